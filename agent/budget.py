@@ -0,0 +1,162 @@
+import math
+import re
+import threading
+
+from config import (TOOL_OUTPUT_TOKENS, TOOL_OUTPUT_TOKEN_LIMITS, TURN_OUTPUT_TOKENS, TOOL_OUTPUT_TAIL_SHARE,
+                    TOKEN_CALIBRATION_MIN_TOKENS)
+from functions.get_files_content import split_budget
+
+# Pieces of text a subword tokenizer usually maps to one token each: short runs of
+# letters, groups of digits, every other symbol
+_PIECES = re.compile(r"[A-Za-z]{1,6}|\d{1,3}|[^\sA-Za-z\d]")
+
+# Room left for the line marking what was cut
+MARKER_TOKENS = 24
+
+
+class TokenEstimator:
+    """
+    Fast local estimate of the number of tokens of a text, calibrated on the real
+    counts reported by the model.
+
+    The raw estimate counts the pieces of text a subword tokenizer usually maps to one
+    token, plus line breaks. calibrate() compares how much the prompt grew between two
+    model calls of a conversation (usage_metadata.prompt_token_count) with how much its
+    raw estimate grew, and keeps a moving average of the ratio to scale every estimate.
+    The estimator is shared by every session of the process.
+    """
+
+    def __init__(self, scale=1.0):
+        self.scale = scale
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def raw(self, text):
+        return len(_PIECES.findall(text)) + text.count("\n")
+
+    def estimate(self, text):
+        if not text:
+            return 0
+        return math.ceil(self.raw(text) * self.scale)
+
+    def calibrate(self, raw_growth, real_growth):
+        """
+        Learn from the growth of a prompt between two model calls.
+
+        Args:
+            raw_growth (int): Growth of the raw estimate of the messages
+            real_growth (int): Growth of the prompt token count reported by the model
+        """
+        # Small or negative growths (compacted conversations) say little about the ratio
+        if raw_growth < TOKEN_CALIBRATION_MIN_TOKENS or real_growth <= 0:
+            return
+        ratio = min(max(real_growth / raw_growth, 0.25), 4.0)
+        with self._lock:
+            self.samples += 1
+            # Running mean of the first samples, then a moving average
+            self.scale += (ratio - self.scale) * max(1 / self.samples, 0.2)
+
+
+estimator = TokenEstimator()
+
+
+def _is_boundary(lines, i):
+    """
+    Whether a cut before line i keeps blocks whole: the line follows a blank line or
+    starts a top-level statement (def, class, decorator...).
+    """
+    if i <= 0 or i >= len(lines):
+        return True
+    line = lines[i]
+    if not lines[i - 1].strip():
+        return True
+    return bool(line.strip()) and line[0] not in " \t)]}"
+
+
+def truncate(text, max_tokens, tail_share=0.25):
+    """
+    Cut a text to about max_tokens estimated tokens, keeping whole lines from its head
+    and its tail with a marker in between.
+
+    Cuts are moved back to the closest block boundary (a blank line, a top-level def or
+    class) within the last quarter of the head or the first quarter of the tail, so
+    functions are not split in the middle when it can be avoided. A single huge line
+    (minified code, data) is cut on characters.
+
+    Args:
+        text (str): The text to cut
+        max_tokens (int): Maximum number of estimated tokens of the result
+        tail_share (float): Part of the budget kept from the end of the text
+
+    Returns:
+        str: The text itself if it fits, else its head, a marker and its tail
+
+    Examples:
+        truncate(output, 2000, tail_share=0.6)
+    """
+    total = estimator.estimate(text)
+    if total <= max_tokens:
+        return text
+    budget = max(max_tokens - MARKER_TOKENS, 0)
+    tail_budget = int(budget * tail_share)
+    head_budget = budget - tail_budget
+
+    lines = text.splitlines(keepends=True)
+    sizes = [estimator.estimate(line) for line in lines]
+    head, used = 0, 0
+    while head < len(lines) and used + sizes[head] <= head_budget:
+        used += sizes[head]
+        head += 1
+    tail, used = len(lines), 0
+    while tail > head and used + sizes[tail - 1] <= tail_budget:
+        tail -= 1
+        used += sizes[tail]
+
+    if head == 0 and tail == len(lines):
+        # Not even one line fits: cut on characters
+        head_chars = len(text) * head_budget // total
+        tail_chars = len(text) * tail_budget // total
+        omitted = len(text) - head_chars - tail_chars
+        return (f"{text[:head_chars]}\n[... {omitted} characters omitted to fit the output budget ...]\n"
+                f"{text[len(text) - tail_chars:] if tail_chars else ''}")
+
+    for i in range(head, head - head // 4 - 1, -1):
+        if _is_boundary(lines, i):
+            head = i
+            break
+    for i in range(tail, tail + (len(lines) - tail) // 4 + 1):
+        if _is_boundary(lines, i):
+            tail = i
+            break
+
+    omitted_tokens = sum(sizes[head:tail])
+    head_text = "".join(lines[:head])
+    if head_text and not head_text.endswith("\n"):
+        head_text += "\n"
+    marker = f"[... {tail - head} lines (~{omitted_tokens} tokens) omitted to fit the output budget ...]\n"
+    return head_text + marker + "".join(lines[tail:])
+
+
+def fit_results(results, turn_tokens=TURN_OUTPUT_TOKENS):
+    """
+    Fit the function results of one turn in the token limits: each result in the
+    limit of its tool, and all of them in turn_tokens. Small results keep their full
+    size and what they leave unused is shared by the larger ones.
+
+    Args:
+        results (list): (function name, result) in the order of the calls
+        turn_tokens (int): Budget shared by the results of the turn
+
+    Returns:
+        list: (function name, result), results over their share truncated
+    """
+    sizes = [estimator.estimate(result) if isinstance(result, str) else 0 for _, result in results]
+    limits = [min(size, TOOL_OUTPUT_TOKEN_LIMITS.get(name, TOOL_OUTPUT_TOKENS))
+              for size, (name, _) in zip(sizes, results)]
+    allowed = split_budget(limits, turn_tokens)
+    fitted = []
+    for (name, result), size, tokens in zip(results, sizes, allowed):
+        if size > tokens:
+            result = truncate(result, tokens, TOOL_OUTPUT_TAIL_SHARE.get(name, 0.25))
+        fitted.append((name, result))
+    return fitted
@@ -0,0 +1,172 @@
+import os
+
+from google.genai import types
+
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_KEEP_RECENT_TURNS, CONTEXT_SUMMARY_CHARS
+from agent.budget import estimator
+from functions.call_function import registry
+from functions.registry import WRITE, ToolArgumentError, is_within
+
+
+def estimate_tokens(text):
+    return estimator.estimate(text)
+
+
+def _part_text(part):
+    if part.text:
+        return part.text
+    if part.function_call:
+        return (part.function_call.name or "") + str(part.function_call.args or {})
+    if part.function_response:
+        return str(part.function_response.response or {})
+    return ""
+
+
+def _part_tokens(part):
+    return estimate_tokens(_part_text(part))
+
+
+def _is_full_read(args):
+    return not any(args.get(k) is not None for k in ("start_line", "end_line", "offset", "limit"))
+
+
+def _replaces(function_call, abs_path):
+    """
+    How a later call made an earlier read of abs_path stale: "read again" (in full),
+    "modified" (a write of that file) or "possibly modified" (a write or a script run
+    whose access covers the whole work_dir), None if it did not.
+
+    Paths come from the access declarations of the tools, resolved against the active
+    workspace like the calls themselves (see Tool.bind).
+    """
+    access = registry.get_call_access(function_call)
+    if access is None:
+        return None
+    mode, path = access
+    if mode == WRITE:
+        if path == abs_path:
+            return "modified"
+        return "possibly modified" if is_within(abs_path, path) else None
+    if function_call.name == "get_file_content":
+        return "read again" if path == abs_path and _is_full_read(function_call.args or {}) else None
+    if function_call.name == "get_files_content":
+        try:
+            kwargs = registry.get(function_call.name).bind(function_call.args)
+        except ToolArgumentError:
+            return None
+        for item in kwargs.get("files") or []:
+            if (isinstance(item, dict) and isinstance(item.get("file_path"), str) and _is_full_read(item)
+                    and os.path.abspath(os.path.join(kwargs["work_dir"], item["file_path"])) == abs_path):
+                return "read again"
+    return None
+
+
+class ContextManager:
+    """
+    Keeps the conversation sent to the model under a token budget.
+
+    When the estimated size of the messages exceeds token_budget, compact() rewrites
+    function results, oldest first, until the conversation fits again:
+
+    1. File reads superseded by a later full read or a write of the same file (or a
+       write or script run that may have changed it) are replaced by a one-line
+       reference.
+    2. Results older than keep_recent_turns turns are cut down to a short summary.
+
+    The last keep_recent_turns turns are never touched.
+    """
+
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, keep_recent_turns=CONTEXT_KEEP_RECENT_TURNS):
+        self.token_budget = token_budget
+        self.keep_recent_turns = keep_recent_turns
+        self.tokens_saved = 0
+        # Raw estimate and real token count of the last prompt, to calibrate the estimator
+        self._last_prompt = None
+
+    def estimate(self, messages):
+        """
+        Estimated number of tokens of a list of types.Content.
+        """
+        return sum(_part_tokens(part) for content in messages for part in (content.parts or []))
+
+    def observe(self, messages, prompt_tokens):
+        """
+        Calibrate the token estimator with the prompt token count the model reported
+        for messages (usage_metadata.prompt_token_count).
+
+        Only the growth since the previous call of the conversation is compared: the
+        count also includes the system prompt and the tool declarations.
+        """
+        raw = sum(estimator.raw(_part_text(part)) for content in messages for part in (content.parts or []))
+        if self._last_prompt is not None:
+            estimator.calibrate(raw - self._last_prompt[0], prompt_tokens - self._last_prompt[1])
+        self._last_prompt = (raw, prompt_tokens)
+
+    def _function_results(self, messages):
+        # (turn, message index, part index, function call) of every function response
+        results = []
+        turn = 0
+        for i, content in enumerate(messages[:-1]):
+            calls = [part.function_call for part in (content.parts or []) if part.function_call]
+            if content.role != "model" or not calls:
+                continue
+            turn += 1
+            response_parts = messages[i + 1].parts or []
+            for j, (call, part) in enumerate(zip(calls, response_parts)):
+                if part.function_response:
+                    results.append((turn, i + 1, j, call))
+        return results, turn
+
+    def compact(self, messages):
+        """
+        Shrink messages in place if they exceed the token budget.
+
+        Returns:
+            int: Estimated number of tokens saved by this compaction
+        """
+        total = self.estimate(messages)
+        if total <= self.token_budget:
+            return 0
+
+        results, last_turn = self._function_results(messages)
+        # Results are in turn order, so the stale ones are a prefix
+        stale = [r for r in results if r[0] <= last_turn - self.keep_recent_turns]
+
+        # Reads of a file that was read again in full or written afterwards
+        superseded = []
+        for index, (turn, i, j, call) in enumerate(stale):
+            if call.name != "get_file_content":
+                continue
+            access = registry.get_call_access(call)
+            if access is None:
+                continue
+            for _, _, _, later in results[index + 1:]:
+                reason = _replaces(later, access[1])
+                if reason is not None:
+                    superseded.append((i, j, f"[Superseded: {call.args.get('file_path', '')} was {reason} later]"))
+                    break
+
+        summaries = []
+        for turn, i, j, call in stale:
+            result = str((messages[i].parts[j].function_response.response or {}).get("result", ""))
+            if len(result) > CONTEXT_SUMMARY_CHARS:
+                head = result[:CONTEXT_SUMMARY_CHARS].rsplit("\n", 1)[0]
+                summaries.append((i, j, f"{head}\n[...{len(result) - len(head)} characters of this old result omitted, call {call.name} again if needed]"))
+
+        saved = 0
+        for i, j, replacement in superseded + summaries:
+            if total - saved <= self.token_budget:
+                break
+            part = messages[i].parts[j]
+            before = _part_tokens(part)
+            new_part = types.Part(function_response=types.FunctionResponse(
+                name=part.function_response.name,
+                response={"result": replacement},
+            ))
+            after = _part_tokens(new_part)
+            if after < before:
+                messages[i].parts[j] = new_part
+                saved += before - after
+
+        self.tokens_saved += saved
+        return saved
@@ -0,0 +1,109 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from config import MAX_PARALLEL_CALLS
+from functions.call_function import call_function, registry
+from functions.registry import READ, WRITE
+from agent.tracing import NULL_TRACER
+
+
+def get_call_access(function_call_part):
+    """
+    Describe which path a function call touches and whether it modifies it.
+
+    Args:
+        function_call_part (types.FunctionCall): The function call requested by the model
+
+    Returns:
+        tuple: (mode, abs_path) where mode is READ or WRITE, or None if the call
+        cannot be analysed and must not overlap with any other call
+    """
+    # Each tool declares its access when it is registered (functions/call_function.py)
+    return registry.get_call_access(function_call_part)
+
+
+def _paths_overlap(a, b):
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+def _conflicts(a, b):
+    if a is None or b is None:
+        return True
+    if a[0] == READ and b[0] == READ:
+        return False
+    return _paths_overlap(a[1], b[1])
+
+
+def _call_after(dependencies, function_call_part, tracer=NULL_TRACER, parent=None):
+    wait(dependencies)
+    with tracer.span("tool.call", parent=parent, tool=function_call_part.name) as span:
+        try:
+            result = call_function(function_call_part)
+        except Exception as e:
+            result = f"Error: {e}"
+        span.set(result_chars=len(result))
+        if result.startswith("Error"):
+            span.error(result[:200])
+        return result
+
+
+class CallDispatcher:
+    """
+    Submits the function calls of one model turn to an executor as they arrive.
+
+    A call waits for every earlier call it conflicts with (a write to an overlapping
+    path, or a call that cannot be analysed), so writes to the same file keep the order
+    the model asked for. Reads never wait for each other.
+    """
+
+    def __init__(self, executor, tracer=NULL_TRACER, parent=None):
+        self.executor = executor
+        self.tracer = tracer
+        self.parent = parent
+        self._accesses = []
+        self._futures = []
+
+    def submit(self, function_call_part):
+        """
+        Schedule a function call after the earlier calls it conflicts with.
+
+        Args:
+            function_call_part (types.FunctionCall): The function call requested by the model
+
+        Returns:
+            concurrent.futures.Future: Resolves to the result string of the call
+        """
+        access = get_call_access(function_call_part)
+        # Dependencies are always submitted earlier, so the FIFO pool never
+        # leaves a waiting call blocking the calls it waits on.
+        dependencies = [
+            future for other, future in zip(self._accesses, self._futures)
+            if _conflicts(access, other)
+        ]
+        # The call sees the workspace of the session that submitted it (server mode)
+        future = self.executor.submit(contextvars.copy_context().run, _call_after, dependencies,
+                                      function_call_part, self.tracer, self.parent)
+        self._accesses.append(access)
+        self._futures.append(future)
+        return future
+
+
+def dispatch_function_calls(function_calls, max_workers=MAX_PARALLEL_CALLS):
+    """
+    Execute the function calls of one model turn, running independent calls concurrently.
+
+    Args:
+        function_calls (list): Function calls from the model response, in order
+        max_workers (int): Maximum number of calls running at the same time
+
+    Returns:
+        list: Results of the calls, in the same order as function_calls
+    """
+    if len(function_calls) <= 1 or max_workers <= 1:
+        return [_call_after([], fc) for fc in function_calls]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        dispatcher = CallDispatcher(executor)
+        futures = [dispatcher.submit(fc) for fc in function_calls]
+        return [future.result() for future in futures]
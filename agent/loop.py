@@ -0,0 +1,257 @@
+import asyncio
+import contextlib
+import functools
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from google.genai import types
+
+from config import get_system_prompt, MAX_PARALLEL_CALLS, MAX_OPEN_WORKSPACES
+from agent.dispatcher import CallDispatcher
+from agent.context import ContextManager
+from agent.tracing import NULL_TRACER
+from agent.session import function_response_message
+from functions.call_function import registry, call_function
+
+
+def build_generate_config():
+    """
+    Build the generation config exposing every available function to the model.
+    The config is built once per system prompt (one per workspace) and shared by the runs
+    of the MAX_OPEN_WORKSPACES most recently used workspaces.
+
+    Returns:
+        types.GenerateContentConfig: Config with tools and system instruction
+    """
+    return _generate_config(get_system_prompt())
+
+
+@functools.lru_cache(maxsize=MAX_OPEN_WORKSPACES)
+def _generate_config(system_prompt):
+    return types.GenerateContentConfig(
+        tools=[registry.tool()],
+        system_instruction=system_prompt,
+    )
+
+
+def _chunk_parts(chunk):
+    if not chunk.candidates or not chunk.candidates[0].content:
+        return []
+    return chunk.candidates[0].content.parts or []
+
+
+async def run_agent(client, model_name, prompt, max_turns=4, verbose=False, config=None, output=None,
+                    context=None, tracer=None, session=None, executor=None, prefetcher=None):
+    """
+    Run the agentic loop on the streaming API until the AI gives a final answer.
+
+    Text is written to output as soon as it streams in, and each function call starts
+    executing as soon as its part has arrived, while the rest of the response is
+    still streaming.
+
+    Args:
+        client (genai.Client): Gemini client (its async `aio` interface is used)
+        model_name (str): Name of the model to call
+        prompt (str): The user prompt
+        max_turns (int): Maximum number of function calling turns
+        verbose (bool): If True, print function calls and their results
+        config (types.GenerateContentConfig, optional): Defaults to build_generate_config()
+        output (file, optional): Where streamed text is written (default: sys.stdout)
+        context (ContextManager, optional): Compacts old function results (default: ContextManager())
+        tracer (Tracer, optional): Records spans of the run, turns, model calls and tools (default: disabled)
+        session (Session, optional): Checkpoint log the conversation is loaded from and
+            appended to after each step, so an interrupted run can be resumed. With a
+            resumed session, prompt may be None to simply continue it.
+        executor (concurrent.futures.Executor, optional): Runs the function calls, shared
+            by the runs of a server (default: a pool of MAX_PARALLEL_CALLS threads for this run)
+        prefetcher (Prefetcher, optional): Loads the files the model will likely read next
+            while the next model call is in flight (default: no prefetch)
+
+    Returns:
+        str: The final text answer of the AI (None if max_turns was reached)
+
+    Examples:
+        answer = asyncio.run(run_agent(client, "gemini-2.5-flash", "what files are in the root?"))
+    """
+    output = output or sys.stdout
+    config = config or build_generate_config()
+    context = context or ContextManager()
+    tracer = tracer or NULL_TRACER
+    messages = list(session.messages) if session is not None else []
+    if session is not None and session.pending:
+        # Interrupted while running function calls: finish them before the next model call
+        messages.append(await _resume_pending_calls(session, verbose))
+    if prompt:
+        messages.append(types.Content(role="user", parts=[types.Part(text=prompt)]))
+        if session is not None:
+            session.append_message(messages[-1])
+            session.checkpoint()
+
+    if executor is None:
+        executor_scope = ThreadPoolExecutor(max_workers=MAX_PARALLEL_CALLS)
+    else:
+        executor_scope = contextlib.nullcontext(executor)
+    with executor_scope as executor, \
+            tracer.span("agent.run", model=model_name, prompt_chars=len(prompt or "")) as run_span:
+        # Agentic loop: Keep calling functions until AI gives final answer
+        for turn in range(max_turns):
+            with tracer.span("agent.turn", parent=run_span, turn=turn + 1) as turn_span:
+                dispatcher = CallDispatcher(executor, tracer, turn_span)
+                answer = await _run_turn(client, model_name, config, messages, context, dispatcher,
+                                         tracer, turn_span, turn + 1, output, verbose, session, prefetcher)
+            if answer is not None:
+                if verbose:
+                    print(f"\n--- Turn {turn + 1}: AI provided final answer ---")
+                run_span.set(turns=turn + 1)
+                return answer
+
+            # Loop continues - AI will decide what to do next
+
+        run_span.set(turns=max_turns)
+        run_span.error("max turns reached")
+
+    # Max turns reached
+    print(f"Warning: Reached maximum number of turns ({max_turns})")
+    return None
+
+
+async def _run_turn(client, model_name, config, messages, context, dispatcher, tracer, turn_span, turn,
+                    output, verbose, session, prefetcher=None):
+    """
+    One model call and the function calls it requests.
+
+    Returns:
+        str: The final answer, or None if the AI called functions (their results are
+        appended to messages)
+    """
+    model_parts = []
+    pending_calls = []
+    text_chunks = []
+
+    # Keep the conversation under the token budget before re-sending it
+    with tracer.span("context.compact", parent=turn_span, messages=len(messages)) as compact_span:
+        saved = context.compact(messages)
+        compact_span.set(tokens_saved=saved)
+    if verbose and saved:
+        print(f"Context compacted: ~{saved} tokens saved")
+
+    with tracer.span("model.generate", parent=turn_span, model=model_name) as model_span:
+        usage = None
+        first_chunk = None
+        stream = await client.aio.models.generate_content_stream(
+            model=model_name,
+            contents=messages,
+            config=config,
+        )
+        async for chunk in stream:
+            if first_chunk is None:
+                first_chunk = model_span.elapsed()
+            # The last chunk carries the token counts of the whole response
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            for part in _chunk_parts(chunk):
+                if part.function_call:
+                    # Start executing right away, the rest keeps streaming meanwhile
+                    if verbose:
+                        print(f"Calling function: {part.function_call.name}({part.function_call.args})")
+                    if prefetcher is not None:
+                        prefetcher.observe(part.function_call)
+                    if session is not None:
+                        # Logged before it runs, so a resumed session knows it may have run
+                        session.append_call(len(pending_calls), part.function_call)
+                        tool = registry.get(part.function_call.name)
+                        if tool is None or tool.side_effects:
+                            session.checkpoint()
+                    future = asyncio.wrap_future(dispatcher.submit(part.function_call))
+                    pending_calls.append((part.function_call, future))
+                    model_parts.append(part)
+                elif part.text and not part.thought:
+                    output.write(part.text)
+                    output.flush()
+                    text_chunks.append(part.text)
+                    # Merge streamed text back into a single part for the history
+                    if model_parts and model_parts[-1].text is not None:
+                        model_parts[-1] = types.Part(text=model_parts[-1].text + part.text)
+                    else:
+                        model_parts.append(types.Part(text=part.text))
+        if getattr(usage, "prompt_token_count", None):
+            context.observe(messages, usage.prompt_token_count)
+        model_span.set(
+            first_chunk_ms=None if first_chunk is None else round(first_chunk * 1000, 3),
+            function_calls=len(pending_calls),
+            text_chars=sum(len(text) for text in text_chunks),
+            prompt_tokens=getattr(usage, "prompt_token_count", None),
+            response_tokens=getattr(usage, "candidates_token_count", None),
+            thoughts_tokens=getattr(usage, "thoughts_token_count", None),
+        )
+
+    if text_chunks:
+        output.write("\n")
+        output.flush()
+
+    if not pending_calls:
+        # No function calls - AI has final answer
+        if session is not None:
+            session.append_message(types.Content(role="model", parts=model_parts))
+            session.checkpoint()
+        return "".join(text_chunks)
+
+    if verbose:
+        print(f"\n--- Turn {turn}: AI called {len(pending_calls)} function(s) ---")
+
+    # Add AI's response (with function calls) to conversation
+    messages.append(types.Content(role="model", parts=model_parts))
+    if session is not None:
+        session.append_message(messages[-1])
+
+    # Results are collected in the order the AI asked for them
+    results = []
+    for index, (function_call_part, future) in enumerate(pending_calls):
+        result = await future
+        if verbose:
+            print(f"Function result:\n{result}\n")
+        if session is not None:
+            session.append_result(index, function_call_part.name, result)
+        results.append((function_call_part.name, result))
+
+    # Add function results to conversation
+    messages.append(function_response_message(results))
+    if prefetcher is not None:
+        # Runs while the next model call is in flight
+        prefetcher.schedule([function_call_part for function_call_part, _ in pending_calls])
+    if session is not None:
+        # Logged as sent: the fitting depends on the estimator calibration of this run
+        session.append_message(messages[-1])
+        session.checkpoint()
+    return None
+
+
+async def _resume_pending_calls(session, verbose):
+    """
+    Results of the function calls a resumed session was interrupted in.
+
+    Logged results are reused. Calls without a result are re-run only if the tool has
+    no side effects: a write or a script may have been applied before the interruption.
+
+    Returns:
+        types.Content: The function response message to append to the history
+    """
+    results = []
+    for index, (function_call_part, result) in enumerate(session.pending):
+        if result is None:
+            tool = registry.get(function_call_part.name)
+            if tool is not None and not tool.side_effects:
+                # Off the event loop, other sessions of a server keep running
+                result = await asyncio.to_thread(call_function, function_call_part)
+            else:
+                result = (f"Error: The session was interrupted while {function_call_part.name} was running. "
+                          f"It was not run again because it may already have changed files; check the "
+                          f"current state before retrying it.")
+            session.append_result(index, function_call_part.name, result)
+        if verbose:
+            print(f"Resumed result of {function_call_part.name}:\n{result}\n")
+        results.append((function_call_part.name, result))
+    message = function_response_message(results)
+    session.pending = []
+    session.append_message(message)
+    session.checkpoint()
+    return message
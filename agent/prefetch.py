@@ -0,0 +1,236 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import PREFETCH_MAX_FILES, PREFETCH_MAX_FILE_BYTES, PREFETCH_LISTING_FILES, PREFETCH_TRACKED_FILES
+from functions.call_function import registry
+from functions.get_file_content import get_file_content
+from functions.get_file_outline import parse_symbols
+from functions.run_tests import parse_test_module, resolve_import
+
+# Tools reading one file, and the argument naming it
+FILE_READS = {"get_file_content": "file_path", "get_file_outline": "file_path", "get_symbol": "file_path"}
+
+
+def read_paths(name, kwargs):
+    """
+    Absolute paths of the files a tool call reads.
+
+    Args:
+        name (str): Name of the tool
+        kwargs (dict): Bound arguments of the call (work_dir resolved)
+
+    Returns:
+        list: Absolute paths, empty for a tool that does not read files
+    """
+    work_dir = kwargs.get("work_dir") or "."
+    if name in FILE_READS:
+        paths = [kwargs.get(FILE_READS[name])]
+    elif name == "get_files_content":
+        paths = [item.get("file_path") for item in kwargs.get("files") or [] if isinstance(item, dict)]
+    else:
+        return []
+    return [os.path.abspath(os.path.join(work_dir, path)) for path in paths if isinstance(path, str) and path]
+
+
+def _test_files(root, abs_path):
+    directory = os.path.dirname(abs_path)
+    stem = os.path.splitext(os.path.basename(abs_path))[0]
+    if stem.startswith("test"):
+        return []
+    directories = [directory, os.path.join(directory, "tests"), os.path.join(root, "tests"), os.path.join(root, "test")]
+    return [os.path.join(d, name) for d in directories for name in (f"test_{stem}.py", f"{stem}_test.py")]
+
+
+def predict_reads(name, kwargs):
+    """
+    Files the model is likely to read after a tool call.
+
+    After a read of a Python file: the workspace modules it imports, the __init__.py
+    of its package and its tests (test_<name>.py or <name>_test.py next to it or in a
+    tests directory). After a directory listing: the PREFETCH_LISTING_FILES of the
+    directory.
+
+    Args:
+        name (str): Name of the tool
+        kwargs (dict): Bound arguments of the call (work_dir resolved)
+
+    Returns:
+        list: Absolute paths of existing workspace files, most likely first
+    """
+    root = os.path.abspath(kwargs.get("work_dir") or ".")
+    read = read_paths(name, kwargs)
+    candidates = []
+    if name == "get_files_info":
+        directory = os.path.abspath(os.path.join(root, kwargs.get("dir") or "."))
+        candidates = [os.path.join(directory, file_name) for file_name in PREFETCH_LISTING_FILES]
+    for path in read:
+        if not path.endswith(".py"):
+            continue
+        try:
+            _, imports = parse_test_module(path)
+        except (OSError, SyntaxError, ValueError):
+            imports = []
+        for module, level, names in imports:
+            candidates += resolve_import(root, os.path.dirname(path), module, level, names)
+        candidates.append(os.path.join(os.path.dirname(path), "__init__.py"))
+        candidates += _test_files(root, path)
+
+    predicted = []
+    for path in candidates:
+        if path not in predicted and path not in read and path.startswith(root + os.sep) and os.path.isfile(path):
+            predicted.append(path)
+    return predicted
+
+
+class Prefetcher:
+    """
+    Loads the files the model is likely to read next into the file cache, on a
+    background thread while the next model call is in flight.
+
+    The files are read with get_file_content (and Python files parsed for
+    get_file_outline), which cache exactly the strings a later call returns, keyed by
+    mtime and size: a prefetch only makes the next reads faster, the model sees the
+    same results and nothing is added to the conversation.
+
+    stats() reports the hit rate (prefetched files the model then read, unchanged)
+    and the coverage (file reads of the model that had been prefetched), to tune the
+    predictions of predict_reads().
+
+    Args:
+        max_files (int): Maximum number of files prefetched after a turn
+        max_file_bytes (int): Larger files are not prefetched
+
+    Examples:
+        prefetcher = Prefetcher()
+        asyncio.run(run_agent(client, model_name, prompt, prefetcher=prefetcher))
+        print(prefetcher.stats())
+    """
+
+    def __init__(self, max_files=PREFETCH_MAX_FILES, max_file_bytes=PREFETCH_MAX_FILE_BYTES):
+        self.max_files = max_files
+        self.max_file_bytes = max_file_bytes
+        self.predicted = 0
+        self.loaded = 0
+        self.hits = 0
+        self.reads = 0
+        self._prefetched = OrderedDict()    # abs_path -> (mtime_ns, size) when loaded, not read yet
+        self._pending = []
+        self._closed = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+
+    @staticmethod
+    def _bind(function_call_part):
+        tool = registry.get(function_call_part.name)
+        if tool is None:
+            return None
+        try:
+            return tool.bind(function_call_part.args)
+        except Exception:
+            return None
+
+    def observe(self, function_call_part):
+        """
+        Count the files a call of the model reads, and the prefetched ones among them.
+        """
+        kwargs = self._bind(function_call_part)
+        if kwargs is None:
+            return
+        for path in read_paths(function_call_part.name, kwargs):
+            with self._lock:
+                self.reads += 1
+                loaded = self._prefetched.pop(path, None)
+            if loaded is None:
+                continue
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                continue
+            # A file changed since it was prefetched is read from disk again
+            if loaded == (stat_result.st_mtime_ns, stat_result.st_size):
+                with self._lock:
+                    self.hits += 1
+
+    def schedule(self, function_calls):
+        """
+        Start prefetching the files likely read after the calls of a turn.
+
+        Args:
+            function_calls (list): The types.FunctionCall of the turn
+        """
+        requests = []
+        for function_call_part in function_calls:
+            kwargs = self._bind(function_call_part)
+            if kwargs is not None:
+                requests.append((function_call_part.name, kwargs))
+        if requests and not self._closed:
+            future = self._executor.submit(self._prefetch, requests)
+            with self._lock:
+                self._pending = [f for f in self._pending if not f.done()] + [future]
+
+    def _prefetch(self, requests):
+        paths = []
+        for name, kwargs in requests:
+            try:
+                paths += [path for path in predict_reads(name, kwargs) if path not in paths]
+            except Exception:
+                continue
+        paths = paths[:self.max_files]
+        with self._lock:
+            self.predicted += len(paths)
+        for path in paths:
+            if self._closed:
+                return
+            with self._lock:
+                if path in self._prefetched:
+                    continue
+            try:
+                stat_result = os.stat(path)
+                if stat_result.st_size > self.max_file_bytes:
+                    continue
+                content = get_file_content(os.path.dirname(path), os.path.basename(path))
+                if content.startswith("Error:"):
+                    continue
+            except OSError:
+                continue
+            if path.endswith((".py", ".pyi")):
+                try:
+                    parse_symbols(path, stat_result)
+                except (OSError, SyntaxError, ValueError):
+                    pass  # get_file_outline reports it
+            with self._lock:
+                self.loaded += 1
+                self._prefetched[path] = (stat_result.st_mtime_ns, stat_result.st_size)
+                while len(self._prefetched) > PREFETCH_TRACKED_FILES:
+                    self._prefetched.popitem(last=False)
+
+    def wait(self, timeout=None):
+        """
+        Block until the scheduled prefetches are done.
+        """
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.result(timeout)
+
+    def stats(self):
+        """
+        Returns:
+            dict: predicted, loaded and read files, hits, hit_rate (hits / loaded) and
+            coverage (hits / reads)
+        """
+        with self._lock:
+            return {
+                "predicted": self.predicted,
+                "loaded": self.loaded,
+                "reads": self.reads,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.loaded, 3) if self.loaded else None,
+                "coverage": round(self.hits / self.reads, 3) if self.reads else None,
+            }
+
+    def close(self):
+        self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+from config import get_workspace_root
+
+from functions.write_file import atomic_write
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+AUTO = "auto"
+MODES = (OFF, RECORD, REPLAY, AUTO)
+
+# Stands for the workspace path in hashed requests
+WORKSPACE_PLACEHOLDER = "<workspace>"
+
+
+class CacheMiss(Exception):
+    pass
+
+
+def _dump(value):
+    if isinstance(value, list):
+        return [_dump(item) for item in value]
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    return value
+
+
+def request_key(model, contents, config=None):
+    """
+    Stable hash of a model request: model name, generation config and messages.
+
+    The absolute path of the active workspace (named in the system prompt) is
+    replaced by a placeholder before hashing, so responses recorded in one checkout
+    are replayed in another one, or in another server workspace. The OS named in the
+    system prompt stays part of the key: the model may answer differently for it.
+    """
+    if isinstance(contents, str):
+        from google.genai import types
+
+        contents = [types.Content(role="user", parts=[types.Part(text=contents)])]
+    request = {"model": model, "config": _dump(config), "contents": _dump(list(contents))}
+    encoded = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    root = get_workspace_root()
+    for path in sorted({root, Path(root).as_posix()}, key=len, reverse=True):
+        # As it appears inside the JSON strings (escaped backslashes on Windows)
+        encoded = encoded.replace(json.dumps(path, ensure_ascii=False)[1:-1], WORKSPACE_PLACEHOLDER)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk store of model responses, one JSON file of response chunks per request.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def load(self, key):
+        """
+        Returns:
+            list: The recorded types.GenerateContentResponse chunks, or None
+        """
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                chunks = json.load(f)["chunks"]
+        except (OSError, ValueError, KeyError):
+            return None
+        from google.genai import types
+
+        return [types.GenerateContentResponse.model_validate(chunk) for chunk in chunks]
+
+    def save(self, key, model, chunks):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, json.dumps({"model": model, "chunks": _dump(chunks)}, ensure_ascii=False))
+
+
+class CachingClient:
+    """
+    Drop-in wrapper of genai.Client that records and replays model responses.
+
+    Only the calls made by the agent are wrapped: models.generate_content and
+    aio.models.generate_content_stream. Modes:
+
+    - record: always call the model and store its response
+    - replay: only serve stored responses, a request never seen raises CacheMiss
+      (client may be None: the cache is an offline, deterministic stand-in model)
+    - auto: serve stored responses, call the model and store the response on a miss
+
+    Examples:
+        client = CachingClient(genai.Client(), ".magnet/responses", mode="auto")
+        offline = CachingClient(None, ".magnet/responses", mode="replay")
+    """
+
+    def __init__(self, client, cache_dir, mode=AUTO):
+        if mode not in (RECORD, REPLAY, AUTO):
+            raise ValueError(f"Invalid cache mode {mode!r}, expected one of record, replay, auto")
+        if client is None and mode != REPLAY:
+            raise ValueError(f"A client is required in {mode} mode")
+        self.client = client
+        self.cache = ResponseCache(cache_dir)
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.models = SimpleNamespace(generate_content=self.generate_content)
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content_stream=self.generate_content_stream))
+
+    def _lookup(self, key):
+        if self.mode == RECORD:
+            return None
+        chunks = self.cache.load(key)
+        if chunks is not None:
+            self.hits += 1
+            return chunks
+        self.misses += 1
+        if self.mode == REPLAY:
+            raise CacheMiss(f"No recorded response for request {key[:12]}")
+        return None
+
+    def generate_content(self, model, contents, config=None):
+        key = request_key(model, contents, config)
+        chunks = self._lookup(key)
+        if chunks is not None:
+            return chunks[0]
+        response = self.client.models.generate_content(model=model, contents=contents, config=config)
+        self.cache.save(key, model, [response])
+        return response
+
+    async def generate_content_stream(self, model, contents, config=None):
+        key = request_key(model, contents, config)
+        chunks = self._lookup(key)
+        if chunks is not None:
+            return self._replay(chunks)
+        stream = await self.client.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+        return self._record(key, model, stream)
+
+    async def _replay(self, chunks):
+        for chunk in chunks:
+            yield chunk
+
+    async def _record(self, key, model, stream):
+        chunks = []
+        async for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        # Only complete responses are stored
+        self.cache.save(key, model, chunks)
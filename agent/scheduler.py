@@ -0,0 +1,266 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from config import (MODEL_REQUESTS_PER_MINUTE, MODEL_BURST, MODEL_MAX_RETRIES, MODEL_RETRY_BASE_SECONDS,
+                    MODEL_RETRY_MAX_SECONDS, MODEL_CALL_DEADLINE)
+
+# HTTP statuses worth retrying: timeout, quota exhausted, server errors
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+RATE_LIMITED = 429
+
+# Priority of the model calls made in the current context (thread or asyncio task):
+# waiting calls with a higher priority are sent first
+_priority = contextvars.ContextVar("model_call_priority", default=0)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def set_priority(priority):
+    """
+    Priority of the model calls of the current context (default: 0, higher goes first).
+    """
+    return _priority.set(priority)
+
+
+def _status(error):
+    status = getattr(error, "code", None) or getattr(error, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error):
+    """
+    Whether a failed model call may succeed if sent again: quota and server errors,
+    timeouts and dropped connections.
+    """
+    if isinstance(error, DeadlineExceeded):
+        return False
+    if _status(error) is not None:
+        return _status(error) in RETRYABLE_STATUS
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # httpx network errors, without importing httpx
+    return any(cls.__name__ == "TransportError" for cls in type(error).__mro__)
+
+
+def retry_after(error):
+    """
+    Delay asked for by the API (RetryInfo of a 429), in seconds, or None.
+    """
+    match = re.search(r"retryDelay'?\"?:\s*'?\"?(\d+(?:\.\d+)?)s", str(getattr(error, "details", None) or ""))
+    return float(match.group(1)) if match else None
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average, with bursts of up to burst requests.
+
+    Args:
+        rate (float): Tokens added per second (0: unlimited)
+        burst (int): Maximum number of tokens saved up
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def take(self):
+        """
+        Take a token if one is available.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one is available
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if not self.rate:
+                return 0.0
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds):
+        """
+        Hand out no token for seconds (the API reported its quota as exhausted).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self.tokens = 0.0
+            self._updated = now + seconds
+
+
+class ModelScheduler:
+    """
+    Wrapper of genai.Client scheduling the model calls of every session of the process.
+
+    - A token bucket limits the request rate to the quota. Waiting calls are queued
+      by priority (set_priority), then in arrival order.
+    - Quota (429), server and network errors are retried with jittered exponential
+      backoff. A 429 also pauses the bucket, so every session backs off together.
+      Only the start of a response is retried: once chunks have been handed out, an
+      error is raised to the caller.
+    - Each call has a deadline covering its wait in the queue, its retries and the
+      streaming of the response, after which DeadlineExceeded is raised.
+
+    Only aio.models.generate_content_stream (the agent loop) is scheduled, models is
+    passed through.
+
+    Args:
+        client (genai.Client): The wrapped client
+        requests_per_minute (float): Average request rate (0: unlimited)
+        burst (int): Requests that may be sent at once after a quiet period
+        max_retries (int): Retries of one call before its error is raised
+        retry_base (float): Backoff before the first retry, doubled at each retry
+        retry_max (float): Maximum backoff
+        deadline (float): Seconds a call may take in total
+
+    Examples:
+        client = ModelScheduler(genai.Client(), requests_per_minute=60)
+        print(client.metrics()["queue_depth"])
+    """
+
+    def __init__(self, client, requests_per_minute=MODEL_REQUESTS_PER_MINUTE, burst=MODEL_BURST,
+                 max_retries=MODEL_MAX_RETRIES, retry_base=MODEL_RETRY_BASE_SECONDS,
+                 retry_max=MODEL_RETRY_MAX_SECONDS, deadline=MODEL_CALL_DEADLINE):
+        self.client = client
+        self.bucket = TokenBucket(requests_per_minute / 60, burst)
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.deadline = deadline
+        self.models = getattr(client, "models", None)
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content_stream=self.generate_content_stream))
+        # Waiting calls: (-priority, arrival, future)
+        self._queue = []
+        self._arrivals = itertools.count()
+        self._wakeup = None
+        self._loop = None
+        self._stats = dict(calls=0, retries=0, rate_limited=0, failures=0, deadline_exceeded=0,
+                           throttled=0, throttle_seconds=0.0, max_queue_depth=0)
+
+    def metrics(self):
+        """
+        Counters to tune the request rate against the quota.
+
+        Returns:
+            dict: calls, retries, rate_limited (429 received), failures (errors raised),
+            deadline_exceeded, throttled (calls that waited for the bucket) and
+            throttle_seconds (their total wait), queue_depth and max_queue_depth
+        """
+        return {**self._stats, "throttle_seconds": round(self._stats["throttle_seconds"], 3),
+                "queue_depth": len(self._queue)}
+
+    async def _within(self, deadline, awaitable):
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining <= 0:
+                if asyncio.iscoroutine(awaitable):
+                    awaitable.close()
+                raise asyncio.TimeoutError
+            return await asyncio.wait_for(awaitable, remaining)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Model call exceeded its deadline of {self.deadline:g}s")
+
+    def _grant(self):
+        """
+        Hand out the available tokens to the waiting calls, highest priority first.
+        """
+        self._wakeup = None
+        self._loop = asyncio.get_running_loop()
+        while self._queue:
+            future = self._queue[0][2]
+            # Gave up at its deadline, or left behind by an event loop that was closed
+            if future.done() or future.get_loop() is not self._loop:
+                heapq.heappop(self._queue)
+                continue
+            delay = self.bucket.take()
+            if delay:
+                self._wakeup = self._loop.call_later(delay, self._grant)
+                return
+            heapq.heappop(self._queue)
+            future.set_result(None)
+
+    async def _acquire(self, deadline):
+        if not self._queue and not self.bucket.take():
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (-_priority.get(), next(self._arrivals), future))
+        self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._queue))
+        self._stats["throttled"] += 1
+        started = time.monotonic()
+        if self._wakeup is None or self._loop is not asyncio.get_running_loop():
+            self._grant()
+        try:
+            await self._within(deadline, future)
+        finally:
+            self._stats["throttle_seconds"] += time.monotonic() - started
+
+    def _backoff(self, retry, error):
+        # Full jitter: concurrent sessions do not retry in lockstep
+        delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** retry))
+        if _status(error) == RATE_LIMITED:
+            self._stats["rate_limited"] += 1
+            delay = max(delay, retry_after(error) or 0)
+            self.bucket.pause(delay)
+        return delay
+
+    async def generate_content_stream(self, model, contents, config=None):
+        self._stats["calls"] += 1
+        deadline = time.monotonic() + self.deadline
+        try:
+            for retry in itertools.count():
+                await self._acquire(deadline)
+                try:
+                    stream = await self._within(deadline, self.client.aio.models.generate_content_stream(
+                        model=model, contents=contents, config=config))
+                    # Errors are often only raised with the first chunk
+                    first = await self._within(deadline, anext(stream, None))
+                    return self._stream(first, stream, deadline)
+                except Exception as e:
+                    if retry >= self.max_retries or not is_retryable(e):
+                        raise
+                    delay = self._backoff(retry, e)
+                    if time.monotonic() + delay >= deadline:
+                        raise DeadlineExceeded(f"Model call exceeded its deadline of {self.deadline:g}s") from e
+                    self._stats["retries"] += 1
+                    await asyncio.sleep(delay)
+        except DeadlineExceeded:
+            self._stats["deadline_exceeded"] += 1
+            self._stats["failures"] += 1
+            raise
+        except Exception:
+            self._stats["failures"] += 1
+            raise
+
+    async def _stream(self, first, stream, deadline):
+        chunk = first
+        while chunk is not None:
+            yield chunk
+            chunk = await self._within(deadline, anext(stream, None))
+
+
+def scheduler_of(client):
+    """
+    The ModelScheduler a client is (or wraps, e.g. in a CachingClient), or None.
+    """
+    while client is not None and not isinstance(client, ModelScheduler):
+        client = getattr(client, "client", None)
+    return client
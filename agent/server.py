@@ -0,0 +1,322 @@
+import asyncio
+import io
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (set_workspace_root, SESSION_DIR, MAX_PARALLEL_CALLS, SERVER_MAX_SESSIONS,
+                    SERVER_MAX_REQUEST_BYTES, SERVER_KEEP_FINISHED_RUNS)
+from agent.loop import run_agent
+from agent.prefetch import Prefetcher
+from agent.scheduler import set_priority, scheduler_of
+from agent.session import Session, SessionError, new_session_id, is_session_id
+from agent.tracing import NULL_TRACER
+from functions import workspace_index, trigram_index
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+MAX_TURNS = "max_turns"
+FAILED = "failed"
+
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Run:
+    """
+    One agent run of the server: a prompt executed in a session of a workspace.
+    """
+
+    def __init__(self, session, workspace, prompt, max_turns, priority=0):
+        self.id = session.id
+        self.session = session
+        self.workspace = workspace
+        self.prompt = prompt
+        self.max_turns = max_turns
+        self.priority = priority
+        self.status = QUEUED
+        self.answer = None
+        self.error = None
+        # Text streamed by the model, as the CLI would print it
+        self.output = io.StringIO()
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.task = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "workspace": self.workspace,
+            "answer": self.answer,
+            "error": self.error,
+            "output": self.output.getvalue(),
+            "queued_seconds": None if self.started is None else round(self.started - self.created, 3),
+            "run_seconds": None if self.finished is None else round(self.finished - self.started, 3),
+        }
+
+
+class AgentServer:
+    """
+    Runs many agent sessions concurrently in one long-lived process, served as a small
+    JSON API over HTTP or a Unix socket.
+
+    Every run shares the Gemini client (and its connection pool), the function call
+    threads and the process-wide caches (file cache, workspace indexes), so a prompt
+    pays neither interpreter start-up nor client construction. Each run has its own
+    workspace under workspaces_dir, the root its tools are confined to, and its own
+    checkpointed session, so it can be resumed like a CLI run.
+
+    Endpoints:
+        POST /runs: {"prompt": ..., "workspace": ..., "max_turns": ..., "resume": ...,
+                     "priority": ..., "wait": ...}
+            workspace is a directory of workspaces_dir (default: a new one per run),
+            resume the id of a session of that workspace to continue, priority orders
+            the model calls waiting for the rate limit (higher first). Returns the run,
+            once finished if wait is true.
+        GET /runs/<id>: Status, answer and streamed output of a run
+        GET /health: Number of runs per status, the model call metrics and the
+            prefetch hit rate
+
+    Args:
+        client (genai.Client): Shared Gemini client (its async `aio` interface is used)
+        model_name (str): Name of the model to call
+        workspaces_dir (str): Directory holding the workspace of every run
+        max_sessions (int): Maximum number of runs executing at the same time, the
+            others wait in order
+        max_turns (int): Default maximum number of function calling turns of a run
+        tracer (Tracer, optional): Records the spans of every run (default: disabled)
+        prefetch (bool): Load the files each run will likely read next while its model
+            call is in flight (one background thread shared by the runs)
+
+    Examples:
+        server = AgentServer(client, "gemini-2.5-flash", "workspaces", max_sessions=16)
+        asyncio.run(server.serve("127.0.0.1:8765"))
+    """
+
+    def __init__(self, client, model_name, workspaces_dir, max_sessions=SERVER_MAX_SESSIONS, max_turns=4,
+                 tracer=None, prefetch=False):
+        self.client = client
+        self.model_name = model_name
+        self.workspaces_dir = os.path.abspath(workspaces_dir)
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.tracer = tracer or NULL_TRACER
+        self.runs = OrderedDict()
+        self._slots = asyncio.Semaphore(max_sessions)
+        # Shared by every run: calls only wait for earlier calls, so a FIFO pool cannot deadlock
+        self.executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_CALLS * max_sessions)
+        self.prefetcher = Prefetcher() if prefetch else None
+
+    def _workspace(self, name, run_id):
+        name = name or run_id
+        # One directory right under workspaces_dir: a run must not see the others
+        if (not isinstance(name, str) or name in ("", ".", "..") or "/" in name or os.sep in name
+                or (os.altsep and os.altsep in name)):
+            raise HTTPError(400, f"Workspace {name} must be the name of a directory of {self.workspaces_dir}")
+        path = os.path.abspath(os.path.join(self.workspaces_dir, name))
+        if os.path.dirname(path) != self.workspaces_dir:
+            raise HTTPError(400, f"Workspace {name} is outside {self.workspaces_dir}")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    async def start(self, request):
+        """
+        Queue a run of the agent.
+
+        Args:
+            request (dict): Body of POST /runs
+
+        Returns:
+            Run: The queued run (finished if request["wait"] is true)
+        """
+        prompt = request.get("prompt")
+        resume = request.get("resume")
+        max_turns = request.get("max_turns", self.max_turns)
+        priority = request.get("priority", 0)
+        if not isinstance(prompt, str) and not resume:
+            raise HTTPError(400, "prompt is required (or resume)")
+        if not isinstance(max_turns, int) or max_turns < 1:
+            raise HTTPError(400, "max_turns must be a positive integer")
+        if not isinstance(priority, int):
+            raise HTTPError(400, "priority must be an integer")
+        if resume is not None and not is_session_id(resume):
+            raise HTTPError(400, f"Invalid session id {resume!r}")
+        if resume:
+            current = self.runs.get(resume)
+            if current is not None and current.status in (QUEUED, RUNNING):
+                raise HTTPError(409, f"Session {resume} is already running")
+            if request.get("workspace") is None:
+                # Resume in the workspace the session ran in
+                request = {**request, "workspace": current.workspace if current else resume}
+
+        run_id = resume or new_session_id()
+        workspace = self._workspace(request.get("workspace"), run_id)
+        session_dir = os.path.join(workspace, SESSION_DIR)
+        try:
+            session = Session.open(session_dir, resume) if resume else Session.create(session_dir, run_id)
+        except SessionError as e:
+            raise HTTPError(404 if resume else 409, str(e))
+
+        run = Run(session, workspace, prompt, max_turns, priority)
+        self.runs[run.id] = run
+        self.runs.move_to_end(run.id)
+        run.task = asyncio.create_task(self._execute(run))
+        if request.get("wait"):
+            await asyncio.shield(run.task)
+        return run
+
+    async def _execute(self, run):
+        async with self._slots:
+            run.status = RUNNING
+            run.started = time.time()
+            # Only this task sees the workspace: tools resolve their work_dir against it
+            set_workspace_root(run.workspace)
+            set_priority(run.priority)
+            try:
+                run.answer = await run_agent(
+                    self.client,
+                    self.model_name,
+                    run.prompt,
+                    max_turns=run.max_turns,
+                    output=run.output,
+                    tracer=self.tracer,
+                    session=run.session,
+                    executor=self.executor,
+                    prefetcher=self.prefetcher,
+                )
+                run.status = DONE if run.answer is not None else MAX_TURNS
+            except Exception as e:
+                run.status = FAILED
+                run.error = str(e)
+            finally:
+                run.session.close()
+                run.finished = time.time()
+                self._release(run.workspace)
+                self._forget_finished()
+
+    def _release(self, workspace):
+        # Indexes of a finished workspace would otherwise stay open for the life of the server
+        if any(run.workspace == workspace and run.finished is None for run in self.runs.values()):
+            return
+        workspace_index.release_workspace(workspace)
+        trigram_index.release_workspace(workspace)
+
+    def _forget_finished(self):
+        finished = [run_id for run_id, run in self.runs.items() if run.finished is not None]
+        for run_id in finished[:max(len(finished) - SERVER_KEEP_FINISHED_RUNS, 0)]:
+            del self.runs[run_id]
+
+    def health(self):
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, MAX_TURNS, FAILED)}
+        for run in self.runs.values():
+            counts[run.status] += 1
+        health = {"status": "ok", "max_sessions": self.max_sessions, "runs": counts}
+        scheduler = scheduler_of(self.client)
+        if scheduler is not None:
+            health["model_calls"] = scheduler.metrics()
+        if self.prefetcher is not None:
+            health["prefetch"] = self.prefetcher.stats()
+        return health
+
+    async def _route(self, method, path, body):
+        if path == "/health":
+            if method != "GET":
+                raise HTTPError(405, f"{method} is not allowed on {path}")
+            return 200, self.health()
+        if path == "/runs":
+            if method != "POST":
+                raise HTTPError(405, f"{method} is not allowed on {path}")
+            try:
+                request = json.loads(body or b"{}")
+            except ValueError:
+                raise HTTPError(400, "The body must be a JSON object")
+            if not isinstance(request, dict):
+                raise HTTPError(400, "The body must be a JSON object")
+            run = await self.start(request)
+            return (200 if run.finished is not None else 202), run.to_dict()
+        if path.startswith("/runs/"):
+            if method != "GET":
+                raise HTTPError(405, f"{method} is not allowed on {path}")
+            run = self.runs.get(path[len("/runs/"):])
+            if run is None:
+                raise HTTPError(404, f"Run {path[len('/runs/'):]} not found")
+            return 200, run.to_dict()
+        raise HTTPError(404, f"Unknown path {path}")
+
+    async def handle(self, reader, writer):
+        """
+        Serve one HTTP/1.1 request on a connection, then close it.
+        """
+        try:
+            try:
+                request_line = (await reader.readline()).decode("latin-1").split()
+                if len(request_line) != 3:
+                    raise HTTPError(400, "Malformed request line")
+                method, path, _ = request_line
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode("latin-1").strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > SERVER_MAX_REQUEST_BYTES:
+                    raise HTTPError(413, f"Request body over {SERVER_MAX_REQUEST_BYTES} bytes")
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self._route(method, path.split("?", 1)[0], body)
+            except HTTPError as e:
+                status, payload = e.status, {"error": str(e)}
+            except (ValueError, asyncio.IncompleteReadError) as e:
+                status, payload = 400, {"error": f"Malformed request: {e}"}
+            except Exception as e:
+                status, payload = 500, {"error": str(e)}
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + data
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass  # The client went away, its run keeps going
+        finally:
+            writer.close()
+
+    async def start_server(self, address):
+        """
+        Listen on address: "host:port", or "unix:/path/to.sock" for a Unix socket.
+
+        Returns:
+            asyncio.Server: The listening server
+        """
+        if address.startswith("unix:"):
+            return await asyncio.start_unix_server(self.handle, path=address[len("unix:"):])
+        host, _, port = address.rpartition(":")
+        return await asyncio.start_server(self.handle, host or "127.0.0.1", int(port))
+
+    async def serve(self, address):
+        """
+        Serve requests on address until cancelled.
+        """
+        server = await self.start_server(address)
+        print(f"Serving agent runs on {address} (max {self.max_sessions} at a time)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False)
+            if self.prefetcher is not None:
+                self.prefetcher.close()
@@ -0,0 +1,179 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from google.genai import types
+
+from agent.budget import fit_results
+
+
+# Format of new_session_id(): session ids name files, nothing else is accepted
+SESSION_ID = re.compile(r"[0-9-]+-[0-9a-f]{6}")
+
+
+class SessionError(Exception):
+    pass
+
+
+def new_session_id():
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def is_session_id(session_id):
+    return isinstance(session_id, str) and SESSION_ID.fullmatch(session_id) is not None
+
+
+class Session:
+    """
+    Append-only checkpoint log of a conversation, one JSON record per line:
+
+    - {"type": "message", "content": ...}: a message of the history (the prompt, a
+      model response, the function results as sent to the model, a final answer)
+    - {"type": "call", "index": i, "call": ...}: the i-th function call of the response
+      being streamed, logged before it starts running (the response itself is logged
+      once it has streamed in full)
+    - {"type": "result", "index": i, "name": ..., "result": ...}: the raw result of
+      the i-th function call of the last model response, logged as soon as it is known
+
+    Only new records are written after each step, so a checkpoint costs O(new turn).
+    The function response message is logged as it was sent, fitted in the token
+    budgets of that run (agent/budget.py), so a resumed session replays exactly what
+    the model saw. If the run stopped before sending it, it is rebuilt from the
+    logged results.
+
+    Examples:
+        session = Session.create(".magnet/sessions")
+        session = Session.open(".magnet/sessions", "20250101-120000-a1b2c3")
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.id = os.path.splitext(os.path.basename(path))[0]
+        self.messages = []
+        # Function calls of the last model response, with their logged result or None
+        self.pending = []
+        # Calls of a response that was still streaming
+        self._streamed = []
+        self._lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def create(cls, session_dir, session_id=None):
+        if session_id is not None and not is_session_id(session_id):
+            raise SessionError(f"Invalid session id {session_id!r}")
+        os.makedirs(session_dir, exist_ok=True)
+        session = cls(os.path.join(session_dir, f"{session_id or new_session_id()}.jsonl"))
+        if os.path.exists(session.path):
+            raise SessionError(f"Session {session.id} already exists")
+        return session
+
+    @classmethod
+    def open(cls, session_dir, session_id):
+        if not is_session_id(session_id):
+            raise SessionError(f"Invalid session id {session_id!r}")
+        session = cls(os.path.join(session_dir, f"{session_id}.jsonl"))
+        if not os.path.isfile(session.path):
+            raise SessionError(f"Session {session_id} not found in {session_dir}")
+        session._load()
+        return session
+
+    def _load(self):
+        with open(self.path, encoding="utf-8", newline="") as f:
+            lines = f.readlines()
+        size = 0
+        for number, line in enumerate(lines, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if number == len(lines):
+                    # Last record cut short by a crash: drop it so new records start on a clean line
+                    os.truncate(self.path, size)
+                    break
+                raise SessionError(f"Corrupted record at line {number} of {self.path}")
+            if not line.endswith("\n"):
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n")
+            size += len(line.encode("utf-8"))
+            if record["type"] == "message":
+                content = types.Content.model_validate(record["content"])
+                if self.pending and content.role == "user" and any(
+                        part.function_response for part in content.parts or []):
+                    # The results of the pending calls, as they were sent
+                    self.pending = []
+                else:
+                    self._close_pending()
+                self.messages.append(content)
+                calls = [part.function_call for part in (content.parts or []) if part.function_call]
+                if content.role == "model":
+                    self._streamed = []
+                    if calls:
+                        self.pending = [[call, None] for call in calls]
+            elif record["type"] == "call":
+                self._streamed.append(types.FunctionCall.model_validate(record["call"]))
+            elif record["type"] == "result" and record["index"] < len(self.pending):
+                self.pending[record["index"]][1] = record["result"]
+        self._close_pending()
+        if self._streamed:
+            # Interrupted while the response was streaming: its calls may have started.
+            # The response is logged with the calls it had, for the next loads.
+            content = types.Content(role="model", parts=[types.Part(function_call=call) for call in self._streamed])
+            self.messages.append(content)
+            self.pending = [[call, None] for call in self._streamed]
+            self._streamed = []
+            self.append_message(content)
+
+    def _close_pending(self):
+        # Every call of the last model response has its result: rebuild the response message
+        if self.pending and all(result is not None for _, result in self.pending):
+            self.messages.append(function_response_message([
+                (call.name, result) for call, result in self.pending
+            ]))
+            self.pending = []
+
+    def _append(self, record):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._file.flush()
+
+    def append_message(self, content):
+        self._append({"type": "message", "content": content.model_dump(mode="json", exclude_none=True)})
+
+    def append_call(self, index, function_call):
+        self._append({"type": "call", "index": index,
+                      "call": function_call.model_dump(mode="json", exclude_none=True)})
+
+    def append_result(self, index, name, result):
+        self._append({"type": "result", "index": index, "name": name, "result": result})
+
+    def checkpoint(self):
+        """
+        Make the records written so far durable (end of a turn).
+        """
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def function_response_message(results):
+    """
+    The user message carrying function results back to the model, each result fitted
+    in the token limits of its tool and of the turn (agent/budget.py).
+
+    Args:
+        results (list): (function name, result) in the order of the calls
+    """
+    return types.Content(role="user", parts=[
+        types.Part(function_response=types.FunctionResponse(name=name, response={"result": result}))
+        for name, result in fit_results(results)
+    ])
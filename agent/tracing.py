@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+import time
+
+
+class Span:
+    """
+    A timed operation of an agent run, exported as one JSON line when it ends.
+
+    The fields follow OpenTelemetry spans: trace_id is shared by every span of a
+    run, parent_id links a span to the one it belongs to (run > turn > model / tool).
+    """
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.status = "ok"
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def error(self, message):
+        self.status = "error"
+        self.attributes["error"] = str(message)
+
+    def elapsed(self):
+        return time.perf_counter() - self._started
+
+    def end(self):
+        if self.duration is None:
+            self.duration = self.elapsed()
+            self.tracer._export(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error(f"{exc_type.__name__}: {exc}")
+        self.end()
+        return False
+
+
+class _NullSpan:
+    """
+    Span of a disabled tracer: every method does nothing.
+    """
+    trace_id = span_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def error(self, message):
+        pass
+
+    def elapsed(self):
+        return 0.0
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Records spans of agent runs and aggregates them into metrics.
+
+    Spans are appended as JSON lines to path (if given). A disabled tracer hands out
+    NULL_SPAN, so instrumented code costs one attribute check per span.
+
+    Examples:
+        tracer = Tracer("trace.jsonl")
+        with tracer.span("tool.call", parent=turn_span, tool="get_file_content") as span:
+            span.set(result_chars=len(result))
+    """
+
+    def __init__(self, path=None, enabled=True):
+        self.enabled = enabled
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def span(self, name, parent=None, **attributes):
+        """
+        Start a span. Use it as a context manager, or call end() on it.
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, parent, attributes)
+
+    def _export(self, span):
+        key = span.name if span.name != "tool.call" else f"tool.call {span.attributes.get('tool')}"
+        with self._lock:
+            metric = self._metrics.setdefault(key, {"count": 0, "seconds": 0.0, "errors": 0})
+            metric["count"] += 1
+            metric["seconds"] += span.duration
+            metric["errors"] += span.status == "error"
+            for counter in ("prompt_tokens", "response_tokens"):
+                if span.attributes.get(counter):
+                    metric[counter] = metric.get(counter, 0) + span.attributes[counter]
+            if self.path is None:
+                return
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps({
+                "trace_id": span.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "name": span.name,
+                "start_time": span.start_time,
+                "duration_ms": round(span.duration * 1000, 3),
+                "status": span.status,
+                "attributes": span.attributes,
+            }, default=str) + "\n")
+            self._file.flush()
+
+    def metrics(self):
+        """
+        Returns:
+            dict: Per span name (tool spans per tool): count, seconds, errors and tokens
+        """
+        with self._lock:
+            return {key: dict(metric) for key, metric in self._metrics.items()}
+
+    def summary(self):
+        """
+        Human-readable table of the metrics, slowest first.
+        """
+        lines = []
+        for key, metric in sorted(self.metrics().items(), key=lambda item: -item[1]["seconds"]):
+            line = f"{key}: {metric['count']} x, {metric['seconds'] * 1000:.1f} ms"
+            if metric["errors"]:
+                line += f", {metric['errors']} errors"
+            if "prompt_tokens" in metric or "response_tokens" in metric:
+                line += f", {metric.get('prompt_tokens', 0)} prompt / {metric.get('response_tokens', 0)} response tokens"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+NULL_TRACER = Tracer(enabled=False)
@@ -0,0 +1,296 @@
+"""
+End-to-end benchmark of the agent loop against a scripted local model.
+
+main() is driven with a fake client that replays a realistic tool-call trace (list,
+search, read, edit, run) over a synthetic repository of N files, so the numbers
+measure the agent itself: no network, no API key, same calls on every run.
+
+Usage:
+    python benchmark.py --files 200 --runs 5 --output bench.json
+    python benchmark.py --files 200 --runs 5 --compare bench.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from google.genai import types
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import main as magnet_main
+from agent import dispatcher
+
+# Metrics where a larger value is a regression, compared by --compare (medians of the
+# runs, and the peak RSS of the whole benchmark process)
+COMPARED_METRICS = ("wall_seconds", "model_seconds", "tool_seconds", "bytes_sent")
+
+
+def make_synthetic_repo(root, n_files):
+    """
+    Create a Python project of n_files modules under root: pkg/module_<i>.py, each
+    importing the previous one, and a main.py running them.
+    """
+    pkg = os.path.join(root, "pkg")
+    os.makedirs(pkg)
+    with open(os.path.join(pkg, "__init__.py"), "w") as f:
+        f.write("")
+    for i in range(n_files):
+        lines = [f'"""Synthetic module {i}."""\n']
+        if i:
+            lines.append(f"from pkg.module_{i - 1} import compute_{i - 1}\n")
+        lines.append("\n\n")
+        for j in range(10):
+            lines.append(f"def helper_{i}_{j}(value):\n")
+            lines.append(f"    # Scale the value by {j}\n")
+            lines.append(f"    return value * {j} + {i}\n\n\n")
+        previous = f"compute_{i - 1}(value)" if i else "value"
+        lines.append(f"def compute_{i}(value):\n")
+        lines.append(f"    return helper_{i}_1({previous})\n")
+        with open(os.path.join(pkg, f"module_{i}.py"), "w") as f:
+            f.write("".join(lines))
+    last = n_files - 1
+    with open(os.path.join(root, "main.py"), "w") as f:
+        f.write(f"import sys\nsys.setrecursionlimit(10000)\nfrom pkg.module_{last} import compute_{last}\n\n"
+                f"print(compute_{last}(1))\n")
+
+
+def make_trace(n_files):
+    """
+    Tool calls of each model turn, followed by the final answer.
+    """
+    target = n_files // 2
+    reads = sorted({0, target, n_files - 1})
+    patch = (f"pkg/module_{target}.py\n<<<<<<< SEARCH\n"
+             f"def compute_{target}(value):\n=======\n"
+             f"def compute_{target}(value):\n    # Entry point of module {target}\n>>>>>>> REPLACE\n")
+    turns = [
+        [("get_files_info", {"work_dir": ".", "recursive": True, "pattern": "*.py"})],
+        [("find_files", {"work_dir": ".", "pattern": "main.py"}),
+         ("search_code", {"work_dir": ".", "query": f"def compute_{target}"})],
+        [("get_files_content", {"work_dir": ".", "files": ["main.py"] + [f"pkg/module_{i}.py" for i in reads]})],
+        [("get_file_content", {"work_dir": ".", "file_path": f"pkg/module_{target}.py", "start_line": 30,
+                               "end_line": 40})],
+        [("apply_patch", {"work_dir": ".", "patch": patch})],
+        [("run_python_file", {"work_dir": ".", "file_path": "main.py"})],
+    ]
+    return turns, f"Added a comment to compute_{target} and checked that main.py still runs."
+
+
+def _request_bytes(contents, config):
+    size = sum(len(content.model_dump_json(exclude_none=True)) for content in contents)
+    if config is not None:
+        size += len(config.model_dump_json(exclude_none=True))
+    return size
+
+
+class ScriptedModel:
+    """
+    Stand-in for genai.Client: replays a trace on aio.models.generate_content_stream
+    and measures the time and bytes of every request.
+    """
+
+    def __init__(self, turns, answer, latency=0.0):
+        self.turns = list(turns)
+        self.answer = answer
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        self.model_seconds = 0.0
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content_stream=self.generate_content_stream))
+
+    async def generate_content_stream(self, model, contents, config=None):
+        started = time.perf_counter()
+        self.requests += 1
+        self.bytes_sent += _request_bytes(contents, config)
+        calls = self.turns.pop(0) if self.turns else []
+        if calls:
+            parts = [types.Part(function_call=types.FunctionCall(name=name, args=args)) for name, args in calls]
+        else:
+            parts = [types.Part(text=word) for word in re.findall(r"\S+\s*", self.answer)]
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.model_seconds += time.perf_counter() - started
+        return self._stream(parts)
+
+    async def _stream(self, parts):
+        for part in parts:
+            started = time.perf_counter()
+            yield types.GenerateContentResponse(candidates=[
+                types.Candidate(content=types.Content(role="model", parts=[part]))
+            ])
+            # Time spent by the loop between chunks is not model time
+            self.model_seconds += time.perf_counter() - started
+
+
+def _busy_seconds(intervals):
+    # Tool calls of one turn run in parallel: count the time any of them is running
+    busy = 0.0
+    end = float("-inf")
+    for start, stop in sorted(intervals):
+        if stop > end:
+            busy += stop - max(start, end)
+            end = stop
+    return busy
+
+
+def _peak_rss_kb():
+    # High-water mark of the whole process: it only grows from run to run, so it is
+    # reported once for the benchmark, not per run
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_once(n_files, latency=0.0):
+    """
+    Run main() once on a fresh synthetic repository.
+
+    Returns:
+        dict: turns, wall/model/tool seconds and bytes sent
+    """
+    turns, answer = make_trace(n_files)
+    model = ScriptedModel(turns, answer, latency)
+    tool_intervals = []
+    tool_errors = []
+    call_function = dispatcher.call_function
+
+    def timed_call_function(function_call_part):
+        started = time.perf_counter()
+        try:
+            result = call_function(function_call_part)
+        finally:
+            tool_intervals.append((started, time.perf_counter()))
+        if str(result).startswith("Error"):
+            tool_errors.append(f"{function_call_part.name}: {result}")
+        return result
+
+    cwd = os.getcwd()
+    create_client = magnet_main.create_client
+    argv = sys.argv
+    with tempfile.TemporaryDirectory() as root:
+        make_synthetic_repo(root, n_files)
+        os.chdir(root)
+        magnet_main.create_client = lambda cache_mode: model
+        dispatcher.call_function = timed_call_function
+        sys.argv = ["main.py", "-p", "add a comment to the compute function of the middle module",
+                    "--max-turns", str(len(turns) + 1)]
+        output = io.StringIO()
+        started = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(output):
+                magnet_main.main()
+        except SystemExit:
+            pass
+        finally:
+            wall_seconds = time.perf_counter() - started
+            sys.argv = argv
+            dispatcher.call_function = call_function
+            magnet_main.create_client = create_client
+            os.chdir(cwd)
+
+    if tool_errors or answer not in output.getvalue():
+        raise RuntimeError("The agent did not finish the scripted task:\n" + "\n".join(tool_errors)
+                           + output.getvalue())
+    tool_seconds = _busy_seconds(tool_intervals)
+    return {
+        "turns": model.requests,
+        "tool_calls": len(tool_intervals),
+        "wall_seconds": wall_seconds,
+        "model_seconds": model.model_seconds,
+        "tool_seconds": tool_seconds,
+        "loop_seconds": max(wall_seconds - model.model_seconds - tool_seconds, 0.0),
+        "bytes_sent": model.bytes_sent,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(n_files, runs, latency=0.0):
+    """
+    Run the benchmark runs times. The first run starts with cold caches and indexes.
+
+    Returns:
+        dict: Environment, parameters, every run, the median of each metric and the
+        peak RSS of the process over all the runs
+    """
+    results = [run_once(n_files, latency) for _ in range(runs)]
+    median = {key: statistics.median(r[key] for r in results) for key in results[0]}
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "files": n_files,
+        "model_latency": latency,
+        "runs": results,
+        "median": median,
+        "peak_rss_kb": _peak_rss_kb(),
+    }
+
+
+def compare(report, baseline):
+    """
+    Lines comparing the median metrics of report with those of baseline.
+    """
+    lines = [f"Compared with {baseline.get('commit') or 'baseline'} ({baseline.get('files')} files):"]
+    for key in COMPARED_METRICS:
+        old, new = baseline.get("median", {}).get(key), report["median"].get(key)
+        if not old or new is None:
+            continue
+        lines.append(f"  {key}: {old:.4g} -> {new:.4g} ({(new - old) / old:+.1%})")
+    old, new = baseline.get("peak_rss_kb"), report.get("peak_rss_kb")
+    if old and new is not None:
+        lines.append(f"  peak_rss_kb: {old:.4g} -> {new:.4g} ({(new - old) / old:+.1%})")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agent loop against a scripted local model")
+    parser.add_argument("--files", type=int, default=100, help="Number of modules of the synthetic repository")
+    parser.add_argument("--runs", type=int, default=3, help="Number of runs (the first one is cold)")
+    parser.add_argument("--model-latency", type=float, default=0.0, help="Simulated seconds per model request")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.files, args.runs, args.model_latency)
+    median = report["median"]
+    print(f"{args.files} files, {args.runs} runs, median of {median['turns']:.0f} turns / "
+          f"{median['tool_calls']:.0f} tool calls:")
+    print(f"  wall {median['wall_seconds'] * 1000:.1f} ms = model {median['model_seconds'] * 1000:.1f} ms"
+          f" + tools {median['tool_seconds'] * 1000:.1f} ms + loop {median['loop_seconds'] * 1000:.1f} ms")
+    print(f"  bytes sent {median['bytes_sent']:.0f}")
+    if report["peak_rss_kb"] is not None:
+        print(f"  peak RSS of the process {report['peak_rss_kb']:.0f} KB (all runs)")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(report, json.load(f))))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import contextvars
+import functools
 import os
 from pathlib import Path
 import platform
@@ -5,11 +7,33 @@ import platform
 
 # HELPERS ( TODO: move to a separate file laterr)
 
+# Workspace of the running session in server mode (each asyncio task has its own)
+_workspace_root = contextvars.ContextVar("workspace_root", default=None)
+
+
+def get_workspace_root():
+    """
+    Returns the absolute path of the active workspace: the one of the current session
+    in server mode, the current directory otherwise.
+    """
+    return _workspace_root.get() or os.getcwd()
+
+
+def set_workspace_root(path):
+    """
+    Make path the active workspace of the current context (thread or asyncio task).
+
+    Returns:
+        contextvars.Token: To restore the previous workspace with _workspace_root.reset
+    """
+    return _workspace_root.set(os.path.abspath(path))
+
+
 def get_workspace_context():
     """
     Scans the current environment to build the context string.
     """
-    current_uri = os.getcwd()
+    current_uri = get_workspace_root()
     corpus_name = Path(current_uri).as_posix()
     context_block = (
         f"The user has 1 active workspace, each defined by a URI and a CorpusName.\n"
@@ -24,7 +48,109 @@ def get_workspace_context():
 
 MAX_CHARS = 10000
 
-SYSTEM_PROMPT = f"""
+# Character budget shared by the files of one get_files_content call
+BATCH_READ_MAX_CHARS = 30000
+
+# Maximum number of entries returned by get_files_info
+MAX_LIST_ENTRIES = 500
+
+# Maximum number of function calls from one turn executed at the same time
+MAX_PARALLEL_CALLS = 8
+
+# Memory budget of the process-wide file read cache
+FILE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Speculative prefetch of the files the model is likely to read next (agent/prefetch.py)
+PREFETCH_ENABLED = os.getenv("MAGNET_PREFETCH", "0") == "1"
+PREFETCH_MAX_FILES = 8
+PREFETCH_MAX_FILE_BYTES = 256 * 1024
+# Files of a listed directory worth prefetching
+PREFETCH_LISTING_FILES = ("__init__.py", "README.md", "main.py", "pyproject.toml", "setup.py")
+# Prefetched files remembered for the hit rate until the model reads them
+PREFETCH_TRACKED_FILES = 256
+
+# Persistent workspace index, stored inside the indexed workspace
+WORKSPACE_INDEX_DIR = ".magnet"
+INDEX_HASH_MAX_BYTES = 16 * 1024 * 1024
+# A refresh commits its progress at least this often, so an interrupted scan resumes
+INDEX_COMMIT_SECONDS = 1.0
+# find_files, search_code and run_tests see the changes made by editors or other
+# programs at most this late (the agent's own writes and scripts are seen at once)
+INDEX_REFRESH_SECONDS = 2.0
+# Workspaces whose indexes, system prompt and tool config are kept in memory, least
+# recently used closed first (a server creates one workspace per run)
+MAX_OPEN_WORKSPACES = int(os.getenv("MAGNET_MAX_OPEN_WORKSPACES", "16"))
+MAX_FIND_RESULTS = 200
+
+# Code search (files larger than this are not indexed)
+SEARCH_MAX_FILE_BYTES = 1024 * 1024
+MAX_SEARCH_RESULTS = 100
+
+# Output of run_python_file kept in memory and returned (head + tail)
+RUN_OUTPUT_MAX_BYTES = 16 * 1024
+
+# run_tests: timeout of one shard, lines kept from the end of each failing traceback,
+# and the last passing run of each test module (content hash of its dependencies)
+TEST_TIMEOUT = 300
+TEST_TRACEBACK_LINES = 25
+TEST_RESULTS_FILE = os.path.join(WORKSPACE_INDEX_DIR, "test_results.json")
+
+# Optional pool of warm interpreters for run_python_file (POSIX only, 0 disables it)
+PYTHON_WORKER_POOL_SIZE = int(os.getenv("MAGNET_WORKER_POOL_SIZE", "0"))
+PYTHON_WORKER_PRELOAD = [m for m in os.getenv("MAGNET_WORKER_PRELOAD", "").split(",") if m]
+
+# Conversation compaction: old function results are shortened above this budget
+CONTEXT_TOKEN_BUDGET = 60000
+CONTEXT_KEEP_RECENT_TURNS = 2
+CONTEXT_SUMMARY_CHARS = 300
+
+# Function results sent to the model, in estimated tokens (see agent/budget.py): a
+# limit per result, by tool, and a budget shared by the results of one turn
+TOOL_OUTPUT_TOKENS = 6000
+TOOL_OUTPUT_TOKEN_LIMITS = {
+    "get_file_content": 4000,
+    "get_files_content": 10000,
+    "get_files_info": 3000,
+    "find_files": 2000,
+    "search_code": 3000,
+}
+TURN_OUTPUT_TOKENS = 20000
+# Part of a truncated result kept from its end (errors and tracebacks end the output of a script)
+TOOL_OUTPUT_TAIL_SHARE = {"run_python_file": 0.6}
+# Smallest prompt growth between two model calls used to calibrate the token estimator
+TOKEN_CALIBRATION_MIN_TOKENS = 200
+
+# Model response cache: off, record, replay or auto (see agent/response_cache.py)
+RESPONSE_CACHE_MODE = os.getenv("MAGNET_RESPONSE_CACHE", "off")
+RESPONSE_CACHE_DIR = os.getenv("MAGNET_RESPONSE_CACHE_DIR", os.path.join(WORKSPACE_INDEX_DIR, "responses"))
+
+# Append-only conversation checkpoints, one file per session (see agent/session.py)
+SESSION_DIR = os.getenv("MAGNET_SESSION_DIR", os.path.join(WORKSPACE_INDEX_DIR, "sessions"))
+
+# Server mode (python main.py --serve): agent runs executed at the same time, and
+# subprocesses started by tools at the same time across every run (0: unlimited)
+SERVER_MAX_SESSIONS = int(os.getenv("MAGNET_MAX_SESSIONS", "8"))
+MAX_TOOL_SUBPROCESSES = int(os.getenv("MAGNET_MAX_SUBPROCESSES", "0"))
+SERVER_MAX_REQUEST_BYTES = 1024 * 1024
+# Finished runs kept in memory for GET /runs/<id>
+SERVER_KEEP_FINISHED_RUNS = 1000
+
+# Model call scheduler (see agent/scheduler.py): requests per minute shared by every
+# session of the process (0: unlimited) with bursts of MODEL_BURST, retries of
+# transient errors with jittered exponential backoff, and a deadline per call
+MODEL_REQUESTS_PER_MINUTE = float(os.getenv("MAGNET_MODEL_RPM", "0"))
+MODEL_BURST = int(os.getenv("MAGNET_MODEL_BURST", "4"))
+MODEL_MAX_RETRIES = int(os.getenv("MAGNET_MODEL_MAX_RETRIES", "5"))
+MODEL_RETRY_BASE_SECONDS = 1.0
+MODEL_RETRY_MAX_SECONDS = 60.0
+MODEL_CALL_DEADLINE = float(os.getenv("MAGNET_MODEL_DEADLINE", "600"))
+
+# JSON lines trace of every run (spans of turns, model calls and tools), disabled if unset
+TRACE_FILE = os.getenv("MAGNET_TRACE_FILE")
+
+@functools.lru_cache(maxsize=MAX_OPEN_WORKSPACES)
+def _build_system_prompt(workspace_root):
+    return f"""
 <identity>
 You are a helpful AI coding agent.
 </identity>
@@ -33,16 +159,38 @@ You are a helpful AI coding agent.
 When a user asks a question or makes a request, make a function call plan. You can perform the following actions:
 
 - List files and directories in the working directory.
-- Read the content of a file.
-- Write to a file (overwriting or updating based on arguments provided).
+- Read the content of a file, or of several files at once.
+- Get the outline of a Python file (classes, functions and their line ranges) or the source of one of its symbols.
+- Write to a file (overwriting or updating based on arguments provided), or change several files as one transaction.
+- Apply a unified diff or search/replace blocks to existing files.
 - Run a Python file (with optional arguments).
+- Run the tests of the workspace and get a summary of the failures.
+- Find files by name or glob pattern in the workspace index.
+- Search the code of the workspace for a string or regular expression.
 </instructions>
 
 <user_information>
 The USERS's OS version is {platform.system()}
 {get_workspace_context()}
 You are not allowed to access files not in active workspaces.
-You can only make one function call at a time.
+You can make several function calls in one turn: independent calls run in parallel, so batch them instead of making one call per turn.
+To read several related files, prefer one get_files_content call over several get_file_content calls.
+To go to a definition in a Python file, prefer get_file_outline and get_symbol over reading the whole file.
+To change part of an existing file, prefer apply_patch over rewriting the whole file with write_file.
 All paths you provide should be relative to the working directory.
 </user_information>
-"""
\ No newline at end of file
+"""
+
+
+def get_system_prompt():
+    """
+    The system prompt for the active workspace, built on first use.
+    """
+    return _build_system_prompt(get_workspace_root())
+
+
+def __getattr__(name):
+    # SYSTEM_PROMPT used to be computed at import time, it is now built on first access
+    if name == "SYSTEM_PROMPT":
+        return get_system_prompt()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
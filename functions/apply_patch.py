@@ -0,0 +1,350 @@
+import difflib
+import os
+import re
+from functions.write_file import write_files
+from functions.registry import is_within
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+SEARCH_MARKER = re.compile(r"^<{5,9} SEARCH\s*$")
+DIVIDER_MARKER = re.compile(r"^={5,9}\s*$")
+REPLACE_MARKER = re.compile(r"^>{5,9} REPLACE\s*$")
+
+# Increasingly tolerant ways of comparing a line of a hunk with a line of the file
+MATCH_LEVELS = (
+    ("exact", lambda line: line),
+    ("ignoring trailing whitespace", lambda line: line.rstrip()),
+    ("ignoring indentation", lambda line: line.strip()),
+)
+IGNORING_INDENTATION = 2
+
+
+class PatchError(Exception):
+    pass
+
+
+class Hunk:
+    """
+    One change of a patch: old_lines are replaced with new_lines.
+
+    hint is the 0-indexed line where old_lines are expected (from the @@ header of a
+    unified diff), or None if the hunk may be anywhere in the file.
+    """
+
+    def __init__(self, old_lines, new_lines, hint=None):
+        self.old_lines = old_lines
+        self.new_lines = new_lines
+        self.hint = hint
+
+
+class LineMatcher:
+    """
+    Locates hunks in the lines of a file.
+
+    Each line is hashed once per match level into a dict of line -> positions, so a
+    hunk is located from the positions of its rarest line instead of comparing it at
+    every offset of the file.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self._indexes = {}
+
+    def _index(self, level):
+        if level not in self._indexes:
+            normalize = MATCH_LEVELS[level][1]
+            keys = [normalize(line) for line in self.lines]
+            positions = {}
+            for i, key in enumerate(keys):
+                positions.setdefault(key, []).append(i)
+            self._indexes[level] = (keys, positions)
+        return self._indexes[level]
+
+    def find(self, old_lines, hint=None):
+        """
+        Find old_lines in the file, trying each match level in turn.
+
+        Returns:
+            tuple: (start, level) of the match closest to hint
+
+        Raises:
+            PatchError: If old_lines is not found, or found at several places without a hint
+        """
+        for level, (_, normalize) in enumerate(MATCH_LEVELS):
+            keys, positions = self._index(level)
+            needle = [normalize(line) for line in old_lines]
+            # Anchor on the least frequent line of the hunk
+            anchor = min(range(len(needle)), key=lambda k: len(positions.get(needle[k], ())))
+            starts = [
+                p - anchor for p in positions.get(needle[anchor], ())
+                if p >= anchor and keys[p - anchor:p - anchor + len(needle)] == needle
+            ]
+            if not starts:
+                continue
+            if hint is not None:
+                return min(starts, key=lambda s: abs(s - hint)), level
+            if len(starts) > 1:
+                raise PatchError(f"matches {len(starts)} places (lines {', '.join(str(s + 1) for s in starts[:5])}), "
+                                 f"add surrounding lines to make it unique")
+            return starts[0], level
+        raise PatchError("not found")
+
+    def replace(self, start, count, new_lines):
+        self.lines[start:start + count] = new_lines
+        self._indexes.clear()
+
+
+def _strip_diff_path(path):
+    path = path.split("\t")[0].strip()
+    if path != "/dev/null" and path[:2] in ("a/", "b/"):
+        path = path[2:]
+    return path
+
+
+def parse_unified_diff(patch):
+    """
+    Parse a unified diff (as produced by `diff -u` or `git diff`).
+
+    Line counts of the @@ headers are not trusted, a hunk ends at the next header.
+
+    Returns:
+        list: (file_path, hunks, is_new_file) for each file of the diff
+    """
+    files = []
+    hunks = None
+    lines = patch.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            old_path = _strip_diff_path(line[4:])
+            new_path = _strip_diff_path(lines[i + 1][4:])
+            if new_path == "/dev/null":
+                raise PatchError(f"Deleting files is not supported ({old_path})")
+            hunks = []
+            files.append((new_path, hunks, old_path == "/dev/null"))
+            i += 2
+            continue
+        header = HUNK_HEADER.match(line)
+        if header:
+            if hunks is None:
+                raise PatchError("Hunk without a ---/+++ file header")
+            old_start, old_count = int(header.group(1)), header.group(2)
+            # "-l,0" inserts after line l
+            hint = old_start if old_count == "0" else max(old_start - 1, 0)
+            hunk = Hunk([], [], hint)
+            hunks.append(hunk)
+            trailing_blanks = 0
+            i += 1
+            while i < len(lines) and not HUNK_HEADER.match(lines[i]) and not (
+                    lines[i].startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ ")):
+                body = lines[i]
+                trailing_blanks = trailing_blanks + 1 if body == "" else 0
+                if body.startswith("-"):
+                    hunk.old_lines.append(body[1:])
+                elif body.startswith("+"):
+                    hunk.new_lines.append(body[1:])
+                elif body.startswith(" ") or body == "":
+                    # Editors often strip the single space of empty context lines
+                    hunk.old_lines.append(body[1:])
+                    hunk.new_lines.append(body[1:])
+                elif body.startswith("\\") or body.startswith("diff ") or body.startswith("index "):
+                    pass
+                else:
+                    raise PatchError(f"Invalid line in hunk: {body!r}")
+                i += 1
+            # Blank lines separating the diffs of two files are not context
+            if trailing_blanks:
+                del hunk.old_lines[-trailing_blanks:], hunk.new_lines[-trailing_blanks:]
+            continue
+        i += 1
+    if not files:
+        raise PatchError("No ---/+++ file header found in the diff")
+    return files
+
+
+def parse_search_replace(patch):
+    """
+    Parse search/replace blocks, each preceded by the path of its file:
+
+        path/to/file.py
+        <<<<<<< SEARCH
+        old lines
+        =======
+        new lines
+        >>>>>>> REPLACE
+
+    Returns:
+        list: (file_path, hunks, is_new_file) for each file, in order of appearance
+    """
+    files = {}
+    lines = patch.splitlines()
+    file_path = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not SEARCH_MARKER.match(line):
+            if line.strip() and not line.strip().startswith("```"):
+                file_path = line.strip()
+            i += 1
+            continue
+        if file_path is None:
+            raise PatchError("SEARCH block without a file path on the line before it")
+        old_lines, new_lines = [], []
+        i += 1
+        while i < len(lines) and not DIVIDER_MARKER.match(lines[i]):
+            old_lines.append(lines[i])
+            i += 1
+        i += 1
+        while i < len(lines) and not REPLACE_MARKER.match(lines[i]):
+            new_lines.append(lines[i])
+            i += 1
+        if i >= len(lines):
+            raise PatchError(f"Unterminated SEARCH block for {file_path}")
+        i += 1
+        hunks, _ = files.setdefault(file_path, ([], not old_lines))
+        hunks.append(Hunk(old_lines, new_lines))
+    if not files:
+        raise PatchError("No SEARCH/REPLACE block found")
+    return [(path, hunks, is_new) for path, (hunks, is_new) in files.items()]
+
+
+def _indentation(lines):
+    """
+    Leading whitespace common to the non-blank lines.
+    """
+    indents = [line[:len(line) - len(line.lstrip())] for line in lines if line.strip()]
+    return os.path.commonprefix(indents) if indents else ""
+
+
+def _reindent(new_lines, old_lines, matched_lines):
+    """
+    Move the lines of a hunk matched ignoring indentation to the indentation of the
+    file: new_lines are shifted by the difference between the matched lines of the
+    file and old_lines, unless they are already at the indentation of the file.
+    """
+    file_indent = _indentation(matched_lines)
+    old_indent = _indentation(old_lines)
+    if old_indent == file_indent or _indentation(new_lines) == file_indent:
+        return new_lines
+    return [file_indent + line[len(old_indent):] if line.strip() and line.startswith(old_indent) else line
+            for line in new_lines]
+
+
+def apply_hunks(text, hunks):
+    """
+    Apply hunks in order to the text of a file.
+
+    Returns:
+        tuple: (new text, list of (1-indexed line, level name) per hunk)
+
+    Raises:
+        PatchError: If a hunk cannot be located
+    """
+    newline = "\r\n" if "\r\n" in text else "\n"
+    ends_with_newline = text.endswith("\n") or not text
+    matcher = LineMatcher(text.splitlines())
+    applied = []
+    delta = 0
+    for number, hunk in enumerate(hunks, 1):
+        hint = None if hunk.hint is None else hunk.hint + delta
+        if not hunk.old_lines:
+            # Pure insertion, at the position of the header or at the end of the file
+            start = len(matcher.lines) if hint is None else min(hint, len(matcher.lines))
+            level = 0
+        else:
+            try:
+                start, level = matcher.find(hunk.old_lines, hint)
+            except PatchError as e:
+                preview = "\n".join(hunk.old_lines[:3])
+                raise PatchError(f"Hunk {number} {e}:\n{preview}")
+        new_lines = hunk.new_lines
+        if level == IGNORING_INDENTATION:
+            new_lines = _reindent(new_lines, hunk.old_lines, matcher.lines[start:start + len(hunk.old_lines)])
+        matcher.replace(start, len(hunk.old_lines), new_lines)
+        delta += len(hunk.new_lines) - len(hunk.old_lines)
+        applied.append((start + 1, MATCH_LEVELS[level][0]))
+    new_text = newline.join(matcher.lines)
+    if matcher.lines and ends_with_newline:
+        new_text += newline
+    return new_text, applied
+
+
+def _summarize(file_path, hunks, applied, is_new_file):
+    # Only the lines that differ, not the context lines of the hunks
+    added = removed = 0
+    for hunk in hunks:
+        matcher = difflib.SequenceMatcher(None, hunk.old_lines, hunk.new_lines, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag != "equal":
+                removed += i2 - i1
+                added += j2 - j1
+    if is_new_file:
+        return f"{file_path}: created (+{added})"
+    lines = ", ".join(str(line) for line, _ in applied)
+    summary = f"{file_path}: {len(hunks)} hunk{'s' if len(hunks) > 1 else ''} at line{'s' if len(hunks) > 1 else ''} {lines} (+{added} -{removed})"
+    fuzzy = [f"hunk {n} {level}" for n, (_, level) in enumerate(applied, 1) if level != "exact"]
+    if fuzzy:
+        summary += f", matched {', '.join(fuzzy)}"
+    return summary
+
+
+def apply_patch(work_dir, patch):
+    """
+    Apply a unified diff or search/replace blocks to one or more files.
+
+    Hunks are located by content, not by line number: the line numbers of a unified diff
+    only break ties, and lines that differ only in whitespace still match. Every file
+    is changed or none is (see write_files).
+
+    Args:
+        work_dir (str): Working directory (for security validation)
+        patch (str): A unified diff, or search/replace blocks each preceded by a file path
+
+    Returns:
+        str: Compact summary of the applied hunks or error message
+
+    Examples:
+        # Unified diff
+        apply_patch('.', '--- a/app.py\\n+++ b/app.py\\n@@ -3,1 +3,1 @@\\n-DEBUG = True\\n+DEBUG = False\\n')
+
+        # Search/replace block
+        apply_patch('.', 'app.py\\n<<<<<<< SEARCH\\nDEBUG = True\\n=======\\nDEBUG = False\\n>>>>>>> REPLACE\\n')
+    """
+    if not patch or not patch.strip():
+        return "Error: patch is required"
+
+    abs_working_dir = os.path.abspath(work_dir)
+    try:
+        if any(SEARCH_MARKER.match(line) for line in patch.splitlines()):
+            files = parse_search_replace(patch)
+        else:
+            files = parse_unified_diff(patch)
+
+        changes = []
+        summaries = []
+        for file_path, hunks, is_new_file in files:
+            abs_file_path = os.path.abspath(os.path.join(work_dir, file_path))
+            if not is_within(abs_file_path, abs_working_dir):
+                raise PatchError(f"File {file_path} is not within the working directory {work_dir}")
+            if os.path.isfile(abs_file_path):
+                # newline='': the line endings of the file are detected and kept
+                with open(abs_file_path, 'r', encoding='utf-8', newline='') as f:
+                    text = f.read()
+                is_new_file = False
+            elif is_new_file:
+                text = ""
+            else:
+                raise PatchError(f"File {file_path} does not exist")
+            try:
+                new_text, applied = apply_hunks(text, hunks)
+            except PatchError as e:
+                raise PatchError(f"{file_path}: {e}")
+            changes.append({"file_path": file_path, "content": new_text})
+            summaries.append(_summarize(file_path, hunks, applied, is_new_file))
+    except Exception as e:
+        return f"Error: {e}. No file was changed"
+
+    result = write_files(work_dir, changes)
+    if result.startswith("Error"):
+        return result
+    return "Success: Applied patch\n" + "\n".join(summaries)
@@ -0,0 +1,194 @@
+from functions.registry import ToolRegistry, READ, WRITE, path_access
+from functions.get_files_info import get_files_info
+from functions.run_python_file import run_python_file
+from functions.run_tests import run_tests
+from functions.get_file_content import get_file_content
+from functions.get_files_content import get_files_content
+from functions.get_file_outline import get_file_outline, get_symbol
+from functions.write_file import write_file, write_files
+from functions.apply_patch import apply_patch
+from functions.find_files import find_files
+from functions.search_code import search_code
+
+# Every tool the model can call. Parameters come from the signature and docstring
+# of each function, only nested lists and objects are described here.
+registry = ToolRegistry()
+
+# One line-range replacement, shared by write_file and write_files
+schema_edit = dict(
+    type="OBJECT",
+    properties={
+        "start_line": dict(
+            type="INTEGER",
+            description="The starting line number (1-indexed, inclusive), as numbered before any edit.",
+        ),
+        "end_line": dict(
+            type="INTEGER",
+            description="The ending line number (1-indexed, inclusive), as numbered before any edit.",
+        ),
+        "content": dict(
+            type="STRING",
+            description="The content replacing the lines (empty to delete them).",
+        ),
+        "target_content": dict(
+            type="STRING",
+            description="The content expected at the lines, validated before replacing. Optional.",
+        ),
+    },
+    required=["start_line", "end_line", "content"],
+)
+
+registry.register(
+    get_files_info,
+    "Lists files in the specified directory along with their size and is_dir (if it is a directory or not). Set recursive to True to also list subdirectories (paths ignored by .gitignore are skipped), optionally filtered by a glob pattern and limited by max_depth.",
+    hidden=("respect_gitignore",),
+    # Name of the argument before every tool took work_dir
+    aliases={"working_dir": "work_dir"},
+    access=path_access(READ, "dir"),
+)
+
+registry.register(
+    get_file_content,
+    "Gets the content of a given file as a string. Without a range, returns the first characters of the file. For large files, read a line range with start_line/end_line or a byte range with offset/limit; partial reads report the total number of lines so you can plan the next read.",
+    access=path_access(READ, "file_path"),
+)
+
+registry.register(
+    get_files_content,
+    "Gets the content of several files (or line ranges of files) in one call. The files are read in parallel and share one character budget. Prefer it over several get_file_content calls when you need related files (a module, its imports and its tests).",
+    hidden=("max_chars",),
+    schemas={
+        "files": dict(
+            type="ARRAY",
+            description="The files to read.",
+            items=dict(
+                type="OBJECT",
+                properties={
+                    "file_path": dict(
+                        type="STRING",
+                        description="The path to the file to get content from.",
+                    ),
+                    "start_line": dict(
+                        type="INTEGER",
+                        description="The first line to read (1-indexed, inclusive). Optional.",
+                    ),
+                    "end_line": dict(
+                        type="INTEGER",
+                        description="The last line to read (1-indexed, inclusive). Optional.",
+                    ),
+                },
+                required=["file_path"],
+            ),
+        ),
+    },
+    access=path_access(READ),
+)
+
+registry.register(
+    get_file_outline,
+    "Lists the classes, functions and methods of a Python file with their signatures, line ranges and docstring summaries, without their bodies. Use it to find your way in a large file before reading part of it.",
+    access=path_access(READ, "file_path"),
+)
+
+registry.register(
+    get_symbol,
+    "Gets the source of one class, function or method of a Python file (e.g. 'Parser.parse'), decorators included. Use it to go to a definition instead of reading the whole file.",
+    access=path_access(READ, "file_path"),
+)
+
+registry.register(
+    write_file,
+    "Writes a string to a file in the specified directory. If the file does not exist, it will be created. If the file already exists, it will be overwritten or updated based on arguments provided. If start_line and end_line are None: Overwrites entire file with content. If start_line and end_line are provided: Replaces lines [start_line, end_line] with content. If target_content is provided: Validates that the target range matches before replacing. To change several places of the file at once, pass edits instead (non-overlapping ranges numbered as in the current file, all applied or none).",
+    schemas={
+        "edits": dict(
+            type="ARRAY",
+            description="Several line-range replacements applied in one pass. Optional, used instead of content/start_line/end_line.",
+            items=schema_edit,
+        ),
+    },
+    access=path_access(WRITE, "file_path"),
+    side_effects=True,
+)
+
+registry.register(
+    write_files,
+    "Changes several files as one transaction: either every change is applied or none. Each change either overwrites a file with content or applies edits (line-range replacements numbered as in the current file). Use it for refactors spanning several files.",
+    schemas={
+        "changes": dict(
+            type="ARRAY",
+            description="One change per file.",
+            items=dict(
+                type="OBJECT",
+                properties={
+                    "file_path": dict(
+                        type="STRING",
+                        description="The path to the file to write to.",
+                    ),
+                    "content": dict(
+                        type="STRING",
+                        description="The full new content of the file. Ignored if edits is provided.",
+                    ),
+                    "edits": dict(
+                        type="ARRAY",
+                        description="Line-range replacements to apply to the file.",
+                        items=schema_edit,
+                    ),
+                },
+                required=["file_path"],
+            ),
+        ),
+    },
+    access=path_access(WRITE),
+    side_effects=True,
+)
+
+registry.register(
+    apply_patch,
+    "Changes existing files with a unified diff or with search/replace blocks, so only the changed lines are sent instead of the whole file. Hunks are located by content (line numbers and whitespace differences are tolerated) and every file is changed or none is. Returns a short summary of the applied hunks.",
+    access=path_access(WRITE),
+    side_effects=True,
+)
+
+registry.register(
+    run_python_file,
+    "Runs a Python file in the specified directory. The file is executed in non-interactive mode by default. If you want to run it in interactive mode, set the interactive parameter to True. its takes also cli arguments to pass to the script.",
+    hidden=("max_output_bytes",),
+    # The script may read and write any file of its working directory: pending calls
+    # there land first and later ones wait for it. Interactive runs own the terminal.
+    access=lambda kwargs: None if kwargs["interactive"] else path_access(WRITE)(kwargs),
+    side_effects=True,
+)
+
+registry.register(
+    run_tests,
+    "Runs the unittest/pytest tests of the working directory (or of one test file) in parallel and returns a compact summary: counts and the tracebacks of the failing tests only. Test modules whose code and local imports are unchanged since they last passed are not run again. Prefer it over run_python_file to check your changes.",
+    hidden=("max_workers",),
+    # The tests import the files of the working directory and may write there too
+    access=path_access(WRITE),
+    side_effects=True,
+)
+
+registry.register(
+    find_files,
+    "Finds files in the workspace by name or path using a persistent index, much faster than listing directories. The pattern is a glob (e.g. '*.py', 'tests/test_*.py') or part of a file name.",
+    access=path_access(READ),
+)
+
+registry.register(
+    search_code,
+    "Searches the files of the workspace for a literal string or a regular expression and returns the matching lines as path:line: text. Use it to find definitions and usages instead of reading files one by one.",
+    access=path_access(READ),
+)
+
+
+def call_function(function_call_part):
+    """
+    Route a single function call from the model to its implementation.
+
+    Args:
+        function_call_part (types.FunctionCall): The function call requested by the model
+
+    Returns:
+        str: Result of the function, or an error message
+    """
+    return registry.call(function_call_part)
@@ -0,0 +1,108 @@
+import os
+import threading
+from collections import OrderedDict
+
+from config import FILE_CACHE_MAX_BYTES
+
+
+class FileCache:
+    """
+    Process-wide LRU cache of file reads.
+
+    Entries are keyed by (absolute path, mtime_ns, size, requested range), so a file
+    changed on disk is never served from the cache. Writes made through write_file
+    also invalidate every entry of the file right away. Least recently used entries
+    are evicted once the cached content exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes=FILE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (content, size in bytes)
+        self._keys_by_path = {}         # abs_path -> set of keys
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(abs_path, stat_result, read_range):
+        return (abs_path, stat_result.st_mtime_ns, stat_result.st_size, read_range)
+
+    def get(self, key):
+        """
+        Return the cached content for key, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, content, size=None):
+        """
+        Cache content under key, evicting least recently used entries if needed.
+
+        Args:
+            key (tuple): Key built with make_key()
+            content: Cached value, usually a string
+            size (int, optional): Size in bytes, computed for strings if omitted
+        """
+        if size is None:
+            size = len(content.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (content, size)
+            self._keys_by_path.setdefault(key[0], set()).add(key)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def invalidate(self, abs_path):
+        """
+        Drop every cached entry of a file.
+        """
+        abs_path = os.path.abspath(abs_path)
+        with self._lock:
+            for key in list(self._keys_by_path.get(abs_path, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_path.clear()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses, number of entries and cached bytes
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+    def _remove(self, key):
+        _, size = self._entries.pop(key)
+        self._size -= size
+        keys = self._keys_by_path.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_path[key[0]]
+
+
+# Shared by every tool of the process
+file_cache = FileCache()
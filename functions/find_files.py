@@ -0,0 +1,49 @@
+import os
+from config import MAX_FIND_RESULTS
+from functions.workspace_index import get_workspace_index
+from functions.registry import is_within
+
+
+def find_files(work_dir, pattern, dir=".", max_results=MAX_FIND_RESULTS):
+    """
+    Find files by name or path using the persistent workspace index.
+
+    Args:
+        work_dir (str): Working directory (for security validation)
+        pattern (str): Glob pattern (e.g. '*.py', 'tests/test_*.py') or part of a file name
+        dir (str): Only return files under this relative directory
+        max_results (int): Maximum number of files returned
+
+    Returns:
+        str: One line per file ("- path: size bytes") or error message
+
+    Examples:
+        # All test modules
+        find_files('.', 'test_*.py')
+
+        # Files with 'config' in their name under src/
+        find_files('.', 'config', dir='src')
+    """
+    abs_working_dir = os.path.abspath(work_dir)
+    abs_dir = os.path.abspath(os.path.join(work_dir, dir))
+    if not is_within(abs_dir, abs_working_dir):
+        return f"Error: Directory {dir} is not within the working directory {work_dir}"
+    if not pattern:
+        return "Error: pattern is required"
+
+    try:
+        index = get_workspace_index(abs_working_dir)
+        rel_dir = os.path.relpath(abs_dir, index.root).replace(os.sep, "/")
+        rows = index.query(pattern, "" if rel_dir == "." else rel_dir, max_results + 1)
+    except Exception as e:
+        return f"Error: {e}"
+
+    if not rows:
+        return f"No files matching {pattern}"
+    lines = []
+    for rel_path, size, _ in rows[:max_results]:
+        path = os.path.relpath(os.path.join(index.root, rel_path), abs_working_dir)
+        lines.append(f"- {path}: {size} bytes\n")
+    if len(rows) > max_results:
+        lines.append(f"[...More than {max_results} files match, narrow the pattern or dir]\n")
+    return "".join(lines)
@@ -1,19 +1,185 @@
 import os
+import re
+from array import array
 from config import MAX_CHARS
+from functions.file_cache import file_cache
+from functions.registry import is_within
 
-def get_file_content(work_dir, file_path):
+INDEX_CHUNK_SIZE = 1024 * 1024
+
+
+def get_line_index(abs_file_path, stat_result):
+    """
+    Byte offsets of the start of every line of a file, cached by (path, mtime, size).
+
+    Once built, reading any line range is a single seek, so the tail of a large log
+    costs no more than its head.
+
+    Returns:
+        tuple: (offsets, total_lines) where offsets[i] is the byte offset of line i + 1
+    """
+    cache_key = file_cache.make_key(abs_file_path, stat_result, ("line_index",))
+    index = file_cache.get(cache_key)
+    if index is not None:
+        return index
+
+    offsets = array('Q', [0])
+    with open(abs_file_path, "rb") as f:
+        base = 0
+        while True:
+            chunk = f.read(INDEX_CHUNK_SIZE)
+            if not chunk:
+                break
+            offsets.extend(base + m.end() for m in re.finditer(b"\n", chunk))
+            base += len(chunk)
+
+    # A trailing newline does not start another line
+    total_lines = len(offsets) - 1 if offsets[-1] == stat_result.st_size else len(offsets)
+    index = (offsets, total_lines)
+    file_cache.put(cache_key, index, size=offsets.itemsize * len(offsets))
+    return index
+
+
+def _read_bytes(abs_file_path, start, end):
+    with open(abs_file_path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start).decode("utf-8", errors="replace")
+
+
+def _read_lines(abs_file_path, file_path, stat_result, start_line, end_line):
+    offsets, total_lines = get_line_index(abs_file_path, stat_result)
+    start_line = 1 if start_line is None else start_line
+    if total_lines == 0 and start_line == 1 and (end_line is None or end_line >= 1):
+        # An empty file has no line 1, reading it from the start is still valid
+        return f"[Lines 0-0 of 0 in {file_path}]\n"
+    end_line = total_lines if end_line is None else end_line
+    if start_line > total_lines:
+        return f"Error: start_line {start_line} exceeds file length {total_lines}"
+    if start_line < 1 or end_line < start_line:
+        return f"Error: Invalid line range [{start_line}, {end_line}]"
+    end_line = min(end_line, total_lines)
+
+    start = offsets[start_line - 1]
+    end = offsets[end_line] if end_line < len(offsets) else stat_result.st_size
+    # No need to read more bytes than MAX_CHARS characters can take
+    read_end = min(end, start + MAX_CHARS * 4)
+    content = _read_bytes(abs_file_path, start, read_end)
+
+    # Stay within MAX_CHARS, cutting on a line boundary when possible
+    truncated_line = False
+    if len(content) > MAX_CHARS or read_end < end:
+        cut = content.rfind("\n", 0, MAX_CHARS) + 1
+        if cut:
+            content = content[:cut]
+            end_line = start_line + content.count("\n") - 1
+        else:
+            content = content[:MAX_CHARS]
+            end_line = start_line
+            truncated_line = True
+
+    header = f"[Lines {start_line}-{end_line} of {total_lines} in {file_path}]\n"
+    if truncated_line:
+        content += f"\n[...Line {start_line} truncated at {MAX_CHARS} characters, use offset/limit to read it]"
+    elif end_line < total_lines:
+        content += f"[...{total_lines - end_line} more lines, continue with start_line={end_line + 1}]"
+    return header + content
+
+
+def _read_byte_range(abs_file_path, file_path, stat_result, offset, limit):
+    offset = 0 if offset is None else offset
+    limit = MAX_CHARS if limit is None else min(limit, MAX_CHARS)
+    if offset < 0 or limit < 1:
+        return f"Error: Invalid byte range offset={offset}, limit={limit}"
+    if offset >= stat_result.st_size and stat_result.st_size > 0:
+        return f"Error: offset {offset} exceeds file size {stat_result.st_size}"
+
+    end = min(offset + limit, stat_result.st_size)
+    _, total_lines = get_line_index(abs_file_path, stat_result)
+    header = f"[Bytes {offset}-{end} of {stat_result.st_size} ({total_lines} lines) in {file_path}]\n"
+    content = _read_bytes(abs_file_path, offset, end)
+    if end < stat_result.st_size:
+        content += f"\n[...{stat_result.st_size - end} more bytes, continue with offset={end}]"
+    return header + content
+
+
+def get_file_content(work_dir, file_path, start_line=None, end_line=None, offset=None, limit=None):
+    """
+    Read a file, either from the start or a given line or byte range.
+
+    Args:
+        work_dir (str): Working directory (for security validation)
+        file_path (str): Relative path to the file
+        start_line (int, optional): First line to read (1-indexed, inclusive)
+        end_line (int, optional): Last line to read (1-indexed, inclusive)
+        offset (int, optional): First byte to read (0-indexed)
+        limit (int, optional): Number of bytes to read (at most MAX_CHARS)
+
+    Returns:
+        str: File content or error message. Partial reads start with a header giving
+        the range read and the total number of lines, so the rest can be paginated.
+
+    Examples:
+        # First MAX_CHARS characters
+        get_file_content('.', 'main.py')
+
+        # Lines 100-200
+        get_file_content('.', 'app.log', start_line=100, end_line=200)
+
+        # 4000 bytes from byte 50000
+        get_file_content('.', 'app.log', offset=50000, limit=4000)
+    """
     abs_working_dir = os.path.abspath(work_dir)
     abs_file_path = os.path.abspath(os.path.join(work_dir, file_path))
-    if not abs_file_path.startswith(abs_working_dir):
-        return f"Error: File {file_path} is not within the working directory {working_dir}"
+    if not is_within(abs_file_path, abs_working_dir):
+        return f"Error: File {file_path} is not within the working directory {work_dir}"
     if not os.path.isfile(abs_file_path):
         return f"Error: File {file_path} does not exist"
+
+    by_lines = start_line is not None or end_line is not None
+    by_bytes = offset is not None or limit is not None
+    if by_lines and by_bytes:
+        return "Error: Use either start_line/end_line or offset/limit, not both"
+    # The headers of partial reads name the file as the caller did
+    if by_lines:
+        read_range = ("lines", start_line, end_line, file_path)
+    elif by_bytes:
+        read_range = ("bytes", offset, limit, file_path)
+    else:
+        read_range = ("chars", 0, MAX_CHARS)
+
+    # Cache key includes mtime and size, so a changed file is always re-read
+    try:
+        stat_result = os.stat(abs_file_path)
+        cache_key = file_cache.make_key(abs_file_path, stat_result, read_range)
+    except OSError:
+        stat_result = cache_key = None
+    if cache_key is not None:
+        cached = file_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     string_content = ""
     try:
-        with open(abs_file_path, "r") as f:
-            string_content = f.read(MAX_CHARS)
+        if by_lines or by_bytes:
+            if stat_result is None:
+                return f"Error: File {file_path} does not exist"
+            if by_lines:
+                string_content = _read_lines(abs_file_path, file_path, stat_result, start_line, end_line)
+            else:
+                string_content = _read_byte_range(abs_file_path, file_path, stat_result, offset, limit)
+            if string_content.startswith("Error:"):
+                return string_content
+        else:
+            with open(abs_file_path, "r") as f:
+                string_content = f.read(MAX_CHARS)
             if len(string_content) >= MAX_CHARS:
-                string_content += f"\n[...File {abs_file_path} truncated at {MAX_CHARS} characters]"
+                string_content += f"\n[...File {abs_file_path} truncated at {MAX_CHARS} characters"
+                if stat_result is not None:
+                    _, total_lines = get_line_index(abs_file_path, stat_result)
+                    string_content += f". It has {total_lines} lines, read the rest with start_line/end_line"
+                string_content += "]"
     except Exception as e:
-        return f"Error: {e}" 
-    return string_content
\ No newline at end of file
+        return f"Error: {e}"
+    if cache_key is not None:
+        file_cache.put(cache_key, string_content)
+    return string_content
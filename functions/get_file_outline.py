@@ -0,0 +1,150 @@
+import ast
+import os
+
+from functions.file_cache import file_cache
+from functions.get_file_content import get_file_content
+from functions.registry import is_within
+
+SUMMARY_CHARS = 80
+
+
+def _decorators(node):
+    return "".join(f"@{ast.unparse(decorator)} " for decorator in node.decorator_list)
+
+
+def _signature(node):
+    if isinstance(node, ast.ClassDef):
+        bases = [ast.unparse(base) for base in node.bases] + [ast.unparse(k) for k in node.keywords]
+        return f"{_decorators(node)}class {node.name}" + (f"({', '.join(bases)})" if bases else "")
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns is not None else ""
+    return f"{_decorators(node)}{prefix} {node.name}({ast.unparse(node.args)}){returns}"
+
+
+def _summary(node):
+    docstring = ast.get_docstring(node) or ""
+    line = docstring.strip().split("\n", 1)[0]
+    return line if len(line) <= SUMMARY_CHARS else line[:SUMMARY_CHARS - 3] + "..."
+
+
+def parse_symbols(abs_file_path, stat_result):
+    """
+    Classes, functions and methods of a Python file, parsed with ast.
+
+    The result is kept in the file cache under (path, mtime, size), so a file is
+    parsed once until it changes. write_file invalidates it right away.
+
+    Returns:
+        list: (qualified name, signature, start_line, end_line, depth, docstring summary)
+        in file order. Line ranges are 1-indexed, inclusive and start at the decorators.
+
+    Raises:
+        SyntaxError: If the file is not valid Python
+    """
+    cache_key = file_cache.make_key(abs_file_path, stat_result, ("outline",))
+    symbols = file_cache.get(cache_key)
+    if symbols is not None:
+        return symbols
+
+    with open(abs_file_path, "rb") as f:
+        tree = ast.parse(f.read(), filename=abs_file_path)
+    symbols = []
+
+    def visit(body, prefix, depth):
+        for node in body:
+            if not isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            start_line = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+            symbols.append((prefix + node.name, _signature(node), start_line, node.end_lineno, depth,
+                            _summary(node)))
+            # Methods and nested classes, not the local functions of a function
+            if isinstance(node, ast.ClassDef):
+                visit(node.body, f"{prefix}{node.name}.", depth + 1)
+
+    visit(tree.body, "", 0)
+    size = sum(len(name) + len(signature) + len(summary) + 64 for name, signature, _, _, _, summary in symbols)
+    file_cache.put(cache_key, symbols, size=size + 64)
+    return symbols
+
+
+def _load_symbols(work_dir, file_path):
+    abs_working_dir = os.path.abspath(work_dir)
+    abs_file_path = os.path.abspath(os.path.join(work_dir, file_path))
+    if not is_within(abs_file_path, abs_working_dir):
+        return f"Error: File {file_path} is not within the working directory {work_dir}"
+    if not os.path.isfile(abs_file_path):
+        return f"Error: File {file_path} does not exist"
+    if not abs_file_path.endswith((".py", ".pyi")):
+        return f"Error: File {file_path} is not a Python file"
+    try:
+        return parse_symbols(abs_file_path, os.stat(abs_file_path))
+    except SyntaxError as e:
+        return f"Error: Cannot parse {file_path}: {e.msg} at line {e.lineno}"
+    except Exception as e:
+        return f"Error: {e}"
+
+
+def get_file_outline(work_dir, file_path):
+    """
+    List the classes, functions and methods of a Python file with their signatures
+    and line ranges, without their bodies.
+
+    Args:
+        work_dir (str): Working directory (for security validation)
+        file_path (str): Relative path to the Python file
+
+    Returns:
+        str: One line per symbol ("start-end signature  # docstring summary"), methods
+        indented under their class, or error message
+
+    Examples:
+        get_file_outline('.', 'functions/apply_patch.py')
+    """
+    symbols = _load_symbols(work_dir, file_path)
+    if isinstance(symbols, str):
+        return symbols
+    if not symbols:
+        return f"No classes or functions in {file_path}"
+    lines = [f"[Outline of {file_path}: {len(symbols)} symbols, line ranges inclusive]"]
+    for _, signature, start_line, end_line, depth, summary in symbols:
+        line = f"{'    ' * depth}{start_line}-{end_line} {signature}"
+        lines.append(f"{line}  # {summary}" if summary else line)
+    return "\n".join(lines) + "\n"
+
+
+def get_symbol(work_dir, file_path, symbol):
+    """
+    Get the source of one class, function or method of a Python file.
+
+    Args:
+        work_dir (str): Working directory (for security validation)
+        file_path (str): Relative path to the Python file
+        symbol (str): Name of the symbol, qualified with its class for a method
+            (e.g. 'Parser.parse'). An unqualified name works if it is unique.
+
+    Returns:
+        str: The lines of the symbol (decorators included) after a header giving
+        their range, or error message
+
+    Examples:
+        get_symbol('.', 'functions/apply_patch.py', 'LineMatcher.find')
+    """
+    symbols = _load_symbols(work_dir, file_path)
+    if isinstance(symbols, str):
+        return symbols
+    matches = [s for s in symbols if s[0] == symbol]
+    if not matches:
+        matches = [s for s in symbols if s[0].endswith(f".{symbol}")]
+    if not matches:
+        names = ", ".join(s[0] for s in symbols[:30])
+        return f"Error: No symbol {symbol} in {file_path}" + (f". Symbols: {names}" if names else "")
+    if len(matches) > 1:
+        candidates = ", ".join(f"{s[0]} (lines {s[2]}-{s[3]})" for s in matches)
+        return f"Error: {symbol} is ambiguous in {file_path}, qualify it: {candidates}"
+    _, _, start_line, end_line, _, _ = matches[0]
+    content = get_file_content(work_dir, file_path, start_line=start_line, end_line=end_line)
+    # The whole symbol was read: the pointer to the rest of the file is noise
+    footer = f" more lines, continue with start_line={end_line + 1}]"
+    if content.endswith(footer):
+        content = content[:content.rindex("[...")]
+    return content
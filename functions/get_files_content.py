@@ -0,0 +1,71 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from config import BATCH_READ_MAX_CHARS, MAX_PARALLEL_CALLS
+from functions.get_file_content import get_file_content
+
+
+def split_budget(sizes, budget):
+    """
+    Share a character budget between results: small results keep their full size and
+    what they leave unused is shared equally by the larger ones.
+
+    Returns:
+        list: Number of characters allowed for each result, in the same order
+    """
+    allowed = [0] * len(sizes)
+    remaining = budget
+    pending = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    while pending:
+        share = remaining // len(pending)
+        i = pending.pop(0)
+        allowed[i] = min(sizes[i], share)
+        remaining -= allowed[i]
+    return allowed
+
+
+def get_files_content(work_dir, files, max_chars=BATCH_READ_MAX_CHARS):
+    """
+    Read several files (or line ranges of files) at once, concurrently.
+
+    Args:
+        work_dir (str): Working directory (for security validation)
+        files (list): File paths, or dicts with file_path and optional start_line/end_line
+        max_chars (int): Character budget shared by all the files
+
+    Returns:
+        str: Each file's content under a "=== path ===" header, or error message
+
+    Examples:
+        # Read a module and its tests in one call
+        get_files_content('.', ['app/models.py', 'tests/test_models.py'])
+
+        # Read part of a large file along with a small one
+        get_files_content('.', [{'file_path': 'app.log', 'start_line': 500, 'end_line': 600}, 'config.py'])
+    """
+    if not isinstance(files, list) or not files:
+        return "Error: files must be a non-empty list"
+
+    requests = []
+    for item in files:
+        if isinstance(item, str):
+            item = {"file_path": item}
+        if not isinstance(item, dict) or not item.get("file_path"):
+            return f"Error: Invalid file entry {item!r}, expected a path or {{'file_path': ...}}"
+        requests.append(item)
+
+    def read(item):
+        return get_file_content(work_dir, item["file_path"], item.get("start_line"), item.get("end_line"))
+
+    with ThreadPoolExecutor(max_workers=min(len(requests), MAX_PARALLEL_CALLS)) as executor:
+        contents = list(executor.map(read, requests))
+
+    allowed = split_budget([len(content) for content in contents], max_chars)
+    sections = []
+    for item, content, limit in zip(requests, contents, allowed):
+        if len(content) > limit:
+            # Cut on a line boundary when possible
+            cut = content.rfind("\n", 0, limit) + 1 or limit
+            content = (content[:cut] + f"\n[...Cut to share the read budget between {len(requests)} files, "
+                       f"read the rest with get_file_content]")
+        sections.append(f"=== {item['file_path']} ===\n{content}\n")
+    return "".join(sections)
@@ -1,16 +1,144 @@
 import os
+from fnmatch import fnmatchcase
+from itertools import islice
+from config import MAX_LIST_ENTRIES
+from functions.registry import is_within
 
 
-def get_files_info(working_dir, dir="."):
-    abs_working_dir = os.path.abspath(working_dir)
-    abs_dir = os.path.abspath(os.path.join(working_dir, dir))
-    if not abs_dir.startswith(abs_working_dir):
-        return f"Error: Directory {dir} is not within the working directory {working_dir}"
-    
-    contents = os.listdir(abs_dir)
-    final_response = ""
-    for content in contents:
-        is_dir = os.path.isdir(os.path.join(abs_dir, content))
-        size = os.path.getsize(os.path.join(abs_dir, content))
-        final_response += f"- {content}: {size} bytes, is_dir: {is_dir}\n"
-    return final_response
+def load_gitignore(abs_dir):
+    """
+    Parse the .gitignore of a directory into (negate, dir_only, anchored, pattern) rules.
+    """
+    try:
+        with open(os.path.join(abs_dir, ".gitignore"), "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except (OSError, UnicodeDecodeError):
+        return []
+
+    rules = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if line.startswith("**/"):
+            line = line[3:]
+        # A slash anywhere but at the end anchors the pattern to the .gitignore directory
+        anchored = "/" in line
+        line = line.lstrip("/")
+        if line:
+            rules.append((negate, dir_only, anchored, line))
+    return rules
+
+
+def is_ignored(ignore_rules, abs_path, name, is_dir):
+    """
+    Check a path against the stack of (base_dir, rules) of the .gitignore files above it.
+    The last matching rule wins, like in git.
+    """
+    ignored = False
+    for base_dir, rules in ignore_rules:
+        rel_path = abs_path[len(base_dir) + 1:].replace(os.sep, "/")
+        for negate, dir_only, anchored, pattern in rules:
+            if dir_only and not is_dir:
+                continue
+            if fnmatchcase(rel_path if anchored else name, pattern):
+                ignored = not negate
+    return ignored
+
+
+def ancestor_ignore_rules(abs_working_dir, abs_dir):
+    """
+    Collect the (base_dir, rules) of every .gitignore from abs_working_dir down to abs_dir.
+    """
+    ignore_rules = []
+    current = abs_working_dir
+    parts = os.path.relpath(abs_dir, abs_working_dir).split(os.sep)
+    for part in [""] + [p for p in parts if p not in ("", ".")]:
+        current = os.path.join(current, part) if part else current
+        rules = load_gitignore(current)
+        if rules:
+            ignore_rules.append((current, rules))
+    return ignore_rules
+
+
+def _iter_entries(abs_dir, recursive, pattern, max_depth, ignore_rules):
+    # Depth-first walk with an explicit stack, yielding one output line per entry
+    stack = [(abs_dir, "", 1, ignore_rules)]
+    while stack:
+        current_dir, rel_dir, depth, ignore_rules = stack.pop()
+        try:
+            with os.scandir(current_dir) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            yield f"- {rel_dir or '.'}: Error: {e}\n"
+            continue
+
+        if ignore_rules is not None and rel_dir:
+            rules = load_gitignore(current_dir)
+            if rules:
+                ignore_rules = ignore_rules + [(current_dir, rules)]
+
+        subdirs = []
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            # DirEntry caches the file type (and stat on Windows) from the directory read
+            is_dir = entry.is_dir()
+            if recursive:
+                if entry.name == ".git":
+                    continue
+                if ignore_rules is not None and is_ignored(ignore_rules, entry.path, entry.name, is_dir):
+                    continue
+            if pattern is None or fnmatchcase(entry.name, pattern) or fnmatchcase(rel_path, pattern):
+                try:
+                    size = entry.stat().st_size
+                except OSError:
+                    size = 0
+                yield f"- {rel_path}: {size} bytes, is_dir: {is_dir}\n"
+            if recursive and is_dir and not entry.is_symlink() and (max_depth is None or depth < max_depth):
+                subdirs.append((entry.path, rel_path, depth + 1, ignore_rules))
+        stack.extend(reversed(subdirs))
+
+
+def get_files_info(work_dir, dir=".", recursive=False, pattern=None, max_depth=None,
+                   max_entries=MAX_LIST_ENTRIES, respect_gitignore=True):
+    """
+    List the entries of a directory, optionally walking its subdirectories.
+
+    Args:
+        work_dir (str): Working directory (for security validation)
+        dir (str): Relative path of the directory to list
+        recursive (bool): If True, also list the content of subdirectories
+        pattern (str, optional): Glob matched against entry names and relative paths (e.g. '*.py')
+        max_depth (int, optional): Maximum depth of a recursive listing (1 = only dir itself)
+        max_entries (int): Maximum number of entries returned
+        respect_gitignore (bool): If True, recursive listings skip .gitignore'd paths
+
+    Returns:
+        str: One line per entry ("- path: size bytes, is_dir: bool") or error message
+
+    Examples:
+        # List the working directory
+        get_files_info('.')
+
+        # Find Python files up to two levels deep
+        get_files_info('.', 'src', recursive=True, pattern='*.py', max_depth=2)
+    """
+    abs_working_dir = os.path.abspath(work_dir)
+    abs_dir = os.path.abspath(os.path.join(work_dir, dir))
+    if not is_within(abs_dir, abs_working_dir):
+        return f"Error: Directory {dir} is not within the working directory {work_dir}"
+
+    ignore_rules = None
+    if recursive and respect_gitignore:
+        ignore_rules = ancestor_ignore_rules(abs_working_dir, abs_dir)
+
+    entries = _iter_entries(abs_dir, recursive, pattern, max_depth, ignore_rules)
+    lines = list(islice(entries, max_entries))
+    if len(lines) == max_entries and next(entries, None) is not None:
+        lines.append(f"[...Listing truncated at {max_entries} entries, narrow it with dir, pattern or max_depth]\n")
+    return "".join(lines)
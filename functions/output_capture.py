@@ -0,0 +1,59 @@
+import threading
+
+
+class BoundedOutput:
+    """
+    Thread-safe capture of a process output keeping only its head and tail.
+
+    The first half of max_bytes is kept as the head and the most recent half as the
+    tail, so memory stays bounded whatever the process prints.
+    """
+
+    def __init__(self, max_bytes):
+        self.head_limit = max_bytes // 2
+        self.tail_limit = max_bytes - self.head_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total_bytes = 0
+        self.dropped_bytes = 0
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        with self._lock:
+            self.total_bytes += len(data)
+            room = self.head_limit - len(self.head)
+            if room > 0:
+                self.head += data[:room]
+                data = data[room:]
+            if data:
+                self.tail += data
+                excess = len(self.tail) - self.tail_limit
+                if excess > 0:
+                    del self.tail[:excess]
+                    self.dropped_bytes += excess
+
+    def getvalue(self):
+        """
+        Returns:
+            str: Captured output, with a marker where bytes were dropped
+        """
+        with self._lock:
+            head = self.head.decode("utf-8", errors="replace")
+            tail = self.tail.decode("utf-8", errors="replace")
+            if not self.dropped_bytes:
+                return head + tail
+            return f"{head}\n[...{self.dropped_bytes} bytes of output dropped...]\n{tail}"
+
+
+def pump(stream, capture, chunk_size=65536):
+    """
+    Copy a binary stream into a capture until EOF, as soon as data is available.
+    """
+    try:
+        while True:
+            data = stream.read1(chunk_size)
+            if not data:
+                break
+            capture.write(data)
+    finally:
+        stream.close()
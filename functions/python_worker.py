@@ -0,0 +1,117 @@
+"""
+Warm Python worker used by functions/worker_pool.py.
+
+Started once as `python python_worker.py <socket fd> [modules to preload...]`, it imports
+the preloaded modules and then serves requests read from the socket, one at a time.
+Each request is a JSON line {"file", "args", "cwd"} sent with the write end of an
+output pipe. The worker forks, the child runs the script exactly like
+`python file args...` would (cwd, sys.argv, sys.path[0], __main__, and the shutdown
+of the interpreter) with stdout and stderr on the pipe, and the worker replies with
+{"pid"} then {"returncode"}.
+"""
+import atexit
+import gc
+import importlib
+import io
+import json
+import os
+import runpy
+import socket
+import sys
+import threading
+import traceback
+
+
+def _finalize():
+    """
+    The steps of the interpreter shutdown that os._exit skips: wait for the non-daemon
+    threads, run the atexit handlers, then flush the files the script left open.
+    """
+    try:
+        threading._shutdown()
+    except BaseException:
+        traceback.print_exc()
+    atexit._run_exitfuncs()
+    # Flushed before any collection: a text file collected with its buffer in the same
+    # cycle can lose the text it had not passed to the buffer yet
+    for obj in gc.get_objects():
+        if isinstance(obj, io.IOBase):
+            try:
+                if not obj.closed:
+                    obj.flush()
+            except Exception:
+                pass
+
+
+def _run_script(request, output_fd):
+    os.dup2(output_fd, 1)
+    os.dup2(output_fd, 2)
+    os.close(output_fd)
+    sys.stdout = open(1, "w", buffering=1, closefd=False)
+    sys.stderr = open(2, "w", buffering=1, closefd=False)
+
+    code = 0
+    try:
+        os.chdir(request["cwd"])
+        sys.argv = [request["file"]] + request["args"]
+        sys.path[0] = os.path.dirname(request["file"])
+        runpy.run_path(request["file"], run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        _finalize()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    os._exit(code)
+
+
+def _send(sock, message):
+    sock.sendall(json.dumps(message).encode() + b"\n")
+
+
+def serve(sock):
+    buffer = b""
+    fds = []
+    while True:
+        while b"\n" not in buffer:
+            data, new_fds, _, _ = socket.recv_fds(sock, 65536, 1)
+            if not data:
+                return
+            buffer += data
+            fds.extend(new_fds)
+        line, buffer = buffer.split(b"\n", 1)
+        request = json.loads(line)
+        output_fd = fds.pop(0)
+
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            _run_script(request, output_fd)
+        os.close(output_fd)
+        _send(sock, {"pid": pid})
+
+        _, status = os.waitpid(pid, 0)
+        _send(sock, {"returncode": os.waitstatus_to_exitcode(status)})
+
+
+def main():
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    for module_name in sys.argv[2:]:
+        try:
+            importlib.import_module(module_name)
+        except Exception:
+            pass  # A module that fails to preload is imported by the script itself
+    serve(sock)
+
+
+if __name__ == "__main__":
+    main()
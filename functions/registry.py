@@ -0,0 +1,315 @@
+import asyncio
+import inspect
+import os
+import re
+import threading
+
+from config import get_workspace_root
+
+READ = "read"
+WRITE = "write"
+
+# Docstring types (first word of "name (type, optional): description") -> schema types.
+# Schemas are kept as plain dicts, google.genai is only imported to build declarations.
+DOC_TYPES = {
+    "str": "STRING",
+    "int": "INTEGER",
+    "float": "NUMBER",
+    "bool": "BOOLEAN",
+    "list": "ARRAY",
+    "dict": "OBJECT",
+}
+
+ARG_LINE = re.compile(r"^(\s+)(\w+) \(([^)]*)\):\s*(.*)$")
+
+
+class ToolArgumentError(Exception):
+    pass
+
+
+def parse_docstring_args(docstring):
+    """
+    Parse the Args section of a Google-style docstring.
+
+    Returns:
+        dict: name -> (type string, description), continuation lines joined
+    """
+    args = {}
+    in_args = False
+    indent = None
+    last = None
+    for line in (docstring or "").splitlines():
+        stripped = line.strip()
+        if stripped == "Args:":
+            in_args = True
+            continue
+        if not in_args:
+            continue
+        match = ARG_LINE.match(line)
+        if match and (indent is None or len(match.group(1)) == indent):
+            indent = len(match.group(1))
+            last = match.group(2)
+            args[last] = [match.group(3), match.group(4)]
+        elif stripped and last is not None and len(line) - len(line.lstrip()) > indent:
+            args[last][1] += " " + stripped
+        elif not stripped or stripped.endswith(":"):
+            # Blank line or next section (Returns:, Examples:...) ends Args
+            if args:
+                break
+    return {name: (doc_type, description) for name, (doc_type, description) in args.items()}
+
+
+def _schema_type(doc_type):
+    words = doc_type.replace(",", " ").split()
+    return DOC_TYPES.get(words[0] if words else "str", "STRING")
+
+
+def _coerce(name, value, schema_type):
+    if schema_type == "INTEGER":
+        if isinstance(value, bool):
+            raise ToolArgumentError(f"Argument {name} must be an integer, got {value!r}")
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str) and re.fullmatch(r"\s*-?\d+\s*", value):
+            return int(value)
+        if isinstance(value, int):
+            return value
+        raise ToolArgumentError(f"Argument {name} must be an integer, got {value!r}")
+    if schema_type == "NUMBER":
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ToolArgumentError(f"Argument {name} must be a number, got {value!r}")
+    if schema_type == "BOOLEAN":
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in ("true", "false"):
+            return value.lower() == "true"
+        if value in (0, 1):
+            return bool(value)
+        raise ToolArgumentError(f"Argument {name} must be a boolean, got {value!r}")
+    if schema_type == "STRING":
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            return str(value)
+        raise ToolArgumentError(f"Argument {name} must be a string, got {value!r}")
+    if schema_type == "ARRAY":
+        if isinstance(value, (list, tuple)):
+            return list(value)
+        raise ToolArgumentError(f"Argument {name} must be a list, got {value!r}")
+    if schema_type == "OBJECT" and not isinstance(value, dict):
+        raise ToolArgumentError(f"Argument {name} must be an object, got {value!r}")
+    return value
+
+
+def is_within(path, root):
+    """
+    Whether the absolute path is root or inside it. Unlike a prefix test, a sibling
+    whose name starts with the name of root ("proj2" next to "proj") is outside.
+    """
+    try:
+        return os.path.commonpath([root, path]) == os.path.normpath(root)
+    except ValueError:
+        return False  # Another drive on Windows
+
+
+def resolve_work_dir(work_dir):
+    """
+    Absolute path of a work_dir argument, relative to the active workspace.
+
+    Raises:
+        ToolArgumentError: If the directory is outside the workspace
+    """
+    root = get_workspace_root()
+    path = os.path.abspath(os.path.join(root, work_dir or "."))
+    if not is_within(path, root):
+        raise ToolArgumentError(f"Working directory {work_dir} is outside the workspace {root}")
+    return path
+
+
+class Tool:
+    """
+    A function exposed to the model.
+
+    Its parameters, their types, descriptions and which of them are required are read
+    from the signature and the Args section of the docstring of the function, so a
+    tool is declared in one place.
+
+    Args:
+        function (callable): The implementation, plain or async
+        description (str): What the tool does, as shown to the model
+        name (str, optional): Name exposed to the model (default: the function name)
+        hidden (tuple): Parameters not exposed to the model (they keep their default)
+        schemas (dict, optional): Parameter -> schema dict (fields of types.Schema)
+            overriding the generated one, for lists and objects with a nested structure
+        aliases (dict, optional): Accepted argument name -> parameter name
+        access (callable, optional): Bound arguments -> (READ or WRITE, abs_path), the
+            path the call touches, used to run calls concurrently. None makes every
+            call a barrier.
+        side_effects (bool): If True, the tool changes files or runs code, so it is
+            never replayed blindly (e.g. when a session is resumed)
+    """
+
+    def __init__(self, function, description, name=None, hidden=(), schemas=None, aliases=None, access=None,
+                 side_effects=False):
+        self.function = function
+        self.side_effects = side_effects
+        self.description = description
+        self.name = name or function.__name__
+        self.aliases = aliases or {}
+        self.access = access
+        self.is_async = inspect.iscoroutinefunction(function)
+
+        doc_args = parse_docstring_args(function.__doc__)
+        self.parameters = {}
+        for parameter in inspect.signature(function).parameters.values():
+            if parameter.name in hidden:
+                continue
+            doc_type, doc = doc_args.get(parameter.name, ("str", ""))
+            schema = dict((schemas or {}).get(parameter.name) or {})
+            if not schema:
+                schema = {"type": _schema_type(doc_type), "description": doc}
+                if schema["type"] == "ARRAY":
+                    # "list of int" -> items of that type, strings otherwise
+                    words = doc_type.replace(",", " ").split()
+                    item_type = words[2] if len(words) > 2 and words[1] == "of" else "str"
+                    schema["items"] = {"type": _schema_type(item_type)}
+            required = parameter.default is inspect.Parameter.empty
+            if not required and schema.get("description") and "Optional" not in schema["description"]:
+                description = schema["description"].rstrip(".")
+                if parameter.default not in (None, "") and "default" not in description:
+                    description += f" (default: {parameter.default!r})"
+                schema["description"] = f"{description}. Optional."
+            self.parameters[parameter.name] = (schema, required, parameter.default)
+
+    def declaration(self):
+        from google.genai import types
+
+        return types.FunctionDeclaration(
+            name=self.name,
+            description=self.description,
+            parameters=types.Schema.model_validate({
+                "type": "OBJECT",
+                "properties": {name: schema for name, (schema, _, _) in self.parameters.items()},
+                "required": [name for name, (_, required, _) in self.parameters.items() if required],
+            }),
+        )
+
+    def bind(self, args):
+        """
+        Validate and coerce the arguments of a call.
+
+        Returns:
+            dict: Keyword arguments for the function, defaults filled in
+
+        Raises:
+            ToolArgumentError: On an unknown, missing or mistyped argument
+        """
+        kwargs = {}
+        for key, value in (args or {}).items():
+            name = self.aliases.get(key, key)
+            if name not in self.parameters:
+                raise ToolArgumentError(f"Unknown argument {key} for {self.name}, expected one of "
+                                        f"{', '.join(self.parameters)}")
+            if value is None:
+                continue  # Same as leaving the argument out
+            kwargs[name] = _coerce(name, value, self.parameters[name][0]["type"])
+        for name, (_, required, default) in self.parameters.items():
+            if name in kwargs:
+                continue
+            if required:
+                raise ToolArgumentError(f"Missing required argument {name} for {self.name}")
+            kwargs[name] = default
+        if "work_dir" in self.parameters:
+            # Every session has its own workspace (server mode), the process has one cwd
+            kwargs["work_dir"] = resolve_work_dir(kwargs["work_dir"])
+        return kwargs
+
+    def call(self, args):
+        kwargs = self.bind(args)
+        if self.is_async:
+            # Calls run on executor threads, each async tool gets its own event loop
+            return asyncio.run(self.function(**kwargs))
+        return self.function(**kwargs)
+
+
+def path_access(mode, path_arg=None):
+    """
+    Access of a tool touching work_dir, or the path given by its path_arg argument.
+    """
+    def access(kwargs):
+        work_dir = kwargs.get("work_dir") or "."
+        if path_arg is None:
+            return mode, os.path.abspath(work_dir)
+        return mode, os.path.abspath(os.path.join(work_dir, kwargs.get(path_arg) or ""))
+    return access
+
+
+class ToolRegistry:
+    """
+    Name -> Tool table: one dict lookup per call, declarations built once.
+    """
+
+    def __init__(self):
+        self._tools = {}
+        self._declarations = None
+        self._lock = threading.Lock()
+
+    def register(self, function, description, **options):
+        """
+        Expose a function to the model (see Tool for the options).
+
+        Returns:
+            Tool: The registered tool
+        """
+        tool = Tool(function, description, **options)
+        with self._lock:
+            self._tools[tool.name] = tool
+            self._declarations = None
+        return tool
+
+    def get(self, name):
+        return self._tools.get(name)
+
+    def names(self):
+        return list(self._tools)
+
+    def tool(self):
+        """
+        The types.Tool declaring every registered function, built on first use.
+        """
+        from google.genai import types
+
+        with self._lock:
+            if self._declarations is None:
+                self._declarations = types.Tool(
+                    function_declarations=[tool.declaration() for tool in self._tools.values()]
+                )
+            return self._declarations
+
+    def call(self, function_call_part):
+        """
+        Run a function call from the model.
+
+        Returns:
+            str: Result of the function, or an error message
+        """
+        tool = self._tools.get(function_call_part.name)
+        if tool is None:
+            return f"Error: Unknown function call: {function_call_part.name}"
+        try:
+            return tool.call(function_call_part.args)
+        except ToolArgumentError as e:
+            return f"Error: {e}"
+
+    def get_call_access(self, function_call_part):
+        """
+        Returns:
+            tuple: (READ or WRITE, abs_path) touched by the call, or None if unknown
+        """
+        tool = self._tools.get(function_call_part.name)
+        if tool is None or tool.access is None:
+            return None
+        try:
+            return tool.access(tool.bind(function_call_part.args))
+        except ToolArgumentError:
+            return None
@@ -1,11 +1,80 @@
+import contextlib
 import os
 import subprocess
 import sys
+import threading
+from config import RUN_OUTPUT_MAX_BYTES, MAX_TOOL_SUBPROCESSES
+from functions.output_capture import BoundedOutput, pump
+from functions.worker_pool import get_worker_pool
+from functions.workspace_index import notify_workspace_changed
+from functions.registry import is_within
 
 
-def run_python_file(work_dir, file_path, timeout=30, interactive=False, cli_args=None):
+# Held while a script runs: a semaphore if the number of scripts is limited
+_slots = contextlib.nullcontext()
+
+
+def set_max_subprocesses(limit):
+    """
+    Limit the number of scripts running at the same time, across every session of the
+    process (0: unlimited). A call over the limit waits for a slot, its timeout only
+    starts once the script is running.
+    """
+    global _slots
+    _slots = threading.BoundedSemaphore(limit) if limit > 0 else contextlib.nullcontext()
+
+
+set_max_subprocesses(MAX_TOOL_SUBPROCESSES)
+
+
+def subprocess_slot():
+    """
+    Context manager held by every tool while one of its subprocesses runs.
+    """
+    return _slots
+
+
+def run_subprocess(command, cwd, timeout, max_output_bytes):
+    """
+    Run a command with stdout and stderr streamed into one bounded buffer.
+
+    Returns:
+        tuple: (exit code, or None if it was killed after timeout seconds, output)
+    """
+    process = subprocess.Popen(
+        command,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        # Unbuffered, so output keeps its order and survives a timeout kill
+        env={**os.environ, "PYTHONUNBUFFERED": "1"},
+    )
+    capture = BoundedOutput(max_output_bytes)
+    reader = threading.Thread(target=pump, args=(process.stdout, capture), daemon=True)
+    reader.start()
+
+    try:
+        returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        returncode = None
+    # Child processes of the script may keep the pipe open
+    reader.join(timeout=1)
+    return returncode, capture.getvalue()
+
+
+def run_python_file(work_dir, file_path, timeout=30, interactive=False, cli_args=None,
+                    max_output_bytes=RUN_OUTPUT_MAX_BYTES):
     """
     Run a Python file in its proper working directory using subprocess.
+
+    In non-interactive mode stderr is redirected into the stdout pipe, so both are
+    streamed into one buffer in the exact order they were printed. Only the head and
+    tail of the output are kept (at most max_output_bytes), and the output printed so
+    far is returned even on timeout.
+    If the worker pool is enabled (MAGNET_WORKER_POOL_SIZE), the script runs in a fork
+    of a warm interpreter instead of a new process, with the same argv, cwd and timeout.
     
     Args:
         work_dir (str): Working directory where the file is located
@@ -13,6 +82,7 @@ def run_python_file(work_dir, file_path, timeout=30, interactive=False, cli_args
         timeout (int): Maximum execution time in seconds (default: 30)
         interactive (bool): If True, allows user interaction (input prompts visible)
         cli_args (list): Optional list of command-line arguments to pass to the script
+        max_output_bytes (int): Maximum number of output bytes kept (head + tail)
     
     Returns:
         str: Output from the script or error message
@@ -27,7 +97,7 @@ def run_python_file(work_dir, file_path, timeout=30, interactive=False, cli_args
     abs_working_dir = os.path.abspath(work_dir)
     abs_file_path = os.path.abspath(os.path.join(work_dir, file_path))
     
-    if not abs_file_path.startswith(abs_working_dir):
+    if not is_within(abs_file_path, abs_working_dir):
         return f"Error: File {file_path} is not within the working directory {work_dir}"
     
     if not os.path.isfile(abs_file_path):
@@ -45,40 +115,39 @@ def run_python_file(work_dir, file_path, timeout=30, interactive=False, cli_args
             return f"Error: cli_args must be a list, got {type(cli_args)}"
     
     try:
-        if interactive:
-            # Interactive mode: Connect subprocess to terminal (shows prompts)
-            result = subprocess.run(
-                command,
-                cwd=abs_working_dir,
-                timeout=timeout
-            )
-            
-            # In interactive mode, output goes directly to terminal
-            if result.returncode != 0:
-                return f"\nError: Script exited with code {result.returncode}"
-            return f"\nSuccess: Script completed"
-        else:
-            # Non-interactive mode: Capture output
-            result = subprocess.run(
-                command,
-                cwd=abs_working_dir,
-                capture_output=True,
-                text=True,
-                timeout=timeout
-            )
+        with _slots:
+            if interactive:
+                # Interactive mode: Connect subprocess to terminal (shows prompts)
+                result = subprocess.run(
+                    command,
+                    cwd=abs_working_dir,
+                    timeout=timeout
+                )
             
-            output = ""
-            if result.stdout:
-                output += result.stdout
-            if result.stderr:
-                output += result.stderr
-            
-            if result.returncode != 0:
-                return f"Error: Script exited with code {result.returncode}\n{output}"
+                # In interactive mode, output goes directly to terminal
+                if result.returncode != 0:
+                    return f"\nError: Script exited with code {result.returncode}"
+                return f"\nSuccess: Script completed"
+            else:
+                # Non-interactive mode: Stream output into a bounded buffer
+                pool = get_worker_pool()
+                if pool is not None:
+                    returncode, output = pool.run(abs_file_path, command[2:], abs_working_dir, timeout, max_output_bytes)
+                else:
+                    returncode, output = run_subprocess(command, abs_working_dir, timeout, max_output_bytes)
+
+                if returncode is None:
+                    return f"Error: Script execution timed out after {timeout} seconds" + (f"\nPartial output:\n{output}" if output else "")
+
+                if returncode != 0:
+                    return f"Error: Script exited with code {returncode}\n{output}"
             
-            return output if output else f"Success: File {file_path} executed successfully (no output)"
+                return output if output else f"Success: File {file_path} executed successfully (no output)"
         
     except subprocess.TimeoutExpired:
         return f"Error: Script execution timed out after {timeout} seconds"
     except Exception as e:
-        return f"Error: {e}"
\ No newline at end of file
+        return f"Error: {e}"
+    finally:
+        # The script may have written files: the next query of the workspace index refreshes it
+        notify_workspace_changed(abs_working_dir)
\ No newline at end of file
@@ -0,0 +1,333 @@
+import ast
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import TEST_TIMEOUT, TEST_TRACEBACK_LINES, TEST_RESULTS_FILE, RUN_OUTPUT_MAX_BYTES
+from functions.run_python_file import run_subprocess, subprocess_slot
+from functions.workspace_index import get_workspace_index, hash_file, notify_workspace_changed
+from functions.write_file import atomic_write
+from functions.registry import is_within
+
+RUNNER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_runner.py")
+
+# abs_path -> ((mtime_ns, size), value): parsed modules and content hashes
+_parsed = {}
+_hashes = {}
+_results_lock = threading.Lock()
+
+
+def _stat_key(abs_path):
+    stat_result = os.stat(abs_path)
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+
+def _file_hash(abs_path):
+    key = _stat_key(abs_path)
+    cached = _hashes.get(abs_path)
+    if cached is None or cached[0] != key:
+        cached = (key, hash_file(abs_path, key[1]) or f"{key[0]}:{key[1]}")
+        _hashes[abs_path] = cached
+    return cached[1]
+
+
+def _is_test_case(base, test_cases):
+    name = base.id if isinstance(base, ast.Name) else getattr(base, "attr", "")
+    return name.endswith("TestCase") or name in test_cases
+
+
+def parse_test_module(abs_path):
+    """
+    Tests and imports of a module, read from its syntax tree (the module is not imported).
+
+    Returns:
+        tuple: (units, imports) where units are (name, is_unittest, number of tests)
+        for each TestCase class, pytest class or test function, and imports are
+        (module, level, names) for each import statement
+    """
+    key = _stat_key(abs_path)
+    cached = _parsed.get(abs_path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with open(abs_path, "rb") as f:
+        tree = ast.parse(f.read(), filename=abs_path)
+
+    units = []
+    test_cases = set()
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            methods = [n for n in node.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]
+            count = sum(1 for n in methods if n.name.startswith("test"))
+            if any(_is_test_case(base, test_cases) for base in node.bases):
+                test_cases.add(node.name)
+                units.append((node.name, True, count))
+            elif node.name.startswith("Test") and count and not any(n.name == "__init__" for n in methods):
+                units.append((node.name, False, count))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith("test"):
+            units.append((node.name, False, 1))
+
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend((alias.name, 0, ()) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            imports.append((node.module or "", node.level, tuple(alias.name for alias in node.names)))
+
+    _parsed[abs_path] = (key, (units, imports))
+    return units, imports
+
+
+def resolve_import(root, module_dir, module, level, names):
+    """
+    Workspace files an import statement of a module of module_dir may load, parent
+    package __init__.py files included.
+
+    Returns:
+        list: Absolute paths under root
+    """
+    if level:
+        base = module_dir
+        for _ in range(level - 1):
+            base = os.path.dirname(base)
+        bases = [base]
+    else:
+        # The directory of the test (pytest rootdir insertion) and the root (sys.path[0])
+        bases = [module_dir, root]
+    parts = module.split(".") if module else []
+    found = []
+    for base in bases:
+        path = os.path.join(base, *parts)
+        candidates = [path + ".py", os.path.join(path, "__init__.py")] if parts else []
+        candidates += [os.path.join(path, f"{name}.py") for name in names]
+        found += [c for c in candidates if os.path.isfile(c)]
+        # Parent packages run their __init__ too
+        for i in range(1, len(parts)):
+            init = os.path.join(base, *parts[:i], "__init__.py")
+            if os.path.isfile(init):
+                found.append(init)
+    return [os.path.abspath(p) for p in found if os.path.abspath(p).startswith(root + os.sep)]
+
+
+def dependencies(root, abs_path):
+    """
+    The workspace files a test module depends on: itself, the local modules it imports
+    (transitively) and the conftest.py files pytest loads for it.
+
+    Returns:
+        list: Absolute paths, sorted
+    """
+    seen = set()
+    pending = [abs_path]
+    directory = os.path.dirname(abs_path)
+    while is_within(directory, root):
+        conftest = os.path.join(directory, "conftest.py")
+        if os.path.isfile(conftest):
+            pending.append(conftest)
+        if directory == root:
+            break
+        directory = os.path.dirname(directory)
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        try:
+            _, imports = parse_test_module(path)
+        except (OSError, SyntaxError, ValueError):
+            continue
+        for module, level, names in imports:
+            pending.extend(resolve_import(root, os.path.dirname(path), module, level, names))
+    return sorted(seen)
+
+
+def dependency_hash(root, abs_path):
+    digest = hashlib.sha256()
+    for path in dependencies(root, abs_path):
+        digest.update(f"{os.path.relpath(path, root)}\0{_file_hash(path)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _load_results(root):
+    try:
+        with open(os.path.join(root, TEST_RESULTS_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_results(root, updates):
+    with _results_lock:
+        results = _load_results(root)
+        for rel_path, entry in updates.items():
+            if entry is None:
+                results.pop(rel_path, None)
+            else:
+                results[rel_path] = entry
+        path = os.path.join(root, TEST_RESULTS_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, json.dumps(results, indent=1, sort_keys=True))
+
+
+def _make_shards(units, max_shards):
+    """
+    Split test units over shards, largest first on the least loaded shard.
+    """
+    shards = [[] for _ in range(min(max_shards, len(units)))]
+    loads = [0] * len(shards)
+    for unit in sorted(units, key=lambda unit: -unit[2]):
+        i = loads.index(min(loads))
+        shards[i].append(unit)
+        loads[i] += max(unit[2], 1)
+    return [shard for shard in shards if shard]
+
+
+def _run_shard(root, runner, shard, timeout):
+    fd, result_file = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    test_ids = [test_id for test_id, _, _ in shard]
+    try:
+        with subprocess_slot():
+            returncode, output = run_subprocess([sys.executable, RUNNER_SCRIPT, result_file, runner] + test_ids,
+                                                root, timeout, RUN_OUTPUT_MAX_BYTES)
+        try:
+            with open(result_file, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            if returncode is None:
+                error = f"Timed out after {timeout} seconds"
+            else:
+                error = f"Test runner exited with code {returncode}"
+            return {"passed": 0, "skipped": 0, "failed": [[", ".join(test_ids), f"{error}\n{output}"]], "load_errors": []}
+    finally:
+        os.unlink(result_file)
+
+
+def _trim_traceback(trace):
+    lines = trace.rstrip("\n").splitlines()
+    if len(lines) <= TEST_TRACEBACK_LINES:
+        return "\n".join(lines)
+    return "\n".join([f"[...{len(lines) - TEST_TRACEBACK_LINES} lines]"] + lines[-TEST_TRACEBACK_LINES:])
+
+
+def run_tests(work_dir, path=".", pattern="test*.py", use_cache=True, timeout=TEST_TIMEOUT, max_workers=None):
+    """
+    Discover the unittest and pytest tests of a directory (or one test file), run them
+    in parallel shards of processes and summarize the results.
+
+    pytest runs the tests if it is installed, unittest otherwise. Test modules whose
+    own content and local imports are unchanged (by content hash) since their last
+    passing run are not run again.
+
+    Args:
+        work_dir (str): Working directory, the root tests are imported from
+        path (str): Test file, or directory searched for test files
+        pattern (str): Glob pattern of the test file names
+        use_cache (bool): If False, also run the modules unchanged since they last passed
+        timeout (int): Maximum execution time of each shard in seconds
+        max_workers (int): Maximum number of shards run at the same time (default: one per CPU)
+
+    Returns:
+        str: Counts of passed, failed and skipped tests with the tracebacks of the
+        failing tests only, or error message
+
+    Examples:
+        run_tests('.')
+        run_tests('.', path='tests/test_parser.py', use_cache=False)
+    """
+    abs_working_dir = os.path.abspath(work_dir)
+    abs_path = os.path.abspath(os.path.join(work_dir, path))
+    if not is_within(abs_path, abs_working_dir):
+        return f"Error: Path {path} is not within the working directory {work_dir}"
+    if os.path.isfile(abs_path):
+        modules = [abs_path]
+    elif os.path.isdir(abs_path):
+        try:
+            index = get_workspace_index(abs_working_dir)
+            rel_dir = os.path.relpath(abs_path, index.root).replace(os.sep, "/")
+            rows = index.query(pattern, "" if rel_dir == "." else rel_dir)
+        except Exception as e:
+            return f"Error: {e}"
+        modules = [os.path.join(index.root, rel_path) for rel_path, _, _ in rows if rel_path.endswith(".py")]
+        modules = [m for m in modules if os.path.isfile(m) and m.startswith(abs_working_dir + os.sep)]
+    else:
+        return f"Error: Path {path} does not exist"
+    if not modules:
+        return f"No test files matching {pattern} in {path}"
+
+    runner = "pytest" if importlib.util.find_spec("pytest") is not None else "unittest"
+    previous = _load_results(abs_working_dir) if use_cache else {}
+    units = []
+    unchanged = []
+    not_run = 0
+    hashes = {}
+    for module in modules:
+        rel_path = os.path.relpath(module, abs_working_dir)
+        try:
+            module_units, _ = parse_test_module(module)
+            hashes[rel_path] = dependency_hash(abs_working_dir, module)
+        except (OSError, SyntaxError, ValueError) as e:
+            return f"Error: Cannot read {rel_path}: {e}"
+        if previous.get(rel_path, {}).get("hash") == hashes[rel_path]:
+            unchanged.append(rel_path)
+            continue
+        dotted = os.path.splitext(rel_path)[0].replace(os.sep, ".")
+        if runner == "pytest":
+            ids = [(f"{rel_path}::{name}", count) for name, _, count in module_units] or [(rel_path, 1)]
+        else:
+            ids = [(f"{dotted}.{name}", count) for name, is_unittest, count in module_units if is_unittest]
+            not_run += sum(count for _, is_unittest, count in module_units if not is_unittest)
+            if not module_units:
+                ids = [(dotted, 1)]
+        units += [(test_id, rel_path, count) for test_id, count in ids]
+
+    started = time.perf_counter()
+    shards = _make_shards(units, max_workers or os.cpu_count() or 1)
+    reports = []
+    if shards:
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            reports = list(executor.map(lambda shard: _run_shard(abs_working_dir, runner, shard, timeout), shards))
+        # Tests may write files: the next query of the workspace index refreshes it
+        notify_workspace_changed(abs_working_dir)
+    elapsed = time.perf_counter() - started
+
+    passed = sum(report["passed"] for report in reports)
+    skipped = sum(report["skipped"] for report in reports)
+    failures = []
+    load_errors = []
+    failed_modules = set()
+    for shard, report in zip(shards, reports):
+        failures += report["failed"]
+        load_errors += report["load_errors"]
+        for test_id, _ in report["failed"] + report["load_errors"]:
+            modules_of = {rel_path for unit_id, rel_path, _ in shard
+                          if test_id.startswith(unit_id) or unit_id.startswith(test_id)}
+            # A crashed shard fails every module it ran
+            failed_modules |= modules_of or {rel_path for _, rel_path, _ in shard}
+
+    ran_modules = {rel_path for _, rel_path, _ in units}
+    _save_results(abs_working_dir, {
+        rel_path: None if rel_path in failed_modules else {"hash": hashes[rel_path], "passed_at": int(time.time())}
+        for rel_path in ran_modules
+    })
+
+    status = "Tests failed" if failures or load_errors else "Tests passed"
+    # Tests of modules that could not be imported did not run: counted apart
+    not_loaded = f", {len(load_errors)} not loaded" if load_errors else ""
+    lines = [f"{status}: {len(failures)} failed, {passed} passed, {skipped} skipped{not_loaded} in "
+             f"{len(ran_modules)} modules ({len(shards)} shards, {runner}, {elapsed:.1f}s)"]
+    if unchanged:
+        lines.append(f"Not run, unchanged since their last passing run: {', '.join(unchanged)} "
+                     f"(use_cache=False runs them)")
+    if not_run:
+        lines.append(f"Not run: {not_run} pytest-style tests (pytest is not installed)")
+    for test_id, trace in load_errors:
+        lines.append(f"\nNOT LOADED {test_id}\n{_trim_traceback(trace)}")
+    for test_id, trace in failures:
+        lines.append(f"\nFAILED {test_id}\n{_trim_traceback(trace)}")
+    return "\n".join(lines) + "\n"
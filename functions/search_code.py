@@ -0,0 +1,91 @@
+import os
+import re
+from config import MAX_CHARS, MAX_SEARCH_RESULTS
+from functions.trigram_index import get_trigram_index, required_literals, read_text_file
+from functions.registry import is_within
+
+
+def search_code(work_dir, query, is_regex=False, ignore_case=False, dir=".", context_lines=0,
+                max_results=MAX_SEARCH_RESULTS):
+    """
+    Search the workspace for a literal string or a regular expression.
+
+    Candidate files are narrowed down with a trigram index before being scanned, so
+    only the files that can contain the query are read.
+
+    Args:
+        work_dir (str): Working directory (for security validation)
+        query (str): Text or regular expression to search for
+        is_regex (bool): If True, query is a Python regular expression
+        ignore_case (bool): If True, matching is case-insensitive
+        dir (str): Only search files under this relative directory
+        context_lines (int): Number of lines shown before and after each match
+        max_results (int): Maximum number of matches returned
+
+    Returns:
+        str: Matches as "path:line: text" (context lines as "path-line- text") or error message
+
+    Examples:
+        # Where is a function defined?
+        search_code('.', 'def get_file_content')
+
+        # Every call of an API, with 2 lines of context
+        search_code('.', r'client\\.models\\.\\w+\\(', is_regex=True, context_lines=2)
+    """
+    abs_working_dir = os.path.abspath(work_dir)
+    abs_dir = os.path.abspath(os.path.join(work_dir, dir))
+    if not is_within(abs_dir, abs_working_dir):
+        return f"Error: Directory {dir} is not within the working directory {work_dir}"
+    if not query:
+        return "Error: query is required"
+
+    flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+    try:
+        regex = re.compile(query if is_regex else re.escape(query), flags)
+    except re.error as e:
+        return f"Error: Invalid regular expression: {e}"
+
+    try:
+        index = get_trigram_index(abs_working_dir)
+        candidates = index.candidates(required_literals(query, is_regex))
+    except Exception as e:
+        return f"Error: {e}"
+
+    output = []
+    output_size = 0
+    match_count = 0
+    for rel_path in candidates:
+        abs_path = os.path.join(index.root, *rel_path.split("/"))
+        if not abs_path.startswith(abs_dir + os.sep):
+            continue
+        text = read_text_file(abs_path)
+        if text is None:
+            continue
+        display_path = os.path.relpath(abs_path, abs_working_dir)
+        lines = None
+        last_line = 0
+        line_number = 1
+        counted_up_to = 0
+        for match in regex.finditer(text):
+            if lines is None:
+                lines = text.split("\n")
+            line_number += text.count("\n", counted_up_to, match.start())
+            counted_up_to = match.start()
+            if line_number <= last_line:
+                continue
+            first = max(line_number - context_lines, last_line + 1)
+            last = min(line_number + context_lines, len(lines))
+            for n in range(first, last + 1):
+                separator = ":" if n == line_number else "-"
+                entry = f"{display_path}{separator}{n}{separator} {lines[n - 1]}\n"
+                output.append(entry)
+                output_size += len(entry)
+            last_line = last
+            match_count += 1
+            if match_count >= max_results or output_size >= MAX_CHARS:
+                output.append(f"[...Search stopped after {match_count} matches, narrow the query or dir]\n")
+                return "".join(output)
+
+    if not match_count:
+        return f"No matches for {query}"
+    return "".join(output)
@@ -0,0 +1,84 @@
+"""
+Runs one shard of tests for functions/run_tests.py and writes its results as JSON.
+
+Usage: python test_runner.py RESULT_FILE RUNNER TEST_ID [TEST_ID ...]
+
+RUNNER is pytest (test ids are node ids, path::Class) or unittest (test ids are dotted
+names, module.Class). The current directory is the root the tests are imported from.
+The results are written to RESULT_FILE rather than printed, so the output of the
+tests cannot corrupt them:
+
+    {"passed": 3, "skipped": 0, "failed": [[test_id, traceback], ...],
+     "load_errors": [[test_id, traceback], ...]}
+
+Load errors are the test modules (or names) that could not be imported or collected:
+they did not run, so they count neither as passed nor as failed tests.
+"""
+import io
+import json
+import os
+import sys
+import traceback
+import unittest
+
+
+def run_unittest(test_ids):
+    sys.path.insert(0, os.getcwd())
+    results = {"passed": 0, "skipped": 0, "failed": [], "load_errors": []}
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    for test_id in test_ids:
+        try:
+            suite.addTests(loader.loadTestsFromName(test_id))
+        except Exception:
+            results["load_errors"].append([test_id, traceback.format_exc()])
+    result = unittest.TextTestRunner(stream=io.StringIO(), verbosity=0).run(suite)
+    for test, trace in result.errors + result.failures:
+        # An ImportError is reported by the loader as a test that fails when it runs
+        if isinstance(test, unittest.loader._FailedTest):
+            results["load_errors"].append([test.id(), trace])
+        else:
+            results["failed"].append([test.id(), trace])
+    for test in result.unexpectedSuccesses:
+        results["failed"].append([test.id(), "Unexpected success"])
+    results["skipped"] = len(result.skipped)
+    results["passed"] = (result.testsRun - len(result.failures) - len(result.errors) - results["skipped"]
+                         - len(result.unexpectedSuccesses))
+    return results
+
+
+class PytestCollector:
+    def __init__(self):
+        self.results = {"passed": 0, "skipped": 0, "failed": [], "load_errors": []}
+
+    def pytest_runtest_logreport(self, report):
+        if report.failed:
+            name = report.nodeid if report.when == "call" else f"{report.nodeid} ({report.when})"
+            self.results["failed"].append([name, report.longreprtext])
+        elif report.skipped and report.when in ("setup", "call"):
+            self.results["skipped"] += 1
+        elif report.passed and report.when == "call":
+            self.results["passed"] += 1
+
+    def pytest_collectreport(self, report):
+        if report.failed:
+            self.results["load_errors"].append([report.nodeid, report.longreprtext])
+
+
+def run_pytest(test_ids):
+    import pytest
+
+    collector = PytestCollector()
+    pytest.main(["-q", "--tb=short", "-p", "no:cacheprovider", *test_ids], plugins=[collector])
+    return collector.results
+
+
+def main():
+    result_file, runner, test_ids = sys.argv[1], sys.argv[2], sys.argv[3:]
+    results = run_pytest(test_ids) if runner == "pytest" else run_unittest(test_ids)
+    with open(result_file, "w", encoding="utf-8") as f:
+        json.dump(results, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import os
+import threading
+from collections import OrderedDict, defaultdict
+
+from config import SEARCH_MAX_FILE_BYTES, MAX_OPEN_WORKSPACES
+from functions.workspace_index import get_workspace_index, ancestors
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+
+def trigrams(text):
+    """
+    Set of the lowercase trigrams of a text, as tuples of 3 characters.
+    """
+    text = text.lower()
+    return set(zip(text, text[1:], text[2:]))
+
+
+def required_literals(pattern, is_regex):
+    """
+    Literal strings that every match of the query must contain.
+
+    Only runs of plain characters at the top level of a regex are used, which is
+    enough to narrow the candidate files. An empty list means any file can match.
+    """
+    if not is_regex:
+        return [pattern]
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return []
+
+    literals = []
+    run = []
+    for op, value in parsed:
+        if op == sre_parse.LITERAL:
+            run.append(chr(value))
+            continue
+        if run:
+            literals.append("".join(run))
+            run = []
+        if op == sre_parse.BRANCH:
+            # Any alternative can match, so nothing is required
+            return []
+    if run:
+        literals.append("".join(run))
+    return literals
+
+
+def read_text_file(abs_path):
+    """
+    Content of a text file, or None for binary or oversized files.
+    """
+    try:
+        if os.path.getsize(abs_path) > SEARCH_MAX_FILE_BYTES:
+            return None
+        with open(abs_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if b"\0" in data[:8192]:
+        return None
+    return data.decode("utf-8", errors="replace")
+
+
+class TrigramIndex:
+    """
+    In-memory inverted index from trigrams to the workspace files containing them.
+
+    A query only has to read the files that contain every trigram of its required
+    literals. Updated files get a new id, the postings of the old id are filtered out
+    lazily at query time. sync() re-indexes the files whose size or mtime changed
+    since they were indexed, whoever changed them.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._paths = []                    # file id -> rel path (None once replaced)
+        self._ids = {}                      # rel path -> current file id
+        self._postings = defaultdict(set)   # trigram -> file ids
+        self._indexed = {}                  # rel path -> (size, mtime_ns) when indexed
+        self.synced_version = None          # WorkspaceIndex.version of the last sync
+        self._lock = threading.Lock()
+
+    def sync(self, files):
+        """
+        Bring the index in step with the files of the workspace: index the new and
+        changed files, drop the removed ones.
+
+        Args:
+            files (list): (rel path, size, mtime_ns) of every file of the workspace
+        """
+        current = {rel_path: (size, mtime_ns) for rel_path, size, mtime_ns in files}
+        with self._lock:
+            stale = [rel_path for rel_path in self._indexed if rel_path not in current]
+            stale += [rel_path for rel_path, key in current.items() if self._indexed.get(rel_path) != key]
+        for rel_path in stale:
+            self.update_file(rel_path)
+
+    def update_file(self, rel_path):
+        """
+        (Re-)index a file, or drop it if it no longer exists or is not text.
+        """
+        abs_path = os.path.join(self.root, *rel_path.split("/"))
+        try:
+            # Stat before reading: a change made meanwhile is seen by the next sync
+            stat_result = os.stat(abs_path)
+            indexed = (stat_result.st_size, stat_result.st_mtime_ns)
+        except OSError:
+            indexed = None
+        text = read_text_file(abs_path) if indexed is not None else None
+        with self._lock:
+            old_id = self._ids.pop(rel_path, None)
+            if old_id is not None:
+                self._paths[old_id] = None
+            if indexed is None:
+                self._indexed.pop(rel_path, None)
+            else:
+                self._indexed[rel_path] = indexed
+            if text is None:
+                return
+            file_id = len(self._paths)
+            self._paths.append(rel_path)
+            self._ids[rel_path] = file_id
+            for trigram in trigrams(text):
+                self._postings[trigram].add(file_id)
+
+    def candidates(self, literals):
+        """
+        Relative paths of the files that may contain all the literals, sorted.
+        """
+        query = set()
+        for literal in literals:
+            query |= trigrams(literal)
+        with self._lock:
+            if not query:
+                return sorted(self._ids)
+            postings = sorted((self._postings.get(t, set()) for t in query), key=len)
+            file_ids = set(postings[0])
+            for posting in postings[1:]:
+                file_ids &= posting
+                if not file_ids:
+                    break
+            return sorted(self._paths[i] for i in file_ids if self._paths[i] is not None)
+
+    def contains(self, abs_path):
+        return abs_path.startswith(self.root + os.sep)
+
+
+# root -> TrigramIndex, least recently used first
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_trigram_index(root):
+    """
+    Return the process-wide trigram index containing root, in step with the files on
+    disk: the workspace index is refreshed if needed and, if that changed it, the
+    files changed since they were indexed (by a script or another program) are
+    re-indexed. The writes of the agent are indexed as they happen.
+
+    At most MAX_OPEN_WORKSPACES indexes are kept, the least recently used is dropped.
+    """
+    workspace = get_workspace_index(root)
+    with _indexes_lock:
+        index = _indexes.get(workspace.root)
+        if index is None:
+            index = TrigramIndex(workspace.root)
+            _indexes[workspace.root] = index
+            while len(_indexes) > MAX_OPEN_WORKSPACES:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(workspace.root)
+    version = workspace.version
+    if index.synced_version != version:
+        index.sync(workspace.files())
+        index.synced_version = version
+    return index
+
+
+def release_workspace(root):
+    """
+    Drop the trigram indexes of a workspace (and of its subdirectories) once no run uses it.
+    """
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        for path in [path for path in _indexes if path == root or path.startswith(root + os.sep)]:
+            del _indexes[path]
+
+
+def notify_file_changed(abs_path):
+    """
+    Keep the open trigram indexes in step with a file written by the agent.
+    """
+    abs_path = os.path.abspath(abs_path)
+    for path in ancestors(os.path.dirname(abs_path)):
+        index = _indexes.get(path)
+        if index is not None:
+            index.update_file(os.path.relpath(abs_path, index.root).replace(os.sep, "/"))
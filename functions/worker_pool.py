@@ -0,0 +1,140 @@
+import json
+import os
+import queue
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from config import PYTHON_WORKER_POOL_SIZE, PYTHON_WORKER_PRELOAD
+from functions.output_capture import BoundedOutput, pump
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_worker.py")
+
+
+class WorkerDied(Exception):
+    pass
+
+
+class Worker:
+    """
+    A warm interpreter (functions/python_worker.py) that forks one child per script.
+    """
+
+    def __init__(self, preload):
+        self._sock, child_sock = socket.socketpair()
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT, str(child_sock.fileno())] + list(preload),
+            pass_fds=[child_sock.fileno()],
+            stdin=subprocess.DEVNULL,
+            env={**os.environ, "PYTHONUNBUFFERED": "1"},
+        )
+        child_sock.close()
+        self._buffer = b""
+
+    def _recv_message(self, deadline=None):
+        while b"\n" not in self._buffer:
+            self._sock.settimeout(None if deadline is None else max(deadline - time.monotonic(), 0.001))
+            data = self._sock.recv(4096)
+            if not data:
+                raise WorkerDied("Python worker exited")
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return json.loads(line)
+
+    def run(self, abs_file_path, cli_args, cwd, timeout, capture):
+        """
+        Run a script in a fresh fork of the worker, streaming its output into capture.
+
+        Returns:
+            int: Exit code of the script, or None if it was killed after timeout seconds
+        """
+        read_fd, write_fd = os.pipe()
+        request = {"file": abs_file_path, "args": list(cli_args), "cwd": cwd}
+        try:
+            socket.send_fds(self._sock, [json.dumps(request).encode() + b"\n"], [write_fd])
+        except OSError as e:
+            os.close(read_fd)
+            raise WorkerDied(str(e))
+        finally:
+            os.close(write_fd)
+
+        reader = threading.Thread(target=pump, args=(os.fdopen(read_fd, "rb"), capture), daemon=True)
+        reader.start()
+        deadline = time.monotonic() + timeout
+        pid = self._recv_message(deadline)["pid"]
+        try:
+            returncode = self._recv_message(deadline)["returncode"]
+        except socket.timeout:
+            os.kill(pid, signal.SIGKILL)
+            self._recv_message()
+            returncode = None
+        # Child processes of the script may keep the pipe open
+        reader.join(timeout=1)
+        return returncode
+
+    def close(self):
+        self._sock.close()
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class WorkerPool:
+    """
+    Pool of warm Python interpreters for run_python_file (POSIX only).
+
+    Every worker imports the preload modules once at start-up, then forks a clean
+    child for each script, so a run pays neither interpreter start-up nor the import
+    of the preloaded modules.
+    """
+
+    def __init__(self, size=PYTHON_WORKER_POOL_SIZE, preload=PYTHON_WORKER_PRELOAD):
+        self.preload = list(preload)
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(Worker(self.preload))
+
+    def run(self, abs_file_path, cli_args, cwd, timeout, max_output_bytes):
+        """
+        Run a script on an idle worker (blocks while all workers are busy).
+
+        Returns:
+            tuple: (returncode, output), returncode is None on timeout
+        """
+        worker = self._idle.get()
+        capture = BoundedOutput(max_output_bytes)
+        try:
+            returncode = worker.run(abs_file_path, cli_args or [], cwd, timeout, capture)
+        except (WorkerDied, OSError):
+            # Replace the broken worker and report the failure like a crashed run
+            worker.close()
+            worker = Worker(self.preload)
+            raise
+        finally:
+            self._idle.put(worker)
+        return returncode, capture.getvalue()
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get().close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """
+    The process-wide worker pool, or None if disabled (size 0) or unsupported.
+    """
+    global _pool
+    if PYTHON_WORKER_POOL_SIZE <= 0 or not hasattr(os, "fork") or not hasattr(socket, "send_fds"):
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool()
+        return _pool
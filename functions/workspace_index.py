@@ -0,0 +1,421 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import (get_workspace_root, WORKSPACE_INDEX_DIR, INDEX_HASH_MAX_BYTES, INDEX_COMMIT_SECONDS,
+                    INDEX_REFRESH_SECONDS, MAX_OPEN_WORKSPACES)
+from functions.get_files_info import load_gitignore, is_ignored, ancestor_ignore_rules
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+"""
+
+SKIPPED_NAMES = (".git", WORKSPACE_INDEX_DIR)
+
+# mtime of a directory found but not listed yet: it never matches, so it gets scanned
+UNSCANNED = -1
+
+
+def hash_file(abs_path, size):
+    """
+    Content hash of a file (None for files larger than INDEX_HASH_MAX_BYTES).
+    """
+    if size > INDEX_HASH_MAX_BYTES:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(abs_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class WorkspaceIndex:
+    """
+    Persistent SQLite index of the files of a workspace (path, size, mtime, content hash).
+
+    The index lives in <root>/.magnet/index.sqlite3 and survives between runs. refresh()
+    only re-lists the directories whose mtime changed since the last run (added, removed
+    or renamed entries), and re-hashes only the files whose size or mtime changed.
+    Progress is committed as the scan goes, so a scan interrupted by the end of a short
+    run is resumed by the next one instead of starting over. A closed index reopens its
+    connection on next use.
+
+    Files and directories are stat'ed without holding the connection lock, so queries
+    and updates of other calls go on during a refresh. refresh_if_needed() skips the
+    refresh if one ran less than INDEX_REFRESH_SECONDS ago and no change was reported
+    since (mark_changed(), after a script ran).
+    """
+
+    def __init__(self, root, db_path=None):
+        self.root = os.path.abspath(root)
+        if db_path is None:
+            index_dir = os.path.join(self.root, WORKSPACE_INDEX_DIR)
+            os.makedirs(index_dir, exist_ok=True)
+            db_path = os.path.join(index_dir, "index.sqlite3")
+        self.db_path = db_path
+        # Tools run on worker threads, the lock serializes access to the connection
+        self._lock = threading.Lock()
+        # One refresh at a time, the calls waiting for it do not refresh again
+        self._refresh_lock = threading.Lock()
+        self._conn = None
+        self._refreshed_at = None
+        self._changes = 0           # changes reported by mark_changed()
+        self._refreshed_changes = 0
+        # Incremented by every refresh that changed the index (the writes of the agent
+        # are notified to the trigram index directly)
+        self.version = 0
+        with self._lock:
+            self._open()
+
+    def _open(self):
+        # Called with the lock held
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _abs(self, rel_path):
+        return os.path.join(self.root, *rel_path.split("/")) if rel_path else self.root
+
+    def _rel(self, abs_path):
+        rel_path = os.path.relpath(abs_path, self.root).replace(os.sep, "/")
+        return "" if rel_path == "." else rel_path
+
+    def contains(self, abs_path):
+        return abs_path == self.root or abs_path.startswith(self.root + os.sep)
+
+    def refresh(self):
+        """
+        Bring the index up to date with the workspace.
+
+        Returns:
+            dict: Number of scanned directories, updated files and removed files
+        """
+        with self._refresh_lock:
+            return self._refresh()
+
+    def refresh_if_needed(self):
+        """
+        Refresh the index unless it was refreshed less than INDEX_REFRESH_SECONDS ago
+        and no change was reported since.
+
+        Returns:
+            dict: The stats of the refresh, or None if it was not needed
+        """
+        if self._is_fresh():
+            return None
+        with self._refresh_lock:
+            # Refreshed by another call while this one waited
+            if self._is_fresh():
+                return None
+            return self._refresh()
+
+    def mark_changed(self):
+        """
+        Report that files may have changed (a script ran): the next refresh_if_needed()
+        refreshes the index.
+        """
+        self._changes += 1
+
+    def _is_fresh(self):
+        return (self._refreshed_at is not None and self._changes == self._refreshed_changes
+                and time.monotonic() - self._refreshed_at < INDEX_REFRESH_SECONDS)
+
+    def _refresh(self):
+        # Called with the refresh lock held. Changes made from now on are seen by the next refresh
+        started, changes = time.monotonic(), self._changes
+        stats = {"scanned_dirs": 0, "updated_files": 0, "removed_files": 0}
+        self._committed = started
+        with self._lock:
+            conn = self._open()
+            known_dirs = dict(conn.execute("SELECT path, mtime_ns FROM dirs"))
+            rows = conn.execute("SELECT path, dir, size, mtime_ns FROM files").fetchall() if known_dirs else []
+        if not known_dirs:
+            self._scan_tree("", ancestor_ignore_rules(self.root, self.root), known_dirs, stats)
+        else:
+            removed = set()
+            changed = {}
+            for rel_dir, mtime_ns in known_dirs.items():
+                try:
+                    stat_result = os.stat(self._abs(rel_dir))
+                except OSError:
+                    removed.add(rel_dir)
+                    continue
+                if stat_result.st_mtime_ns != mtime_ns:
+                    changed[rel_dir] = stat_result
+            # Files edited in place do not change the mtime of their directory
+            edited = []
+            for rel_path, rel_dir, size, mtime_ns in rows:
+                if rel_dir in removed or rel_dir in changed:
+                    continue
+                try:
+                    stat_result = os.stat(self._abs(rel_path))
+                except OSError:
+                    edited.append((rel_path, (size, mtime_ns)))
+                    continue
+                if (stat_result.st_size, stat_result.st_mtime_ns) != (size, mtime_ns):
+                    edited.append((rel_path, (size, mtime_ns)))
+
+            for rel_dir in removed:
+                with self._lock:
+                    self._open()
+                    self._remove_dir(rel_dir, stats)
+            for rel_dir, stat_result in changed.items():
+                ignore_rules = ancestor_ignore_rules(self.root, self._abs(rel_dir))
+                with self._lock:
+                    self._open()
+                    subdirs = self._scan_dir(rel_dir, stat_result, ignore_rules, stats)
+                    self._commit_progress()
+                for rel_subdir, sub_rules in subdirs:
+                    # Directories created since the last run are indexed as a whole
+                    if rel_subdir not in known_dirs:
+                        self._scan_tree(rel_subdir, sub_rules, known_dirs, stats)
+            for rel_path, indexed in edited:
+                with self._lock:
+                    self._open()
+                    self._update_file(rel_path, indexed, stats)
+        with self._lock:
+            self._open().commit()
+        self._refreshed_at, self._refreshed_changes = started, changes
+        if stats["scanned_dirs"] or stats["updated_files"] or stats["removed_files"]:
+            self.version += 1
+        return stats
+
+    def _scan_tree(self, rel_dir, ignore_rules, known_dirs, stats):
+        stack = [(rel_dir, ignore_rules)]
+        while stack:
+            rel_dir, ignore_rules = stack.pop()
+            try:
+                stat_result = os.stat(self._abs(rel_dir))
+            except OSError:
+                continue
+            with self._lock:
+                self._open()
+                stack.extend(self._scan_dir(rel_dir, stat_result, ignore_rules, stats))
+                self._commit_progress()
+
+    def _commit_progress(self):
+        if time.monotonic() - self._committed >= INDEX_COMMIT_SECONDS:
+            self._conn.commit()
+            self._committed = time.monotonic()
+
+    def _scan_dir(self, rel_dir, stat_result, ignore_rules, stats):
+        abs_dir = self._abs(rel_dir)
+        existing = {
+            name: (size, mtime_ns)
+            for name, size, mtime_ns in self._conn.execute(
+                "SELECT name, size, mtime_ns FROM files WHERE dir = ?", (rel_dir,))
+        }
+        seen = set()
+        subdirs = []
+        try:
+            with os.scandir(abs_dir) as it:
+                entries = list(it)
+        except OSError:
+            entries = []
+
+        for entry in entries:
+            if entry.name in SKIPPED_NAMES:
+                continue
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if is_ignored(ignore_rules, entry.path, entry.name, is_dir):
+                continue
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if is_dir:
+                # Recorded before it is listed, so an interrupted scan comes back to it
+                self._conn.execute("INSERT OR IGNORE INTO dirs (path, mtime_ns) VALUES (?, ?)",
+                                   (rel_path, UNSCANNED))
+                rules = load_gitignore(entry.path)
+                subdirs.append((rel_path, ignore_rules + [(entry.path, rules)] if rules else ignore_rules))
+                continue
+            if not entry.is_file():
+                continue
+            try:
+                entry_stat = entry.stat()
+            except OSError:
+                continue
+            seen.add(entry.name)
+            if existing.get(entry.name) != (entry_stat.st_size, entry_stat.st_mtime_ns):
+                self._upsert(rel_path, rel_dir, entry.name, entry_stat)
+                stats["updated_files"] += 1
+
+        for name in existing.keys() - seen:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (f"{rel_dir}/{name}" if rel_dir else name,))
+            stats["removed_files"] += 1
+        self._conn.execute("INSERT OR REPLACE INTO dirs (path, mtime_ns) VALUES (?, ?)",
+                           (rel_dir, stat_result.st_mtime_ns))
+        stats["scanned_dirs"] += 1
+        return subdirs
+
+    def _remove_dir(self, rel_dir, stats):
+        prefix = f"{rel_dir}/"
+        removed = self._conn.execute("DELETE FROM files WHERE dir = ? OR substr(dir, 1, ?) = ?",
+                                     (rel_dir, len(prefix), prefix))
+        stats["removed_files"] += removed.rowcount
+        self._conn.execute("DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+                           (rel_dir, len(prefix), prefix))
+
+    def _upsert(self, rel_path, rel_dir, name, stat_result):
+        content_hash = hash_file(self._abs(rel_path), stat_result.st_size)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files (path, dir, name, size, mtime_ns, hash) VALUES (?, ?, ?, ?, ?, ?)",
+            (rel_path, rel_dir, name, stat_result.st_size, stat_result.st_mtime_ns, content_hash),
+        )
+
+    def _update_file(self, rel_path, indexed, stats):
+        try:
+            stat_result = os.stat(self._abs(rel_path))
+        except OSError:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (rel_path,))
+            stats["removed_files"] += 1
+            return
+        if indexed != (stat_result.st_size, stat_result.st_mtime_ns):
+            rel_dir, _, name = rel_path.rpartition("/")
+            self._upsert(rel_path, rel_dir, name, stat_result)
+            stats["updated_files"] += 1
+
+    def update_path(self, abs_path):
+        """
+        Re-index a single file right after it was written (or deleted).
+        """
+        rel_path = self._rel(os.path.abspath(abs_path))
+        with self._lock, self._open():
+            row = self._conn.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (rel_path,)).fetchone()
+            self._update_file(rel_path, row, {"updated_files": 0, "removed_files": 0})
+
+    def query(self, pattern, rel_dir="", limit=None):
+        """
+        Find indexed files whose name or path matches a glob pattern.
+
+        A pattern without wildcards matches any name containing it.
+
+        Returns:
+            list: (path, size, hash) tuples, sorted by path
+        """
+        if not any(c in pattern for c in "*?["):
+            pattern = f"*{pattern}*"
+        sql = "SELECT path, size, hash FROM files WHERE (name GLOB ? OR path GLOB ?)"
+        params = [pattern, pattern]
+        if rel_dir:
+            sql += " AND substr(path, 1, ?) = ?"
+            params.extend([len(rel_dir) + 1, f"{rel_dir}/"])
+        sql += " ORDER BY path"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return self._open().execute(sql, params).fetchall()
+
+    def files(self):
+        """
+        Returns:
+            list: (path, size, mtime_ns) of every indexed file
+        """
+        with self._lock:
+            return self._open().execute("SELECT path, size, mtime_ns FROM files").fetchall()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# root -> WorkspaceIndex, least recently used first
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def ancestors(abs_path):
+    """
+    abs_path and its parent directories, up to the filesystem root.
+    """
+    while True:
+        yield abs_path
+        parent = os.path.dirname(abs_path)
+        if parent == abs_path:
+            return
+        abs_path = parent
+
+
+def get_workspace_index(root):
+    """
+    Return the process-wide index containing root, opened on first use and refreshed
+    if needed (see WorkspaceIndex.refresh_if_needed): files changed by scripts or
+    other programs are found too.
+
+    A directory of the active workspace uses the index of the whole workspace, so a
+    call with work_dir="src" does not create a second index under src/. At most
+    MAX_OPEN_WORKSPACES indexes stay open, the least recently used is closed.
+    """
+    root = os.path.abspath(root)
+    workspace_root = os.path.abspath(get_workspace_root())
+    if root.startswith(workspace_root + os.sep):
+        root = workspace_root
+    with _indexes_lock:
+        index = None
+        for path in ancestors(root):
+            index = _indexes.get(path)
+            if index is not None:
+                _indexes.move_to_end(path)
+                break
+        if index is None:
+            index = WorkspaceIndex(root)
+            _indexes[root] = index
+            while len(_indexes) > MAX_OPEN_WORKSPACES:
+                _, evicted = _indexes.popitem(last=False)
+                evicted.close()
+    # Only re-lists changed directories and re-hashes changed files
+    index.refresh_if_needed()
+    return index
+
+
+def release_workspace(root):
+    """
+    Close the indexes of a workspace (and of its subdirectories) once no run uses it.
+    """
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        for path in [path for path in _indexes if path == root or path.startswith(root + os.sep)]:
+            _indexes.pop(path).close()
+
+
+def notify_file_changed(abs_path):
+    """
+    Keep the open indexes in step with a file written by the agent.
+    """
+    abs_path = os.path.abspath(abs_path)
+    for path in ancestors(os.path.dirname(abs_path)):
+        index = _indexes.get(path)
+        if index is not None:
+            index.update_path(abs_path)
+
+
+def notify_workspace_changed(abs_dir):
+    """
+    Report that a script run in abs_dir may have changed any file of its workspace:
+    the next query refreshes the index instead of waiting for INDEX_REFRESH_SECONDS.
+    """
+    abs_dir = os.path.abspath(abs_dir)
+    for path in ancestors(abs_dir):
+        index = _indexes.get(path)
+        if index is not None:
+            index.mark_changed()
@@ -1,11 +1,141 @@
 import os
+import uuid
+from functions.file_cache import file_cache
+from functions import workspace_index, trigram_index
+from functions.registry import is_within
 
 
-def write_file(work_dir, file_path, content, target_content=None, start_line=None, end_line=None):
+class EditError(Exception):
+    pass
+
+
+def notify_file_written(abs_file_path):
+    """
+    Keep every cache and index in step with a file that was (or may have been) written.
+    """
+    # Never serve stale content from the read cache, even after a failed write
+    file_cache.invalidate(abs_file_path)
+    workspace_index.notify_file_changed(abs_file_path)
+    trigram_index.notify_file_changed(abs_file_path)
+
+
+def write_temp_file(abs_file_path, content):
+    """
+    Write content to a new temporary file next to abs_file_path and fsync it.
+
+    Returns:
+        str: Path of the temporary file, to be renamed over abs_file_path
+    """
+    directory, name = os.path.split(abs_file_path)
+    temp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.tmp")
+    # 0o666 lets the umask apply to new files, existing files keep their mode
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        # Written as given: no newline translation
+        with open(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(abs_file_path):
+            os.chmod(temp_path, os.stat(abs_file_path).st_mode)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+
+def atomic_write(abs_file_path, content):
+    """
+    Replace a file with content so that readers see either the old or the new file,
+    never a partial write (temporary file, fsync, rename).
+    """
+    os.replace(write_temp_file(abs_file_path, content), abs_file_path)
+
+
+def apply_edits(lines, edits):
+    """
+    Splice several non-overlapping hunks into a file in a single pass.
+
+    Args:
+        lines (list): Lines of the file (with line endings)
+        edits (list): Dicts with content, start_line, end_line (1-indexed, inclusive, as
+            numbered in the original file) and optional target_content
+
+    Returns:
+        list: The new lines
+
+    Raises:
+        EditError: On an invalid or overlapping range, or a target_content mismatch
+    """
+    hunks = sorted(edits, key=lambda edit: edit["start_line"])
+    for previous, edit in zip([None] + hunks, hunks):
+        start_line, end_line = edit["start_line"], edit["end_line"]
+        if previous is not None and start_line <= previous["end_line"]:
+            raise EditError(f"Edits [{previous['start_line']}, {previous['end_line']}] and "
+                            f"[{start_line}, {end_line}] overlap")
+        # Validate line range is within file bounds
+        if end_line > len(lines):
+            raise EditError(f"end_line {end_line} exceeds file length {len(lines)}")
+
+        # Extract target section for validation (if target_content provided)
+        target_content = edit.get("target_content")
+        if target_content is not None:
+            target_section = ''.join(lines[start_line - 1:end_line])
+
+            # Normalize whitespace for comparison (strip trailing whitespace on each line)
+            target_normalized = '\n'.join(line.rstrip() for line in target_section.splitlines())
+            expected_normalized = '\n'.join(line.rstrip() for line in target_content.splitlines())
+
+            if target_normalized != expected_normalized:
+                raise EditError(f"Target content mismatch at lines [{start_line}, {end_line}]. "
+                                f"File may have been modified. Expected:\n{expected_normalized}\n\nFound:\n{target_normalized}")
+
+    # Splice: lines before each hunk + new content, then the rest of the file
+    new_lines = []
+    position = 0
+    for edit in hunks:
+        content = edit.get("content") or ""
+        # Ensure content ends with newline (unless it's meant to be empty)
+        if content and not content.endswith('\n'):
+            content += '\n'
+        new_lines.extend(lines[position:edit["start_line"] - 1])
+        if content:
+            new_lines.append(content)
+        position = edit["end_line"]
+    new_lines.extend(lines[position:])
+    return new_lines
+
+
+def _validate_ranges(edits):
+    for edit in edits:
+        start_line, end_line = edit.get("start_line"), edit.get("end_line")
+        if start_line is None or end_line is None or start_line < 1 or end_line < start_line:
+            raise EditError(f"Invalid line range [{start_line}, {end_line}]")
+
+
+def _read_lines(abs_file_path, file_path):
+    if not os.path.isfile(abs_file_path):
+        raise EditError(f"File {file_path} does not exist")
+    with open(abs_file_path, 'r', encoding='utf-8') as f:
+        return f.readlines()
+
+
+def _resolve_path(work_dir, file_path):
+    # Security: Validate file is within working directory
+    abs_working_dir = os.path.abspath(work_dir)
+    abs_file_path = os.path.abspath(os.path.join(work_dir, file_path))
+    if not is_within(abs_file_path, abs_working_dir):
+        raise EditError(f"File {file_path} is not within the working directory {work_dir}")
+    return abs_file_path
+
+
+def write_file(work_dir, file_path, content="", target_content=None, start_line=None, end_line=None, edits=None):
     """
     Write or modify a file using line-based splicing.
-    It supports both full file overwrites and targeted line-range replacements.
-    
+    It supports full file overwrites, targeted line-range replacements and batches of
+    line-range replacements applied in a single pass. The file is always replaced
+    atomically (temporary file, fsync, rename).
+
     Args:
         work_dir (str): Working directory (for security validation)
         file_path (str): Relative path to the file
@@ -13,84 +143,149 @@ def write_file(work_dir, file_path, content, target_content=None, start_line=Non
         target_content (str, optional): Expected content at the target range (for validation)
         start_line (int, optional): Starting line number (1-indexed, inclusive)
         end_line (int, optional): Ending line number (1-indexed, inclusive)
-    
+        edits (list, optional): Non-overlapping hunks, dicts with content, start_line,
+            end_line and optional target_content, numbered as in the original file
+
     Returns:
         str: Success message or error message
-    
+
     Behavior:
+        - If edits is provided: Applies every hunk, or none if one of them is invalid
         - If start_line and end_line are None: Overwrites entire file with content
         - If start_line and end_line are provided: Replaces lines [start_line, end_line] with content
         - If target_content is provided: Validates that the target range matches before replacing
-    
+
     Examples:
         # Overwrite entire file
         write_file('/project', 'test.py', 'print("hello")')
-        
+
         # Replace lines 5-10 with new content
         write_file('/project', 'test.py', 'new_code()', start_line=5, end_line=10)
-        
+
         # Replace with validation
-        write_file('/project', 'test.py', 'new_code()', 
+        write_file('/project', 'test.py', 'new_code()',
                    target_content='old_code()', start_line=5, end_line=10)
+
+        # Replace lines 3-4 and 20 in one pass
+        write_file('/project', 'test.py', '', edits=[
+            {'start_line': 3, 'end_line': 4, 'content': 'a = 1'},
+            {'start_line': 20, 'end_line': 20, 'content': 'b = 2'},
+        ])
     """
-    # Security: Validate file is within working directory
-    abs_working_dir = os.path.abspath(work_dir)
-    abs_file_path = os.path.abspath(os.path.join(work_dir, file_path))
-    
-    if not abs_file_path.startswith(abs_working_dir):
-        return f"Error: File {file_path} is not within the working directory {work_dir}"
-    
     try:
-        # Case 1: Full file overwrite (no line ranges specified)
+        abs_file_path = _resolve_path(work_dir, file_path)
+    except EditError as e:
+        return f"Error: {e}"
+
+    try:
+        # Case 1: Batch of hunks
+        if edits:
+            _validate_ranges(edits)
+            lines = _read_lines(abs_file_path, file_path)
+            atomic_write(abs_file_path, ''.join(apply_edits(lines, edits)))
+            return f"Success: Applied {len(edits)} edits to {file_path}"
+
+        # Case 2: Full file overwrite (no line ranges specified)
         if start_line is None or end_line is None:
-            with open(abs_file_path, 'w', encoding='utf-8') as f:
-                f.write(content)
+            atomic_write(abs_file_path, content)
             return f"Success: File {file_path} written successfully"
-        
-        # Case 2: Line-based splice (targeted replacement)
-        # Validate line numbers
-        if start_line < 1 or end_line < start_line:
-            return f"Error: Invalid line range [{start_line}, {end_line}]"
-        
-        # Read existing file content
-        if not os.path.isfile(abs_file_path):
-            return f"Error: File {file_path} does not exist"
-        
-        with open(abs_file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        # Validate line range is within file bounds
-        if end_line > len(lines):
-            return f"Error: end_line {end_line} exceeds file length {len(lines)}"
-        
-        # Extract target section for validation (if target_content provided)
-        if target_content is not None:
-            target_section = ''.join(lines[start_line - 1:end_line])
-            
-            # Normalize whitespace for comparison (strip trailing whitespace on each line)
-            target_normalized = '\n'.join(line.rstrip() for line in target_section.splitlines())
-            expected_normalized = '\n'.join(line.rstrip() for line in target_content.splitlines())
-            
-            if target_normalized != expected_normalized:
-                return (f"Error: Target content mismatch at lines [{start_line}, {end_line}]. "
-                       f"File may have been modified. Expected:\n{expected_normalized}\n\nFound:\n{target_normalized}")
-        
-        # Ensure content ends with newline (unless it's meant to be empty)
-        if content and not content.endswith('\n'):
-            content += '\n'
-        
-        # Splice: before + new content + after
-        new_lines = (
-            lines[:start_line - 1] +           # Lines before the target range
-            ([content] if content else []) +    # New content (as a single element)
-            lines[end_line:]                    # Lines after the target range
-        )
-        
-        # Write back atomically
-        with open(abs_file_path, 'w', encoding='utf-8') as f:
-            f.writelines(new_lines)
-        
+
+        # Case 3: Line-based splice (targeted replacement)
+        edit = {"start_line": start_line, "end_line": end_line, "content": content, "target_content": target_content}
+        _validate_ranges([edit])
+        lines = _read_lines(abs_file_path, file_path)
+        atomic_write(abs_file_path, ''.join(apply_edits(lines, [edit])))
         return f"Success: Replaced lines [{start_line}, {end_line}] in {file_path}"
-        
+
     except Exception as e:
-        return f"Error: {e}"
\ No newline at end of file
+        return f"Error: {e}"
+    finally:
+        notify_file_written(abs_file_path)
+
+
+def _plan_change(work_dir, change):
+    file_path = change.get("file_path")
+    if not file_path:
+        raise EditError(f"Invalid change {change!r}, file_path is required")
+    abs_file_path = _resolve_path(work_dir, file_path)
+    original = None
+    if os.path.isfile(abs_file_path):
+        # Read as is, so a rollback restores the exact bytes
+        with open(abs_file_path, 'r', encoding='utf-8', newline='') as f:
+            original = f.read()
+
+    edits = change.get("edits")
+    if edits is None and change.get("start_line") is not None:
+        edits = [change]
+    if edits:
+        _validate_ranges(edits)
+        if original is None:
+            raise EditError(f"File {file_path} does not exist")
+        try:
+            new_content = ''.join(apply_edits(original.splitlines(keepends=True), edits))
+        except EditError as e:
+            raise EditError(f"{file_path}: {e}")
+    else:
+        new_content = change.get("content") or ""
+    return abs_file_path, file_path, new_content, original
+
+
+def write_files(work_dir, changes):
+    """
+    Apply changes to several files as one transaction: all of them or none.
+
+    Every change is validated and every new file is written to a temporary file (and
+    fsynced) before the first one is renamed into place. If a rename fails, the files
+    already replaced are restored.
+
+    Args:
+        work_dir (str): Working directory (for security validation)
+        changes (list): Dicts with file_path and either content (full overwrite) or
+            edits (hunks as in write_file)
+
+    Returns:
+        str: Success message or error message
+
+    Examples:
+        write_files('/project', [
+            {'file_path': 'app/api.py', 'edits': [{'start_line': 3, 'end_line': 3, 'content': 'from app.db import connect'}]},
+            {'file_path': 'app/db.py', 'content': 'def connect():\\n    ...\\n'},
+        ])
+    """
+    if not isinstance(changes, list) or not changes:
+        return "Error: changes must be a non-empty list"
+
+    # Phase 1: compute every new file in memory, nothing is written if one is invalid
+    try:
+        plans = [_plan_change(work_dir, change) for change in changes]
+    except Exception as e:
+        return f"Error: {e}. No file was changed"
+    if len({plan[0] for plan in plans}) != len(plans):
+        return "Error: A file appears in several changes, merge its edits into one change. No file was changed"
+
+    temp_paths = []
+    committed = []
+    try:
+        # Phase 2: durable temporary files
+        for abs_file_path, _, new_content, _ in plans:
+            temp_paths.append(write_temp_file(abs_file_path, new_content))
+        # Phase 3: rename into place
+        for plan, temp_path in zip(plans, temp_paths):
+            os.replace(temp_path, plan[0])
+            committed.append(plan)
+    except Exception as e:
+        for temp_path in temp_paths[len(committed):]:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        # Roll back the files already replaced
+        for abs_file_path, _, _, original in reversed(committed):
+            if original is None:
+                os.remove(abs_file_path)
+            else:
+                atomic_write(abs_file_path, original)
+        return f"Error: {e}. No file was changed"
+    finally:
+        for plan in plans:
+            notify_file_written(plan[0])
+
+    return f"Success: Changed {len(plans)} files: {', '.join(plan[1] for plan in plans)}"
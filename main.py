@@ -1,141 +1,214 @@
 import os
-from google import genai
-from google.genai import types
-from dotenv import load_dotenv
-import json
 import argparse
 import sys
-from functions.get_files_info import get_files_info
-from functions.run_python_file import run_python_file
-from functions.get_file_content import get_file_content
-from functions.write_file import write_file
-from config import SYSTEM_PROMPT
-from functions.schemas import schema_get_files_info, schema_write_file, schema_run_python_file, schema_get_file_content
+import threading
+import time
+from agent.response_cache import MODES, OFF, REPLAY
+from agent.tracing import Tracer
+from config import (get_workspace_root, RESPONSE_CACHE_MODE, RESPONSE_CACHE_DIR, TRACE_FILE, SESSION_DIR,
+                    SERVER_MAX_SESSIONS, MAX_TOOL_SUBPROCESSES, PREFETCH_ENABLED)
 
-load_dotenv()
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-model_name = os.getenv("GEMINI_MODEL")
+# google.genai and the agent loop take most of the start-up time: they are only
+# imported once the arguments are valid (see --profile-startup).
+
+
+def create_client(cache_mode=OFF):
+    """
+    Gemini client behind the model call scheduler (rate limit, retries, deadlines),
+    wrapped in the response cache unless cache_mode is off.
+    In replay mode no API key is needed: every response comes from the cache.
+    """
+    if cache_mode == REPLAY:
+        client = None
+    else:
+        from google import genai
+        from agent.scheduler import ModelScheduler
+
+        client = ModelScheduler(genai.Client(api_key=os.getenv("GEMINI_API_KEY")))
+    if cache_mode == OFF:
+        return client
+    from agent.response_cache import CachingClient
+
+    return CachingClient(client, os.path.join(get_workspace_root(), RESPONSE_CACHE_DIR), cache_mode)
+
+
+def warm_workspace_index():
+    try:
+        from functions.workspace_index import get_workspace_index
+
+        get_workspace_index(get_workspace_root())
+    except Exception:
+        pass  # find_files reports the error if the index cannot be opened
+
+
+def profile_startup(args):
+    """
+    Time each start-up step of a run (without calling the model) and print a report.
+    A step that fails (e.g. creating the client without GEMINI_API_KEY) is reported
+    with its error, and the next steps are still timed.
+    """
+    phases = []
+    started = time.perf_counter()
+
+    def phase(name, step):
+        phase_started = time.perf_counter()
+        try:
+            step()
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        phases.append((name, time.perf_counter() - phase_started, error))
+
+    modules_before = len(sys.modules)
+    phase("load .env", lambda: __import__("dotenv").load_dotenv())
+    phase("import google.genai", lambda: __import__("google.genai"))
+    phase("import agent loop and tools", lambda: __import__("agent.loop"))
+    phase("create client", lambda: create_client(args.cache))
+    phase("build system prompt", lambda: __import__("config").get_system_prompt())
+    phase("build tool declarations and config", lambda: sys.modules["agent.loop"].build_generate_config())
+    total = time.perf_counter() - started
+
+    print("Startup profile (python -X importtime main.py ... details the imports):")
+    for name, seconds, error in phases:
+        print(f"  {name:<36} {seconds * 1000:8.1f} ms" + (f"  failed: {error}" if error else ""))
+    print(f"  {'total':<36} {total * 1000:8.1f} ms")
+    print(f"  {len(sys.modules) - modules_before} modules imported")
+
+
+def serve(args, tracer):
+    """
+    Run the agent server (agent/server.py) until interrupted.
+    """
+    import asyncio
+    from dotenv import load_dotenv
+    from agent.server import AgentServer
+    from functions.run_python_file import set_max_subprocesses
+
+    load_dotenv()
+    set_max_subprocesses(args.max_subprocesses)
+    server = AgentServer(
+        create_client(args.cache),
+        os.getenv("GEMINI_MODEL"),
+        args.workspaces,
+        max_sessions=args.max_sessions,
+        max_turns=args.max_turns,
+        tracer=tracer,
+        prefetch=args.prefetch,
+    )
+    try:
+        asyncio.run(server.serve(args.serve))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tracer.close()
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--prompt", "-p", type=str, required=True)
+    parser.add_argument("--prompt", "-p", type=str)
     parser.add_argument("--verbose", "-v", action="store_true", default=False)
     parser.add_argument("--max-turns", type=int, default=4, help="Maximum number of function calling turns")
+    parser.add_argument("--cache", choices=MODES, default=RESPONSE_CACHE_MODE,
+                        help="Record model responses to disk and/or replay them (default: off)")
+    parser.add_argument("--trace", default=TRACE_FILE, metavar="FILE",
+                        help="Append spans of the run (turns, model calls, tools) to FILE as JSON lines")
+    parser.add_argument("--resume", metavar="SESSION",
+                        help="Continue an interrupted session (the prompt, if any, is added as a new message)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Print the time of each start-up step and exit without calling the model")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                        help="Serve agent runs over HTTP on host:port (or unix:PATH) instead of running a prompt")
+    parser.add_argument("--workspaces", default=".", metavar="DIR",
+                        help="Server mode: directory holding the workspace of each run (default: current directory)")
+    parser.add_argument("--max-sessions", type=int, default=SERVER_MAX_SESSIONS,
+                        help="Server mode: maximum number of runs executing at the same time")
+    parser.add_argument("--max-subprocesses", type=int, default=MAX_TOOL_SUBPROCESSES,
+                        help="Maximum number of scripts run by tools at the same time (0: unlimited)")
+    parser.add_argument("--prefetch", action="store_true", default=PREFETCH_ENABLED,
+                        help="Load the files the model will likely read next while it is thinking")
     args = parser.parse_args()
-    
+    if args.profile_startup:
+        profile_startup(args)
+        return
+    if args.serve:
+        serve(args, Tracer(args.trace, enabled=bool(args.trace or args.verbose)))
+        return
+    if not args.prompt and not args.resume:
+        parser.error("the following arguments are required: --prompt/-p (or --resume)")
+
+    # Refresh the workspace index while the first model call is in flight
+    threading.Thread(target=warm_workspace_index, daemon=True).start()
+
+    # Metrics are only collected when they are exported or printed
+    tracer = Tracer(args.trace, enabled=bool(args.trace or args.verbose))
+    session = None
+    prefetcher = None
+
     try:
-        messages = [
-            types.Content(role="user", parts=[types.Part(text=args.prompt)])
-        ]
-
-        available_functions = types.Tool(
-            function_declarations=[
-                schema_get_files_info,
-                schema_get_file_content,
-                schema_write_file,
-                schema_run_python_file,
-            ]
-        )
-
-        config = types.GenerateContentConfig(
-            tools=[available_functions],
-            system_instruction=SYSTEM_PROMPT,
-        )
-
-        # Agentic loop: Keep calling functions until AI gives final answer
-        for turn in range(args.max_turns):
-            response = client.models.generate_content(
-                model=model_name,
-                contents=messages,
-                config=config,
-            )
-
-            # Check if AI wants to call functions
-            if response.function_calls:
-                if args.verbose:
-                    print(f"\n--- Turn {turn + 1}: AI wants to call {len(response.function_calls)} function(s) ---")
-                
-                # Add AI's response (with function calls) to conversation
-                messages.append(types.Content(
-                    role="model",
-                    parts=[types.Part(function_call=fc) for fc in response.function_calls]
-                ))
-                
-                # Execute each function call
-                function_responses = []
-                for function_call_part in response.function_calls:
-                    if args.verbose:
-                        print(f"Calling function: {function_call_part.name}({function_call_part.args})")
-                    
-                    # Route to appropriate function
-                    if function_call_part.name == "get_files_info":
-                        working_dir = function_call_part.args.get('working_dir', '.')
-                        dir_path = function_call_part.args.get('dir', '.')
-                        result = get_files_info(working_dir, dir_path)
-                        
-                    elif function_call_part.name == "get_file_content":
-                        working_dir = function_call_part.args.get('work_dir', '.')
-                        file_path = function_call_part.args.get('file_path', '')
-                        result = get_file_content(working_dir, file_path)
-                        
-                    elif function_call_part.name == "write_file":
-                        working_dir = function_call_part.args.get('work_dir', '.')
-                        file_path = function_call_part.args.get('file_path', '')
-                        content = function_call_part.args.get('content', '')
-                        target_content = function_call_part.args.get('target_content', None)
-                        start_line = function_call_part.args.get('start_line', None)
-                        end_line = function_call_part.args.get('end_line', None)
-                        result = write_file(working_dir, file_path, content, target_content, start_line, end_line)
-
-                    elif function_call_part.name == "run_python_file":
-                        working_dir = function_call_part.args.get('work_dir', '.')
-                        file_path = function_call_part.args.get('file_path', '')
-                        timeout = function_call_part.args.get('timeout', 30)
-                        interactive = function_call_part.args.get('interactive', False)
-                        cli_args = function_call_part.args.get('cli_args', None)
-                        result = run_python_file(working_dir, file_path, timeout, interactive, cli_args)
-                        
-                    else:
-                        result = f"Error: Unknown function call: {function_call_part.name}"
-                    
-                    if args.verbose:
-                        print(f"Function result:\n{result}\n")
-                    
-                    # Add function response
-                    function_responses.append(
-                        types.Part(function_response=types.FunctionResponse(
-                            name=function_call_part.name,
-                            response={"result": result}
-                        ))
-                    )
-                
-                # Add function results to conversation
-                messages.append(types.Content(
-                    role="user",
-                    parts=function_responses
-                ))
-                
-                # Loop continues - AI will decide what to do next
-                
-            else:
-                # No function calls - AI has final answer
-                if args.verbose:
-                    print(f"\n--- Turn {turn + 1}: AI provided final answer ---")
-                print(response.text)
-                break
+        import asyncio
+        from dotenv import load_dotenv
+        from agent.loop import run_agent
+        from agent.scheduler import scheduler_of
+        from agent.session import Session
+        from functions.run_python_file import set_max_subprocesses
+
+        load_dotenv()
+        set_max_subprocesses(args.max_subprocesses)
+        model_name = os.getenv("GEMINI_MODEL")
+        client = create_client(args.cache)
+        if args.prefetch:
+            from agent.prefetch import Prefetcher
+
+            prefetcher = Prefetcher()
+
+        # Every step is checkpointed, so an interrupted run can be continued
+        session_dir = os.path.join(get_workspace_root(), SESSION_DIR)
+        if args.resume:
+            session = Session.open(session_dir, args.resume)
         else:
-            # Max turns reached
-            print(f"Warning: Reached maximum number of turns ({args.max_turns})")
-            if response.text:
-                print(response.text)
+            session = Session.create(session_dir)
+        if args.verbose:
+            print(f"Session: {session.id}")
+
+        # Agentic loop runs on the streaming API: text is printed as it arrives
+        answer = asyncio.run(run_agent(
+            client,
+            model_name,
+            args.prompt,
+            max_turns=args.max_turns,
+            verbose=args.verbose,
+            tracer=tracer,
+            session=session,
+            prefetcher=prefetcher,
+        ))
+        if answer is None:
+            print(f"Continue this session with: python main.py --resume {session.id}")
+        if args.verbose:
+            print(f"\n--- Metrics ---\n{tracer.summary()}")
+        if args.verbose and args.cache != OFF:
+            print(f"Response cache: {client.hits} hits, {client.misses} misses")
+        scheduler = scheduler_of(client)
+        if args.verbose and scheduler is not None:
+            print(f"Model calls: {scheduler.metrics()}")
+        if args.verbose and prefetcher is not None:
+            print(f"Prefetch: {prefetcher.stats()}")
                 
+    except KeyboardInterrupt:
+        if session is not None:
+            print(f"\nInterrupted. Continue this session with: python main.py --resume {session.id}")
     except Exception as e:
         print(f"Error: {e}")
+        if session is not None:
+            print(f"Continue this session with: python main.py --resume {session.id}")
         if args.verbose:
             import traceback
             traceback.print_exc()
     finally:
+        if session is not None:
+            session.close()
+        if prefetcher is not None:
+            prefetcher.close()
+        tracer.close()
         sys.exit(0)
 
 
@@ -2,22 +2,62 @@ import unittest
 from unittest.mock import patch, mock_open, MagicMock
 from functions.get_files_info import get_files_info
 from functions.get_file_content import get_file_content
-from functions.write_file import write_file
+from functions.write_file import write_file, write_files
+from functions.apply_patch import apply_patch
+from functions.run_python_file import run_python_file
+from functions.run_tests import run_tests, dependencies
+from functions.worker_pool import WorkerPool
+from functions.file_cache import FileCache, file_cache
+from functions.get_files_content import get_files_content, split_budget
+from functions.get_file_outline import get_file_outline, get_symbol
+from functions.find_files import find_files
+from functions import workspace_index, trigram_index
+from functions.search_code import search_code
+from agent.dispatcher import dispatch_function_calls
+from functions.registry import ToolRegistry
+from agent.loop import run_agent
+from agent.context import ContextManager
+from agent.budget import TokenEstimator, estimator, truncate, fit_results
+from agent.response_cache import CachingClient, CacheMiss, request_key
+from agent.tracing import Tracer, NULL_SPAN
+from agent.session import Session, SessionError
+from agent.server import AgentServer, HTTPError
+from agent.scheduler import ModelScheduler, DeadlineExceeded, set_priority
+from agent.prefetch import Prefetcher, predict_reads
+import json
+from google.genai import types
+import asyncio
+import io
 import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+import config
 from config import MAX_CHARS
 
+def make_dir_entry(name, is_dir, size):
+    entry = MagicMock()
+    entry.name = name
+    entry.path = f"/path/to/{name}"
+    entry.is_dir.return_value = is_dir
+    entry.stat.return_value.st_size = size
+    return entry
+
 class TestGetFilesInfo(unittest.TestCase):
     @patch('os.path.abspath')
     @patch('os.path.join')
-    @patch('os.path.isdir')
-    @patch('os.path.getsize')
-    @patch('os.listdir')
-    def test_get_files_info_success(self, mock_listdir, mock_getsize, mock_isdir, mock_join, mock_abspath):
+    @patch('os.scandir')
+    def test_get_files_info_success(self, mock_scandir, mock_join, mock_abspath):
         mock_abspath.side_effect = lambda x: f"/path/to/{x}"
         mock_join.side_effect = lambda a, b: f"{a}/{b}"
-        mock_listdir.return_value = ['file.txt', 'folder']
-        mock_isdir.side_effect = lambda path: 'folder' in path
-        mock_getsize.return_value = 123
+        mock_scandir.return_value.__enter__.return_value = [
+            make_dir_entry('folder', True, 123),
+            make_dir_entry('file.txt', False, 123),
+        ]
         
         result = get_files_info('work', 'dir')
         
@@ -33,15 +73,52 @@ class TestGetFilesInfo(unittest.TestCase):
         self.assertEqual(result, "Error: Directory ../unsafe is not within the working directory safe")
 
     @patch('os.path.abspath')
-    @patch('os.listdir')
-    def test_get_files_info_empty_dir(self, mock_listdir, mock_abspath):
+    @patch('os.scandir')
+    def test_get_files_info_empty_dir(self, mock_scandir, mock_abspath):
         mock_abspath.side_effect = lambda x: f"/path/to/{x}"
-        mock_listdir.return_value = []
+        mock_scandir.return_value.__enter__.return_value = []
         
         result = get_files_info('work')
         
         self.assertEqual(result, "")
 
+class TestGetFilesInfoRecursive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = self.tmp.name
+        for rel_path in ['main.py', 'pkg/a.py', 'pkg/sub/b.py', 'pkg/notes.txt', 'build/out.py', 'pkg/keep.log']:
+            path = os.path.join(self.work_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write("x")
+        with open(os.path.join(self.work_dir, '.gitignore'), 'w') as f:
+            f.write("build/\n*.log\n!keep.log\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def listed_paths(self, result):
+        return [line[2:].split(':')[0] for line in result.splitlines() if line.startswith('- ')]
+
+    def test_recursive_respects_gitignore(self):
+        paths = self.listed_paths(get_files_info(self.work_dir, recursive=True))
+
+        self.assertIn('pkg/sub/b.py', paths)
+        self.assertIn('pkg/keep.log', paths)
+        self.assertNotIn('build', paths)
+        self.assertNotIn('build/out.py', paths)
+
+    def test_pattern_and_max_depth(self):
+        paths = self.listed_paths(get_files_info(self.work_dir, recursive=True, pattern='*.py', max_depth=2))
+
+        self.assertEqual(paths, ['main.py', 'pkg/a.py'])
+
+    def test_max_entries_truncates(self):
+        result = get_files_info(self.work_dir, recursive=True, max_entries=2)
+
+        self.assertEqual(len(self.listed_paths(result)), 2)
+        self.assertIn("Listing truncated at 2 entries", result)
+
 class TestGetFileContent(unittest.TestCase):
     @patch('os.path.isfile')
     @patch('os.path.abspath')
@@ -90,66 +167,52 @@ class TestGetFileContent(unittest.TestCase):
         self.assertEqual(result, "Error: File test.txt does not exist")
 
 class TestWriteFile(unittest.TestCase):
-    @patch('os.path.isfile')
-    @patch('os.path.abspath')
-    @patch('os.path.join')
-    @patch('builtins.open', new_callable=mock_open)
-    def test_write_file_full_overwrite(self, mock_file, mock_join, mock_abspath, mock_isfile):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, content):
+        with open(os.path.join(self.work_dir, name), 'w') as f:
+            f.write(content)
+
+    def read(self, name):
+        with open(os.path.join(self.work_dir, name)) as f:
+            return f.read()
+
+    def test_write_file_full_overwrite(self):
         """Test full file overwrite (no line ranges)"""
-        mock_join.return_value = '/work/test.py'
-        mock_abspath.side_effect = lambda x: f"/abs{x}" if x.startswith('/') else f"/abs/{x}"
-        
-        result = write_file('/work', 'test.py', 'print("Hello")\n')
+        result = write_file(self.work_dir, 'test.py', 'print("Hello")\n')
         
-        # Verify file was opened in write mode
-        mock_file.assert_called_once_with('/abs/work/test.py', 'w', encoding='utf-8')
-        # Verify content was written
-        mock_file().write.assert_called_once_with('print("Hello")\n')
+        # Verify content was written, and no temporary file is left behind
+        self.assertEqual(self.read('test.py'), 'print("Hello")\n')
+        self.assertEqual(os.listdir(self.work_dir), ['test.py'])
         self.assertIn("Success", result)
     
-    @patch('os.path.isfile')
-    @patch('os.path.abspath')
-    @patch('builtins.open', new_callable=mock_open)
-    def test_write_file_line_splice_without_validation(self, mock_file, mock_abspath, mock_isfile):
+    def test_write_file_line_splice_without_validation(self):
         """Test line-based replacement without target validation"""
-        mock_abspath.side_effect = lambda x: f"/abs/{x}"
-        mock_isfile.return_value = True
-        
-        # Mock file content: 5 lines
-        original_content = "line1\nline2\nline3\nline4\nline5\n"
-        mock_file.return_value.readlines.return_value = original_content.splitlines(keepends=True)
+        # File content: 5 lines
+        self.write('test.py', "line1\nline2\nline3\nline4\nline5\n")
         
         # Replace lines 2-3 with new content
-        result = write_file('/work', 'test.py', 'new_line\n', start_line=2, end_line=3)
+        result = write_file(self.work_dir, 'test.py', 'new_line\n', start_line=2, end_line=3)
         
         # Verify success
         self.assertIn("Success", result)
         self.assertIn("[2, 3]", result)
         
         # Verify the spliced content
-        handle = mock_file()
-        written_lines = []
-        for call in handle.writelines.call_args_list:
-            written_lines.extend(call[0][0])
-        
-        expected = ['line1\n', 'new_line\n', 'line4\n', 'line5\n']
-        self.assertEqual(written_lines, expected)
+        self.assertEqual(self.read('test.py'), "line1\nnew_line\nline4\nline5\n")
     
-    @patch('os.path.isfile')
-    @patch('os.path.abspath')
-    @patch('builtins.open', new_callable=mock_open)
-    def test_write_file_line_splice_with_validation_success(self, mock_file, mock_abspath, mock_isfile):
+    def test_write_file_line_splice_with_validation_success(self):
         """Test line-based replacement with target validation (matching content)"""
-        mock_abspath.side_effect = lambda x: f"/abs/{x}"
-        mock_isfile.return_value = True
-        
-        # Mock file content
-        original_content = "line1\nold_code()\nline3\n"
-        mock_file.return_value.readlines.return_value = original_content.splitlines(keepends=True)
+        self.write('test.py', "line1\nold_code()\nline3\n")
         
         # Replace line 2 with validation
         result = write_file(
-            '/work', 'test.py', 
+            self.work_dir, 'test.py', 
             'new_code()\n',
             target_content='old_code()\n',
             start_line=2, 
@@ -158,7 +221,77 @@ class TestWriteFile(unittest.TestCase):
         
         # Verify success
         self.assertIn("Success", result)
+        self.assertEqual(self.read('test.py'), "line1\nnew_code()\nline3\n")
+
+    def test_write_file_batch_edits(self):
+        """Test several hunks applied in one pass, numbered as in the original file"""
+        self.write('test.py', "".join(f"line{i}\n" for i in range(1, 8)))
+
+        result = write_file(self.work_dir, 'test.py', '', edits=[
+            {'start_line': 6, 'end_line': 7, 'content': 'tail'},
+            {'start_line': 1, 'end_line': 1, 'content': 'a\nb\n'},
+            {'start_line': 3, 'end_line': 4, 'content': ''},
+        ])
+
+        self.assertEqual(result, "Success: Applied 3 edits to test.py")
+        self.assertEqual(self.read('test.py'), "a\nb\nline2\nline5\ntail\n")
+
+    def test_write_file_overlapping_edits(self):
+        self.write('test.py', "line1\nline2\nline3\n")
+
+        result = write_file(self.work_dir, 'test.py', '', edits=[
+            {'start_line': 1, 'end_line': 2, 'content': 'x'},
+            {'start_line': 2, 'end_line': 3, 'content': 'y'},
+        ])
+
+        self.assertEqual(result, "Error: Edits [1, 2] and [2, 3] overlap")
+        self.assertEqual(self.read('test.py'), "line1\nline2\nline3\n")
     
+    def test_write_files_all_or_nothing(self):
+        self.write('a.py', "a1\na2\n")
+        self.write('b.py', "b1\n")
+
+        result = write_files(self.work_dir, [
+            {'file_path': 'a.py', 'edits': [{'start_line': 1, 'end_line': 1, 'content': 'A1'}]},
+            {'file_path': 'b.py', 'edits': [{'start_line': 1, 'end_line': 1, 'content': 'B1', 'target_content': 'nope'}]},
+        ])
+
+        self.assertIn("b.py: Target content mismatch", result)
+        self.assertIn("No file was changed", result)
+        self.assertEqual(self.read('a.py'), "a1\na2\n")
+
+    def test_write_files_rolls_back_on_rename_failure(self):
+        self.write('a.py', "old\n")
+        real_replace = os.replace
+        calls = []
+
+        def failing_replace(src, dst):
+            calls.append(dst)
+            if len(calls) == 2:
+                raise OSError("disk full")
+            return real_replace(src, dst)
+
+        with patch('os.replace', side_effect=failing_replace):
+            result = write_files(self.work_dir, [
+                {'file_path': 'a.py', 'content': "new\n"},
+                {'file_path': 'c.py', 'content': "created\n"},
+            ])
+
+        self.assertEqual(result, "Error: disk full. No file was changed")
+        self.assertEqual(self.read('a.py'), "old\n")
+        self.assertEqual(sorted(os.listdir(self.work_dir)), ['a.py'])
+
+    def test_write_files_success(self):
+        self.write('a.py', "a1\n")
+
+        result = write_files(self.work_dir, [
+            {'file_path': 'a.py', 'edits': [{'start_line': 1, 'end_line': 1, 'content': 'A1'}]},
+            {'file_path': 'new.py', 'content': "n\n"},
+        ])
+
+        self.assertEqual(result, "Success: Changed 2 files: a.py, new.py")
+        self.assertEqual((self.read('a.py'), self.read('new.py')), ("A1\n", "n\n"))
+
     @patch('os.path.isfile')
     @patch('os.path.abspath')
     @patch('builtins.open', new_callable=mock_open)
@@ -236,9 +369,1397 @@ class TestWriteFile(unittest.TestCase):
         
         self.assertIn("Error: end_line 10 exceeds file length 3", result)
 
+class TestApplyPatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = self.tmp.name
+        with open(os.path.join(self.work_dir, 'app.py'), 'w') as f:
+            f.write("import os\n\n\ndef main():\n    debug = True\n    return debug\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self, name):
+        with open(os.path.join(self.work_dir, name)) as f:
+            return f.read()
+
+    def test_unified_diff_with_wrong_line_numbers(self):
+        """Hunks are located by content, header line numbers only break ties"""
+        patch = "--- a/app.py\n+++ b/app.py\n@@ -40,3 +40,3 @@\n def main():\n-    debug = True\n+    debug = False\n     return debug\n"
+        result = apply_patch(self.work_dir, patch)
+        self.assertEqual(result, "Success: Applied patch\napp.py: 1 hunk at line 4 (+1 -1)")
+        self.assertIn("    debug = False\n", self.read('app.py'))
+
+    def test_search_replace_ignoring_indentation(self):
+        patch = "app.py\n<<<<<<< SEARCH\ndebug = True\n=======\n    debug = False\n>>>>>>> REPLACE\n"
+        result = apply_patch(self.work_dir, patch)
+        self.assertIn("matched hunk 1 ignoring indentation", result)
+        self.assertIn("    debug = False\n", self.read('app.py'))
+
+    def test_replacement_moved_to_the_indentation_of_the_file(self):
+        patch = ("app.py\n<<<<<<< SEARCH\ndebug = True\nreturn debug\n=======\n"
+                 "debug = False\nif debug:\n    print('debug')\nreturn debug\n>>>>>>> REPLACE\n")
+        result = apply_patch(self.work_dir, patch)
+        self.assertIn("(+3 -1), matched hunk 1 ignoring indentation", result)
+        self.assertEqual(self.read('app.py'), "import os\n\n\ndef main():\n    debug = False\n    if debug:\n"
+                                              "        print('debug')\n    return debug\n")
+
+    def test_keeps_crlf_line_endings(self):
+        with open(os.path.join(self.work_dir, 'win.txt'), 'wb') as f:
+            f.write(b"a\r\nb\r\n")
+        result = apply_patch(self.work_dir, "win.txt\n<<<<<<< SEARCH\na\n=======\nA\n>>>>>>> REPLACE\n")
+        self.assertIn("(+1 -1)", result)
+        with open(os.path.join(self.work_dir, 'win.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b"A\r\nb\r\n")
+
+    def test_creates_new_file(self):
+        patch = "--- /dev/null\n+++ b/util.py\n@@ -0,0 +1,2 @@\n+def helper():\n+    pass\n"
+        result = apply_patch(self.work_dir, patch)
+        self.assertIn("util.py: created (+2)", result)
+        self.assertEqual(self.read('util.py'), "def helper():\n    pass\n")
+
+    def test_missing_hunk_changes_nothing(self):
+        patch = ("app.py\n<<<<<<< SEARCH\nimport os\n=======\nimport sys\n>>>>>>> REPLACE\n"
+                 "app.py\n<<<<<<< SEARCH\nnot in the file\n=======\nx\n>>>>>>> REPLACE\n")
+        result = apply_patch(self.work_dir, patch)
+        self.assertIn("Error: app.py: Hunk 2 not found", result)
+        self.assertIn("import os\n", self.read('app.py'))
+
+    def test_ambiguous_search_block(self):
+        patch = "app.py\n<<<<<<< SEARCH\n\n=======\n# blank\n>>>>>>> REPLACE\n"
+        result = apply_patch(self.work_dir, patch)
+        self.assertIn("matches 2 places", result)
+
+
+class TestGetFileContentRanges(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = self.tmp.name
+        with open(os.path.join(self.work_dir, 'app.log'), 'w') as f:
+            f.writelines(f"line {i}\n" for i in range(1, 5001))
+        file_cache.clear()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        file_cache.clear()
+
+    def test_line_range(self):
+        result = get_file_content(self.work_dir, 'app.log', start_line=2, end_line=3)
+
+        self.assertEqual(result, "[Lines 2-3 of 5000 in app.log]\nline 2\nline 3\n"
+                                 "[...4997 more lines, continue with start_line=4]")
+
+    def test_header_names_the_file_as_requested(self):
+        os.makedirs(os.path.join(self.work_dir, 'pkg'))
+        os.rename(os.path.join(self.work_dir, 'app.log'), os.path.join(self.work_dir, 'pkg', 'app.log'))
+        get_file_content(os.path.join(self.work_dir, 'pkg'), 'app.log', start_line=1, end_line=1)
+
+        result = get_file_content(self.work_dir, 'pkg/app.log', start_line=1, end_line=1)
+
+        self.assertTrue(result.startswith("[Lines 1-1 of 5000 in pkg/app.log]\n"))
+        result = get_file_content(self.work_dir, 'pkg/app.log', offset=0, limit=7)
+        self.assertTrue(result.startswith("[Bytes 0-7 of "))
+        self.assertIn(" in pkg/app.log]\n", result)
+
+    def test_range_of_empty_file(self):
+        open(os.path.join(self.work_dir, 'empty.txt'), 'w').close()
+
+        self.assertEqual(get_file_content(self.work_dir, 'empty.txt', start_line=1), "[Lines 0-0 of 0 in empty.txt]\n")
+        self.assertEqual(get_file_content(self.work_dir, 'empty.txt', start_line=1, end_line=50),
+                         "[Lines 0-0 of 0 in empty.txt]\n")
+        self.assertIn("exceeds file length 0", get_file_content(self.work_dir, 'empty.txt', start_line=2))
+
+    def test_tail_of_file(self):
+        result = get_file_content(self.work_dir, 'app.log', start_line=4999)
+
+        self.assertEqual(result, "[Lines 4999-5000 of 5000 in app.log]\nline 4999\nline 5000\n")
+
+    def test_large_range_cut_on_line_boundary(self):
+        result = get_file_content(self.work_dir, 'app.log', start_line=1)
+
+        body = result.split("\n", 1)[1]
+        self.assertLessEqual(len(body.rsplit("\n", 1)[0]), MAX_CHARS)
+        self.assertIn("more lines, continue with start_line=", result)
+
+    def test_byte_range(self):
+        result = get_file_content(self.work_dir, 'app.log', offset=7, limit=7)
+
+        self.assertTrue(result.startswith("[Bytes 7-14 of"))
+        self.assertIn("(5000 lines)", result)
+        self.assertIn("\nline 2\n", result)
+
+    def test_invalid_ranges(self):
+        self.assertIn("Error: start_line 6000 exceeds file length 5000",
+                      get_file_content(self.work_dir, 'app.log', start_line=6000))
+        self.assertIn("Error: Invalid line range",
+                      get_file_content(self.work_dir, 'app.log', start_line=5, end_line=2))
+        self.assertIn("Error: Use either",
+                      get_file_content(self.work_dir, 'app.log', start_line=1, offset=0))
+
+class TestWorkspaceIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = os.path.realpath(self.tmp.name)
+        for rel_path in ['main.py', 'pkg/config.py', 'pkg/util.txt']:
+            path = os.path.join(self.work_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write("x")
+
+    def tearDown(self):
+        index = workspace_index._indexes.pop(self.work_dir, None)
+        if index is not None:
+            index.close()
+        self.tmp.cleanup()
+
+    def test_find_files_by_glob_and_name(self):
+        self.assertEqual(find_files(self.work_dir, '*.py'), "- main.py: 1 bytes\n- pkg/config.py: 1 bytes\n")
+        self.assertEqual(find_files(self.work_dir, 'util', dir='pkg'), "- pkg/util.txt: 1 bytes\n")
+        self.assertEqual(find_files(self.work_dir, '*.rs'), "No files matching *.rs")
+
+    def test_write_file_updates_index(self):
+        find_files(self.work_dir, '*.py')
+        write_file(self.work_dir, 'pkg/new_module.py', "print('hi')\n")
+
+        self.assertIn("- pkg/new_module.py: 12 bytes", find_files(self.work_dir, 'new_module'))
+
+    def test_incremental_refresh(self):
+        index = workspace_index.WorkspaceIndex(self.work_dir)
+        index.refresh()
+        os.makedirs(os.path.join(self.work_dir, 'docs'))
+        with open(os.path.join(self.work_dir, 'docs', 'guide.md'), 'w') as f:
+            f.write("guide")
+        os.remove(os.path.join(self.work_dir, 'pkg', 'util.txt'))
+
+        stats = index.refresh()
+        paths = [row[0] for row in index.query('*')]
+        index.close()
+
+        # Only the root, pkg and the new docs directory are re-listed
+        self.assertEqual(stats['scanned_dirs'], 3)
+        self.assertEqual(paths, ['docs/guide.md', 'main.py', 'pkg/config.py'])
+
+    def test_interrupted_scan_is_resumed(self):
+        for i in range(3):
+            os.makedirs(os.path.join(self.work_dir, f'dir{i}'))
+            with open(os.path.join(self.work_dir, f'dir{i}', 'f.py'), 'w') as f:
+                f.write("y")
+        hashed = []
+
+        def interrupted_hash(abs_path, size):
+            if len(hashed) == 3:
+                raise KeyboardInterrupt
+            hashed.append(abs_path)
+            return "hash"
+
+        index = workspace_index.WorkspaceIndex(self.work_dir)
+        with patch('functions.workspace_index.INDEX_COMMIT_SECONDS', 0), \
+                patch('functions.workspace_index.hash_file', side_effect=interrupted_hash):
+            with self.assertRaises(KeyboardInterrupt):
+                index.refresh()
+        index.close()
+
+        # The next run only indexes what the interrupted one had not committed
+        index = workspace_index.WorkspaceIndex(self.work_dir)
+        stats = index.refresh()
+        paths = [row[0] for row in index.query('*')]
+        index.close()
+        self.assertEqual(stats['updated_files'], 6 - len(hashed))
+        self.assertEqual(paths, ['dir0/f.py', 'dir1/f.py', 'dir2/f.py', 'main.py', 'pkg/config.py', 'pkg/util.txt'])
+
+    def test_subdirectory_uses_the_workspace_index(self):
+        token = config._workspace_root.set(self.work_dir)
+        try:
+            self.assertEqual(find_files(os.path.join(self.work_dir, 'pkg'), 'config'), "- config.py: 1 bytes\n")
+        finally:
+            config._workspace_root.reset(token)
+        self.assertFalse(os.path.exists(os.path.join(self.work_dir, 'pkg', '.magnet')))
+        self.assertIn(self.work_dir, workspace_index._indexes)
+
+    def test_open_indexes_are_bounded_and_released(self):
+        roots = [os.path.join(self.work_dir, name) for name in ('a', 'b', 'c')]
+        for root in roots:
+            os.makedirs(root)
+        with patch('functions.workspace_index.MAX_OPEN_WORKSPACES', 2):
+            indexes = [workspace_index.get_workspace_index(root) for root in roots]
+        self.assertEqual(list(workspace_index._indexes), roots[1:])
+        # The evicted index reopens its connection if a run still holds it
+        self.assertIsNone(indexes[0]._conn)
+        self.assertEqual(indexes[0].query('*'), [])
+
+        workspace_index.release_workspace(self.work_dir)
+        self.assertEqual(list(workspace_index._indexes), [])
+        self.assertIsNone(indexes[2]._conn)
+        for index in indexes:
+            index.close()
+
+class TestSearchCode(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = os.path.realpath(self.tmp.name)
+        files = {
+            'app.py': "import os\n\ndef load_config(path):\n    return open(path).read()\n",
+            'pkg/util.py': "def helper():\n    return load_config('x')\n",
+            'data.bin': "load_config\0binary",
+        }
+        for rel_path, content in files.items():
+            path = os.path.join(self.work_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(content)
+
+    def tearDown(self):
+        trigram_index._indexes.pop(self.work_dir, None)
+        index = workspace_index._indexes.pop(self.work_dir, None)
+        if index is not None:
+            index.close()
+        self.tmp.cleanup()
+
+    def test_literal_search(self):
+        result = search_code(self.work_dir, 'load_config(')
+
+        self.assertEqual(result, "app.py:3: def load_config(path):\n"
+                                 "pkg/util.py:2:     return load_config('x')\n")
+
+    def test_regex_search_with_context(self):
+        result = search_code(self.work_dir, r'def \w+_config', is_regex=True, context_lines=1)
+
+        self.assertEqual(result, "app.py-2- \napp.py:3: def load_config(path):\napp.py-4-     return open(path).read()\n")
+
+    def test_index_follows_write_file(self):
+        search_code(self.work_dir, 'helper')
+        write_file(self.work_dir, 'pkg/util.py', "def renamed_helper():\n    pass\n")
+
+        self.assertIn("pkg/util.py:1: def renamed_helper", search_code(self.work_dir, 'renamed_helper'))
+        self.assertEqual(search_code(self.work_dir, 'load_config', dir='pkg'), "No matches for load_config")
+
+    def test_index_follows_changes_made_outside_write_file(self):
+        search_code(self.work_dir, 'helper')
+        find_files(self.work_dir, '*.py')
+        # An editor changes a file and creates another
+        with open(os.path.join(self.work_dir, 'app.py'), 'a') as f:
+            f.write("beta_token = 1\n")
+        with open(os.path.join(self.work_dir, 'new.py'), 'w') as f:
+            f.write("beta_token = 2\n")
+        os.remove(os.path.join(self.work_dir, 'pkg', 'util.py'))
+
+        # Seen once INDEX_REFRESH_SECONDS have passed
+        with patch('functions.workspace_index.INDEX_REFRESH_SECONDS', 0):
+            self.assertEqual(search_code(self.work_dir, 'beta_token'), "app.py:5: beta_token = 1\nnew.py:1: beta_token = 2\n")
+            self.assertEqual(find_files(self.work_dir, 'new.py'), "- new.py: 15 bytes\n")
+            self.assertEqual(search_code(self.work_dir, 'helper'), "No matches for helper")
+
+    def test_changes_of_a_script_are_seen_at_once(self):
+        with open(os.path.join(self.work_dir, 'gen.py'), 'w') as f:
+            f.write("open('generated.py', 'w').write('gamma_' + 'token = 1')\n")
+        with patch('functions.workspace_index.INDEX_REFRESH_SECONDS', 3600):
+            self.assertEqual(search_code(self.work_dir, 'gamma_token'), "No matches for gamma_token")
+            run_python_file(self.work_dir, 'gen.py')
+            self.assertEqual(search_code(self.work_dir, 'gamma_token'), "generated.py:1: gamma_token = 1\n")
+
+    def test_queries_do_not_refresh_a_fresh_index(self):
+        search_code(self.work_dir, 'helper')
+        index = workspace_index._indexes[self.work_dir]
+        with patch.object(index, '_refresh', wraps=index._refresh) as refresh, \
+                patch.object(trigram_index._indexes[self.work_dir], 'sync') as sync:
+            search_code(self.work_dir, 'helper')
+            find_files(self.work_dir, '*.py')
+            refresh.assert_not_called()
+            # A refresh that finds nothing new does not re-sync the trigram index
+            index.mark_changed()
+            search_code(self.work_dir, 'helper')
+            refresh.assert_called_once()
+            sync.assert_not_called()
+
+    def test_required_literals(self):
+        self.assertEqual(trigram_index.required_literals(r'client\.models\.\w+', True), ['client.models.'])
+        self.assertEqual(trigram_index.required_literals('foo|bar', True), [])
+
+class TestFileOutline(unittest.TestCase):
+    SOURCE = (
+        'import functools\n\n\n'
+        'class Shape:\n'
+        '    """A shape.\n\n    Long description.\n    """\n\n'
+        '    def __init__(self, sides):\n        self.sides = sides\n\n'
+        '    @functools.cache\n'
+        '    def area(self, scale: float = 1.0) -> float:\n        return 0.0\n\n\n'
+        'class Square(Shape):\n'
+        '    def __init__(self):\n        super().__init__(4)\n\n\n'
+        'async def draw(*shapes, color=None):\n    pass\n'
+    )
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = self.tmp.name
+        with open(os.path.join(self.work_dir, 'shapes.py'), 'w') as f:
+            f.write(self.SOURCE)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_outline_lists_signatures_and_ranges(self):
+        self.assertEqual(get_file_outline(self.work_dir, 'shapes.py'), (
+            "[Outline of shapes.py: 6 symbols, line ranges inclusive]\n"
+            "4-15 class Shape  # A shape.\n"
+            "    10-11 def __init__(self, sides)\n"
+            "    13-15 @functools.cache def area(self, scale: float=1.0) -> float\n"
+            "18-20 class Square(Shape)\n"
+            "    19-20 def __init__(self)\n"
+            "23-24 async def draw(*shapes, color=None)\n"
+        ))
+
+    def test_get_symbol(self):
+        self.assertEqual(get_symbol(self.work_dir, 'shapes.py', 'area'),
+                         "[Lines 13-15 of 24 in shapes.py]\n"
+                         "    @functools.cache\n    def area(self, scale: float = 1.0) -> float:\n        return 0.0\n")
+        self.assertIn("ambiguous", get_symbol(self.work_dir, 'shapes.py', '__init__'))
+        self.assertIn("super().__init__(4)", get_symbol(self.work_dir, 'shapes.py', 'Square.__init__'))
+        self.assertIn("No symbol Circle", get_symbol(self.work_dir, 'shapes.py', 'Circle'))
+
+    def test_parsed_once_and_refreshed_on_write(self):
+        get_file_outline(self.work_dir, 'shapes.py')
+        with patch('functions.get_file_outline.ast.parse') as mock_parse:
+            get_symbol(self.work_dir, 'shapes.py', 'draw')
+        mock_parse.assert_not_called()
+
+        write_file(self.work_dir, 'shapes.py', 'def circle(radius):\n    pass\n', start_line=23, end_line=24)
+        self.assertTrue(get_file_outline(self.work_dir, 'shapes.py').endswith("23-24 def circle(radius)\n"))
+
+class TestGetFilesContent(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = self.tmp.name
+        for name, content in [('small.py', "x = 1\n"), ('big.py', "y = 2\n" * 2000)]:
+            with open(os.path.join(self.work_dir, name), 'w') as f:
+                f.write(content)
+        file_cache.clear()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        file_cache.clear()
+
+    def test_reads_files_in_request_order(self):
+        result = get_files_content(self.work_dir, ['small.py', {'file_path': 'big.py', 'start_line': 2, 'end_line': 2}])
+
+        self.assertEqual(result, "=== small.py ===\nx = 1\n\n"
+                                 "=== big.py ===\n[Lines 2-2 of 2000 in big.py]\ny = 2\n"
+                                 "[...1998 more lines, continue with start_line=3]\n")
+
+    def test_shared_budget(self):
+        result = get_files_content(self.work_dir, ['small.py', 'big.py', 'missing.py'], max_chars=1000)
+
+        self.assertIn("=== small.py ===\nx = 1\n", result)
+        self.assertIn("Cut to share the read budget between 3 files", result)
+        self.assertIn("=== missing.py ===\nError: File missing.py does not exist", result)
+        self.assertLess(len(result), 1300)
+
+    def test_split_budget_gives_unused_share_to_larger_results(self):
+        self.assertEqual(split_budget([100, 50000, 20000, 10], 40000), [100, 19945, 19945, 10])
+
+    def test_invalid_files(self):
+        self.assertEqual(get_files_content(self.work_dir, []), "Error: files must be a non-empty list")
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = self.tmp.name
+        with open(os.path.join(self.work_dir, 'a.py'), 'w') as f:
+            f.write("old\n")
+        file_cache.clear()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        file_cache.clear()
+
+    def test_repeated_reads_hit_cache(self):
+        first = get_file_content(self.work_dir, 'a.py')
+        second = get_file_content(self.work_dir, 'a.py')
+
+        self.assertEqual(first, second)
+        self.assertEqual(file_cache.stats()['hits'], 1)
+        self.assertEqual(file_cache.stats()['misses'], 1)
+
+    def test_write_file_invalidates_entries(self):
+        get_file_content(self.work_dir, 'a.py')
+        write_file(self.work_dir, 'a.py', "new\n")
+
+        self.assertEqual(file_cache.stats()['entries'], 0)
+        self.assertEqual(get_file_content(self.work_dir, 'a.py'), "new\n")
+
+    def test_evicts_least_recently_used_over_budget(self):
+        cache = FileCache(max_bytes=10)
+        cache.put(('/a', 1, 4, None), "aaaa")
+        cache.put(('/b', 1, 4, None), "bbbb")
+        cache.get(('/a', 1, 4, None))
+        cache.put(('/c', 1, 4, None), "cccc")
+
+        self.assertIsNone(cache.get(('/b', 1, 4, None)))
+        self.assertEqual(cache.get(('/a', 1, 4, None)), "aaaa")
+        self.assertEqual(cache.stats()['bytes'], 8)
+
+class TestToolRegistry(unittest.TestCase):
+    def setUp(self):
+        def resize(work_dir, width, keep_ratio=False, tags=None):
+            """
+            Resize an image.
+
+            Args:
+                work_dir (str): Working directory
+                width (int): New width in pixels
+                keep_ratio (bool): If True, the height follows the width
+                tags (list of str, optional): Tags added to the image
+            """
+            return f"{work_dir}:{width}:{keep_ratio}:{tags}"
+
+        self.registry = ToolRegistry()
+        self.registry.register(resize, "Resizes an image.", aliases={"w": "width"})
+
+    def call(self, name, args):
+        return self.registry.call(types.FunctionCall(name=name, args=args))
+
+    def test_schema_generated_from_signature_and_docstring(self):
+        declaration = self.registry.tool().function_declarations[0]
+        properties = declaration.parameters.properties
+        self.assertEqual(declaration.parameters.required, ["work_dir", "width"])
+        self.assertEqual(properties["width"].type, types.Type.INTEGER)
+        self.assertEqual(properties["keep_ratio"].description,
+                         "If True, the height follows the width (default: False). Optional.")
+        self.assertEqual(properties["tags"].items.type, types.Type.STRING)
+        # Declarations are built once
+        self.assertIs(self.registry.tool(), self.registry.tool())
+
+    def test_arguments_are_coerced(self):
+        self.assertEqual(self.call("resize", {"work_dir": ".", "w": 64.0, "keep_ratio": "true"}),
+                         f"{os.getcwd()}:64:True:None")
+
+    def test_invalid_arguments(self):
+        self.assertIn("Missing required argument width", self.call("resize", {"work_dir": "."}))
+        self.assertIn("must be an integer", self.call("resize", {"work_dir": ".", "width": "wide"}))
+        self.assertIn("Unknown argument height", self.call("resize", {"work_dir": ".", "width": 1, "height": 2}))
+        self.assertEqual(self.call("crop", {}), "Error: Unknown function call: crop")
+        self.assertIn("outside the workspace", self.call("resize", {"work_dir": "..", "width": 1}))
+
+    def test_async_tool(self):
+        async def ping(work_dir):
+            """
+            Args:
+                work_dir (str): Working directory
+            """
+            await asyncio.sleep(0)
+            return "pong"
+
+        self.registry.register(ping, "Pings.")
+        self.assertEqual(self.call("ping", {"work_dir": "."}), "pong")
+
+
+class TestDispatchFunctionCalls(unittest.TestCase):
+    def test_results_keep_call_order(self):
+        """Slow calls finishing last must not reorder the results"""
+        def fake_call(fc):
+            time.sleep(fc.args['delay'])
+            return fc.args['file_path']
+
+        calls = [
+            SimpleNamespace(name='get_file_content', args={'work_dir': '.', 'file_path': f'f{i}.py', 'delay': d})
+            for i, d in enumerate([0.05, 0.0, 0.02])
+        ]
+        with patch('agent.dispatcher.call_function', side_effect=fake_call):
+            results = dispatch_function_calls(calls)
+
+        self.assertEqual(results, ['f0.py', 'f1.py', 'f2.py'])
+
+    def test_independent_reads_run_concurrently(self):
+        barrier = threading.Barrier(3, timeout=2)
+
+        def fake_call(fc):
+            barrier.wait()  # Raises BrokenBarrierError if the calls are serialized
+            return "ok"
+
+        calls = [SimpleNamespace(name='get_file_content', args={'work_dir': '.', 'file_path': f'f{i}.py'}) for i in range(3)]
+        with patch('agent.dispatcher.call_function', side_effect=fake_call):
+            results = dispatch_function_calls(calls)
+
+        self.assertEqual(results, ["ok", "ok", "ok"])
+
+    def test_reads_wait_for_scripts(self):
+        log = []
+
+        def fake_call(fc):
+            if fc.name == 'run_python_file':
+                time.sleep(0.05)
+            log.append(fc.name)
+            return "done"
+
+        calls = [
+            SimpleNamespace(name='run_python_file', args={'work_dir': '.', 'file_path': 'gen.py'}),
+            SimpleNamespace(name='get_file_content', args={'work_dir': '.', 'file_path': 'out.txt'}),
+        ]
+        with patch('agent.dispatcher.call_function', side_effect=fake_call):
+            dispatch_function_calls(calls)
+
+        self.assertEqual(log, ['run_python_file', 'get_file_content'])
+
+    def test_writes_to_same_path_run_in_order(self):
+        log = []
+
+        def fake_call(fc):
+            if fc.args['content'] == 'first':
+                time.sleep(0.05)
+            log.append(fc.args['content'])
+            return "done"
+
+        calls = [
+            SimpleNamespace(name='write_file', args={'work_dir': '.', 'file_path': 'a.py', 'content': 'first'}),
+            SimpleNamespace(name='write_file', args={'work_dir': '.', 'file_path': 'a.py', 'content': 'second'}),
+        ]
+        with patch('agent.dispatcher.call_function', side_effect=fake_call):
+            dispatch_function_calls(calls)
+
+        self.assertEqual(log, ['first', 'second'])
+
+def make_chunk(*parts):
+    return types.GenerateContentResponse(candidates=[
+        types.Candidate(content=types.Content(role="model", parts=list(parts)))
+    ])
+
+class FakeStreamingClient:
+    """Replays scripted chunk lists, one list per model turn"""
+    def __init__(self, turns):
+        self.turns = list(turns)
+        self.requests = []
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content_stream=self.generate_content_stream))
+
+    async def generate_content_stream(self, model, contents, config):
+        self.requests.append(list(contents))
+        chunks = self.turns.pop(0)
+
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+        return stream()
+
+class TestRunAgent(unittest.TestCase):
+    def test_streams_text_and_executes_function_calls(self):
+        call = types.FunctionCall(name='get_file_content', args={'work_dir': '.', 'file_path': 'a.py'})
+        client = FakeStreamingClient([
+            [make_chunk(types.Part(function_call=call))],
+            [make_chunk(types.Part(text="The file ")), make_chunk(types.Part(text="is empty."))],
+        ])
+        output = io.StringIO()
+
+        with patch('agent.dispatcher.call_function', return_value="") as mock_call:
+            answer = asyncio.run(run_agent(client, 'model', 'read a.py', output=output))
+
+        mock_call.assert_called_once()
+        self.assertEqual(answer, "The file is empty.")
+        self.assertEqual(output.getvalue(), "The file is empty.\n")
+        # Second request carries the function call and its response
+        function_response = client.requests[1][-1].parts[0].function_response
+        self.assertEqual(function_response.name, 'get_file_content')
+
+    def test_max_turns_reached(self):
+        call = types.FunctionCall(name='get_files_info', args={'working_dir': '.'})
+        client = FakeStreamingClient([[make_chunk(types.Part(function_call=call))]] * 2)
+
+        with patch('agent.dispatcher.call_function', return_value="- a.py: 0 bytes, is_dir: False\n"):
+            answer = asyncio.run(run_agent(client, 'model', 'list', max_turns=2, output=io.StringIO()))
+
+        self.assertIsNone(answer)
+
+class TestPrefetcher(unittest.TestCase):
+    FILES = {
+        'README.md': 'A package\n',
+        'pkg/__init__.py': '',
+        'pkg/util.py': 'def helper():\n    return 1\n',
+        'pkg/core.py': 'import os\nfrom pkg import util\nfrom .models import Model\n',
+        'pkg/models.py': 'class Model:\n    pass\n',
+        'tests/test_core.py': 'import unittest\n',
+        'notes.txt': 'unrelated\n',
+    }
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.realpath(self.tmp.name)
+        for rel_path, content in self.FILES.items():
+            os.makedirs(os.path.dirname(os.path.join(self.root, rel_path)), exist_ok=True)
+            with open(os.path.join(self.root, rel_path), 'w') as f:
+                f.write(content)
+        file_cache.clear()
+        # Tool calls resolve their work_dir against the workspace
+        self.workspace = config._workspace_root.set(self.root)
+        self.prefetcher = Prefetcher()
+
+    def tearDown(self):
+        self.prefetcher.close()
+        config._workspace_root.reset(self.workspace)
+        file_cache.clear()
+        self.tmp.cleanup()
+
+    def path(self, rel_path):
+        return os.path.join(self.root, rel_path)
+
+    def test_predictions(self):
+        predicted = predict_reads('get_file_content', {'work_dir': self.root, 'file_path': 'pkg/core.py'})
+        self.assertEqual(predicted, [self.path(p) for p in
+                                     ('pkg/__init__.py', 'pkg/util.py', 'pkg/models.py', 'tests/test_core.py')])
+        predicted = predict_reads('get_files_info', {'work_dir': self.root, 'dir': '.'})
+        self.assertEqual(predicted, [self.path('README.md')])
+        self.assertEqual(predict_reads('run_tests', {'work_dir': self.root}), [])
+
+    def test_prefetched_reads_are_hits_with_identical_results(self):
+        cold = get_file_content(self.root, 'pkg/util.py')
+        file_cache.clear()
+
+        read = types.FunctionCall(name='get_file_content', args={'work_dir': '.', 'file_path': 'pkg/core.py'})
+        self.prefetcher.schedule([read])
+        self.prefetcher.wait(timeout=10)
+        hits = file_cache.stats()['hits']
+        for rel_path in ('pkg/util.py', 'pkg/models.py'):
+            self.prefetcher.observe(types.FunctionCall(name='get_file_content',
+                                                       args={'work_dir': '.', 'file_path': rel_path}))
+        self.assertEqual(get_file_content(self.root, 'pkg/util.py'), cold)
+        self.assertEqual(file_cache.stats()['hits'], hits + 1)
+
+        # A file changed after its prefetch does not count
+        with open(self.path('pkg/__init__.py'), 'w') as f:
+            f.write('VERSION = 2\n')
+        self.prefetcher.observe(types.FunctionCall(name='get_files_content', args={
+            'work_dir': '.', 'files': [{'file_path': 'pkg/__init__.py'}, {'file_path': 'notes.txt'}]}))
+        self.assertEqual(self.prefetcher.stats(), {
+            'predicted': 4, 'loaded': 4, 'reads': 4, 'hits': 2, 'hit_rate': 0.5, 'coverage': 0.5,
+        })
+
+    def test_run_agent_messages_unchanged(self):
+        read = types.FunctionCall(name='get_file_content', args={'work_dir': '.', 'file_path': 'pkg/core.py'})
+        util = types.FunctionCall(name='get_file_content', args={'work_dir': '.', 'file_path': 'pkg/util.py'})
+
+        def run(prefetcher):
+            file_cache.clear()
+            client = FakeStreamingClient([
+                [make_chunk(types.Part(function_call=read))],
+                [make_chunk(types.Part(function_call=util))],
+                [make_chunk(types.Part(text="Done."))],
+            ])
+            generate = client.generate_content_stream
+
+            async def slow_model(**kwargs):
+                # The prefetch finishes while the model is thinking
+                if prefetcher is not None:
+                    await asyncio.to_thread(prefetcher.wait, 10)
+                return await generate(**kwargs)
+
+            client.aio.models.generate_content_stream = slow_model
+            answer = asyncio.run(run_agent(client, 'model', 'read core', output=io.StringIO(),
+                                           prefetcher=prefetcher))
+            return answer, [[message.model_dump() for message in request] for request in client.requests]
+
+        self.assertEqual(run(self.prefetcher), run(None))
+        self.assertEqual(self.prefetcher.stats()['hits'], 1)
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        call = types.FunctionCall(name='get_files_info', args={'working_dir': '.'})
+        self.turns = [
+            [make_chunk(types.Part(function_call=call))],
+            [make_chunk(types.Part(text="Two ")), make_chunk(types.Part(text="files."))],
+        ]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_agent(self, client):
+        with patch('agent.dispatcher.call_function', return_value="- a.py: 0 bytes, is_dir: False\n"):
+            return asyncio.run(run_agent(client, 'model', 'list', output=io.StringIO()))
+
+    def test_record_then_replay_offline(self):
+        recorder = CachingClient(FakeStreamingClient(self.turns), self.tmp.name, mode='record')
+        self.assertEqual(self.run_agent(recorder), "Two files.")
+
+        # No model at all: every response is served from disk
+        replayer = CachingClient(None, self.tmp.name, mode='replay')
+        self.assertEqual(self.run_agent(replayer), "Two files.")
+        self.assertEqual((replayer.hits, replayer.misses), (2, 0))
+
+    def test_replay_miss_raises(self):
+        replayer = CachingClient(None, self.tmp.name, mode='replay')
+        with self.assertRaises(CacheMiss):
+            self.run_agent(replayer)
+
+    def test_auto_calls_model_only_on_miss(self):
+        model = FakeStreamingClient(self.turns + self.turns)
+        client = CachingClient(model, self.tmp.name, mode='auto')
+        self.run_agent(client)
+        self.run_agent(client)
+        self.assertEqual(len(model.requests), 2)
+        self.assertEqual((client.hits, client.misses), (2, 2))
+
+    def test_key_depends_on_model_config_and_messages(self):
+        messages = [types.Content(role="user", parts=[types.Part(text="hi")])]
+        config = types.GenerateContentConfig(system_instruction="be brief")
+        key = request_key('model', messages, config)
+        self.assertEqual(key, request_key('model', [types.Content(role="user", parts=[types.Part(text="hi")])], config))
+        self.assertNotEqual(key, request_key('other', messages, config))
+        self.assertNotEqual(key, request_key('model', messages, types.GenerateContentConfig(system_instruction="x")))
+        self.assertNotEqual(key, request_key('model', messages + messages, config))
+
+    def test_key_does_not_depend_on_the_workspace_path(self):
+        messages = [types.Content(role="user", parts=[types.Part(text="hi")])]
+        keys = []
+        for name in ('checkout', 'other-checkout'):
+            workspace = os.path.join(self.tmp.name, name)
+            token = config.set_workspace_root(workspace)
+            try:
+                prompt = config.get_system_prompt()
+                self.assertIn(workspace, prompt)
+                keys.append(request_key('model', messages, types.GenerateContentConfig(system_instruction=prompt)))
+            finally:
+                config._workspace_root.reset(token)
+        self.assertEqual(keys[0], keys[1])
+
+class TestTracing(unittest.TestCase):
+    def test_spans_of_a_run(self):
+        call = types.FunctionCall(name='get_file_content', args={'work_dir': '.', 'file_path': 'a.py'})
+        answer = make_chunk(types.Part(text="Done."))
+        answer.usage_metadata = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=120, candidates_token_count=8)
+        client = FakeStreamingClient([[make_chunk(types.Part(function_call=call))], [answer]])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trace.jsonl')
+            tracer = Tracer(path)
+            with patch('agent.dispatcher.call_function', return_value="Error: File not found"):
+                asyncio.run(run_agent(client, 'model', 'read a.py', output=io.StringIO(), tracer=tracer))
+            tracer.close()
+            with open(path) as f:
+                spans = [json.loads(line) for line in f]
+
+        by_name = {}
+        for span in spans:
+            by_name.setdefault(span['name'], []).append(span)
+        run = by_name['agent.run'][0]
+        self.assertEqual(run['attributes']['turns'], 2)
+        self.assertTrue(all(span['trace_id'] == run['trace_id'] for span in spans))
+        tool = by_name['tool.call'][0]
+        self.assertEqual(tool['status'], 'error')
+        self.assertEqual(tool['attributes']['tool'], 'get_file_content')
+        self.assertIn(tool['parent_id'], [turn['span_id'] for turn in by_name['agent.turn']])
+        self.assertEqual(by_name['model.generate'][1]['attributes']['prompt_tokens'], 120)
+        metrics = tracer.metrics()
+        self.assertEqual(metrics['tool.call get_file_content']['errors'], 1)
+        self.assertEqual(metrics['model.generate']['response_tokens'], 8)
+
+    def test_disabled_tracer_hands_out_null_span(self):
+        tracer = Tracer(enabled=False)
+        self.assertIs(tracer.span("tool.call", tool="x"), NULL_SPAN)
+        self.assertEqual(tracer.metrics(), {})
+
+class TestStartup(unittest.TestCase):
+    def test_cli_import_does_not_load_genai(self):
+        code = "import sys, main, functions.call_function; print('google.genai' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), "False", result.stderr)
+
+    def test_profile_reports_a_failed_step(self):
+        env = {k: v for k, v in os.environ.items() if k not in ("GEMINI_API_KEY", "GOOGLE_API_KEY")}
+        with tempfile.TemporaryDirectory() as tmp:
+            # Run outside the repository so no .env provides a key
+            result = subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+                                     "--profile-startup"],
+                                    capture_output=True, text=True, cwd=tmp, env=env)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertNotIn("Traceback", result.stderr)
+        line = next(l for l in result.stdout.splitlines() if "create client" in l)
+        self.assertIn("failed: ValueError", line)
+        self.assertIn("build tool declarations and config", result.stdout)
+
+    def test_system_prompt_built_on_first_use(self):
+        import config
+        self.assertIs(config.SYSTEM_PROMPT, config.get_system_prompt())
+        self.assertIn(config.get_workspace_root(), config.SYSTEM_PROMPT)
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.read_call = types.FunctionCall(name='get_file_content', args={'work_dir': '.', 'file_path': 'a.py'})
+        self.write_call = types.FunctionCall(name='write_file', args={'work_dir': '.', 'file_path': 'a.py', 'content': 'x'})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_run_is_checkpointed_and_reloaded(self):
+        session = Session.create(self.tmp.name)
+        client = FakeStreamingClient([
+            [make_chunk(types.Part(function_call=self.read_call))],
+            [make_chunk(types.Part(text="Empty."))],
+        ])
+        with patch('agent.dispatcher.call_function', return_value=""):
+            asyncio.run(run_agent(client, 'model', 'read a.py', output=io.StringIO(), session=session))
+        session.close()
+
+        resumed = Session.open(self.tmp.name, session.id)
+        self.assertEqual([m.role for m in resumed.messages], ["user", "model", "user", "model"])
+        self.assertEqual(resumed.messages[2].parts[0].function_response.response, {"result": ""})
+        self.assertEqual(resumed.pending, [])
+        # The call before it runs, raw results as they arrive, then the response message as sent
+        with open(session.path) as f:
+            self.assertEqual([json.loads(line)["type"] for line in f],
+                             ["message", "call", "message", "result", "message", "message"])
+
+    def test_crash_while_streaming_does_not_rerun_started_calls(self):
+        session = Session.create(self.tmp.name)
+        client = FakeStreamingClient([[make_chunk(types.Part(function_call=self.write_call))]])
+
+        async def crash(*args, **kwargs):
+            stream = await FakeStreamingClient.generate_content_stream(client, *args, **kwargs)
+
+            async def interrupted():
+                async for chunk in stream:
+                    yield chunk
+                raise ConnectionError("process killed")
+            return interrupted()
+
+        client.aio.models.generate_content_stream = crash
+        with patch('agent.dispatcher.call_function', return_value="Successfully wrote") as mock_write:
+            with self.assertRaises(ConnectionError):
+                asyncio.run(run_agent(client, 'model', 'write a.py', output=io.StringIO(), session=session))
+        mock_write.assert_called_once()
+        session.close()
+
+        resumed = Session.open(self.tmp.name, session.id)
+        self.assertEqual([m.role for m in resumed.messages], ["user", "model"])
+        self.assertEqual([call.name for call, _ in resumed.pending], ['write_file'])
+        client = FakeStreamingClient([[make_chunk(types.Part(text="Done."))]])
+        with patch('agent.loop.call_function') as mock_call:
+            asyncio.run(run_agent(client, 'model', None, output=io.StringIO(), session=resumed))
+        mock_call.assert_not_called()
+        self.assertIn("was not run again", client.requests[0][-1].parts[0].function_response.response["result"])
+        resumed.close()
+
+        # The log stays consistent for the next resume
+        reloaded = Session.open(self.tmp.name, session.id)
+        self.assertEqual([m.role for m in reloaded.messages], ["user", "model", "user", "model"])
+        self.assertEqual(reloaded.pending, [])
+
+    def test_resumed_history_is_what_the_model_saw(self):
+        session = Session.create(self.tmp.name)
+        client = FakeStreamingClient([
+            [make_chunk(types.Part(function_call=self.read_call))],
+            [make_chunk(types.Part(text="Long."))],
+        ])
+        long_output = "".join(f"line {i} of the file\n" for i in range(3000))
+        with patch('agent.dispatcher.call_function', return_value=long_output):
+            asyncio.run(run_agent(client, 'model', 'read a.py', output=io.StringIO(), session=session))
+        session.close()
+
+        # Another process calibrates its estimator differently
+        with patch.object(estimator, 'scale', 2.5):
+            resumed = Session.open(self.tmp.name, session.id)
+        self.assertEqual(resumed.messages[2], client.requests[1][-1])
+        self.assertIn("omitted to fit the output budget", resumed.messages[2].parts[0].function_response.response["result"])
+
+    def test_resume_does_not_rerun_side_effects(self):
+        session = Session.create(self.tmp.name)
+        session.append_message(types.Content(role="user", parts=[types.Part(text="fix a.py")]))
+        session.append_message(types.Content(role="model", parts=[
+            types.Part(function_call=self.read_call), types.Part(function_call=self.write_call)]))
+        session.close()
+        with open(session.path, 'a') as f:
+            f.write('{"type": "res')  # Crashed while writing
+
+        resumed = Session.open(self.tmp.name, session.id)
+        self.assertEqual(len(resumed.pending), 2)
+        with open(session.path) as f:
+            self.assertTrue(f.read().endswith('}\n'))
+        client = FakeStreamingClient([[make_chunk(types.Part(text="Done."))]])
+        with patch('agent.loop.call_function', return_value="content of a.py") as mock_call:
+            answer = asyncio.run(run_agent(client, 'model', None, output=io.StringIO(), session=resumed))
+
+        self.assertEqual(answer, "Done.")
+        mock_call.assert_called_once_with(self.read_call)
+        results = [p.function_response.response["result"] for p in client.requests[0][-1].parts]
+        self.assertEqual(results[0], "content of a.py")
+        self.assertIn("was not run again", results[1])
+
+class EchoClient:
+    """Writes the prompt to out.txt in the workspace, then answers with it"""
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content_stream=self.generate_content_stream))
+
+    async def generate_content_stream(self, model, contents, config):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.02)
+        self.active -= 1
+        prompt = contents[0].parts[0].text
+        if len(contents) == 1:
+            call = types.FunctionCall(name='write_file', args={'work_dir': '.', 'file_path': 'out.txt', 'content': prompt})
+            chunks = [make_chunk(types.Part(function_call=call))]
+        else:
+            chunks = [make_chunk(types.Part(text=prompt))]
+
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+        return stream()
+
+class FlakyClient:
+    """Raises the scripted errors first, then streams the prompt back"""
+    def __init__(self, errors=(), delay=0):
+        self.errors = list(errors)
+        self.delay = delay
+        self.prompts = []
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content_stream=self.generate_content_stream))
+
+    async def generate_content_stream(self, model, contents, config):
+        await asyncio.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        self.prompts.append(contents)
+
+        async def stream():
+            yield make_chunk(types.Part(text=contents))
+        return stream()
+
+class APIError(Exception):
+    def __init__(self, code):
+        super().__init__(f"{code} error")
+        self.code = code
+
+class TestModelScheduler(unittest.TestCase):
+    async def generate(self, scheduler, prompt, priority=0):
+        set_priority(priority)
+        stream = await scheduler.aio.models.generate_content_stream(model='model', contents=prompt)
+        return [chunk.text async for chunk in stream]
+
+    def test_retries_transient_errors(self):
+        scheduler = ModelScheduler(FlakyClient([APIError(429), APIError(503)]), retry_base=0.01)
+        self.assertEqual(asyncio.run(self.generate(scheduler, "hi")), ["hi"])
+        metrics = scheduler.metrics()
+        self.assertEqual((metrics["retries"], metrics["rate_limited"], metrics["failures"]), (2, 1, 0))
+
+    def test_client_errors_are_not_retried(self):
+        client = FlakyClient([APIError(400)])
+        scheduler = ModelScheduler(client, retry_base=0.01)
+        with self.assertRaises(APIError):
+            asyncio.run(self.generate(scheduler, "hi"))
+        self.assertEqual(scheduler.metrics()["retries"], 0)
+
+    def test_rate_limit_serves_higher_priority_first(self):
+        client = FlakyClient()
+        scheduler = ModelScheduler(client, requests_per_minute=1200, burst=1)
+
+        async def scenario():
+            # The first call takes the only token, the others wait for the next ones
+            return await asyncio.gather(*(
+                self.generate(scheduler, prompt, priority)
+                for prompt, priority in [("first", 0), ("low", 0), ("high", 5)]
+            ))
+
+        asyncio.run(scenario())
+        self.assertEqual(client.prompts, ["first", "high", "low"])
+        metrics = scheduler.metrics()
+        self.assertEqual((metrics["throttled"], metrics["max_queue_depth"], metrics["queue_depth"]), (2, 2, 0))
+
+    def test_deadline(self):
+        scheduler = ModelScheduler(FlakyClient(delay=1), deadline=0.05)
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(self.generate(scheduler, "hi"))
+        self.assertEqual(scheduler.metrics()["deadline_exceeded"], 1)
+
+class TestAgentServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.client = EchoClient()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def request(self, port, method, path, body=None):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        data = json.dumps(body).encode() if body is not None else b""
+        writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+        response = await reader.read()
+        writer.close()
+        head, _, payload = response.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(payload)
+
+    def test_concurrent_runs_in_their_own_workspace(self):
+        async def scenario():
+            server = AgentServer(self.client, 'model', self.tmp.name, max_sessions=2)
+            runs = [await server.start({"prompt": f"task {i}"}) for i in range(4)]
+            await asyncio.gather(*(run.task for run in runs))
+            server.executor.shutdown()
+            return runs
+
+        runs = asyncio.run(scenario())
+        for i, run in enumerate(runs):
+            self.assertEqual((run.status, run.answer), ("done", f"task {i}"))
+            self.assertEqual(os.path.dirname(run.workspace), os.path.abspath(self.tmp.name))
+            with open(os.path.join(run.workspace, 'out.txt')) as f:
+                self.assertEqual(f.read(), f"task {i}")
+        self.assertEqual(self.client.max_active, 2)
+        # Tools resolve work_dir against the workspace of their run, not the server's cwd
+        self.assertFalse(os.path.exists('out.txt'))
+
+    def test_http_api(self):
+        async def scenario():
+            server = AgentServer(self.client, 'model', self.tmp.name)
+            listening = await server.start_server('127.0.0.1:0')
+            port = listening.sockets[0].getsockname()[1]
+            async with listening:
+                created = await self.request(port, "POST", "/runs", {"prompt": "hello", "workspace": "repo", "wait": True})
+                fetched = await self.request(port, "GET", f"/runs/{created[1]['id']}")
+                health = await self.request(port, "GET", "/health")
+                escaped = await self.request(port, "POST", "/runs", {"prompt": "x", "workspace": "../x"})
+                missing = await self.request(port, "GET", "/runs/nope")
+            server.executor.shutdown()
+            return created, fetched, health, escaped, missing
+
+        created, fetched, health, escaped, missing = asyncio.run(scenario())
+        self.assertEqual(created[0], 200)
+        self.assertEqual(created[1]["answer"], "hello")
+        self.assertEqual(created[1]["output"], "hello\n")
+        self.assertEqual(fetched, (200, created[1]))
+        self.assertEqual(health[1]["runs"]["done"], 1)
+        self.assertEqual(escaped[0], 400)
+        self.assertEqual(missing[0], 404)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp.name, 'repo', 'out.txt')))
+
+    def test_rejects_shared_workspaces_and_session_paths(self):
+        async def scenario():
+            server = AgentServer(self.client, 'model', self.tmp.name)
+            statuses = []
+            for request in ({"workspace": "."}, {"workspace": ".."}, {"workspace": "a/b"},
+                            {"workspace": "repo", "resume": "../../../x"}, {"resume": "20250101-120000-zzzzzz"}):
+                try:
+                    await server.start({"prompt": "x", **request})
+                except HTTPError as e:
+                    statuses.append(e.status)
+            server.executor.shutdown()
+            return statuses
+
+        self.assertEqual(asyncio.run(scenario()), [400] * 5)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+        with self.assertRaises(SessionError):
+            Session.open(self.tmp.name, '../x')
+
+    def test_runs_cannot_reach_a_sibling_workspace(self):
+        os.makedirs(os.path.join(self.tmp.name, 'proj2'))
+        with open(os.path.join(self.tmp.name, 'proj2', 'x'), 'w') as f:
+            f.write("secret")
+        calls = [
+            types.FunctionCall(name='get_file_content', args={'work_dir': '.', 'file_path': '../proj2/x'}),
+            types.FunctionCall(name='get_files_info', args={'work_dir': '.', 'dir': '../proj2'}),
+            types.FunctionCall(name='write_file', args={'work_dir': '.', 'file_path': '../proj2/pwn.txt', 'content': 'x'}),
+            types.FunctionCall(name='get_file_content', args={'work_dir': '../proj2', 'file_path': 'x'}),
+        ]
+        client = FakeStreamingClient([[make_chunk(*(types.Part(function_call=call) for call in calls))],
+                                      [make_chunk(types.Part(text="Done."))]])
+
+        async def scenario():
+            server = AgentServer(client, 'model', self.tmp.name)
+            run = await server.start({"prompt": "x", "workspace": "proj"})
+            await run.task
+            server.executor.shutdown()
+            return run
+
+        self.assertEqual(asyncio.run(scenario()).status, "done")
+        results = [part.function_response.response["result"] for part in client.requests[1][-1].parts]
+        self.assertEqual(len(results), 4)
+        for result in results:
+            self.assertTrue(result.startswith("Error:"), result)
+            self.assertNotIn("secret", result)
+        self.assertEqual(os.listdir(os.path.join(self.tmp.name, 'proj2')), ['x'])
+
+class TestBenchmark(unittest.TestCase):
+    def test_runs_scripted_trace_through_main(self):
+        import benchmark
+        report = benchmark.run_benchmark(n_files=5, runs=1)
+        run = report["runs"][0]
+        self.assertEqual(run["turns"], 7)
+        self.assertEqual(run["tool_calls"], 7)
+        self.assertGreater(run["bytes_sent"], 0)
+        self.assertLessEqual(run["model_seconds"] + run["tool_seconds"], run["wall_seconds"])
+        # The process-wide high-water mark is not a per-run metric
+        self.assertNotIn("peak_rss_kb", run)
+        self.assertNotIn("peak_rss_kb", report["median"])
+
+def make_turn(name, args, result):
+    return [
+        types.Content(role="model", parts=[types.Part(function_call=types.FunctionCall(name=name, args=args))]),
+        types.Content(role="user", parts=[types.Part(function_response=types.FunctionResponse(
+            name=name, response={"result": result}))]),
+    ]
+
+def result_of(content):
+    return content.parts[0].function_response.response["result"]
+
+class TestContextManager(unittest.TestCase):
+    def setUp(self):
+        read_a = {'work_dir': '.', 'file_path': 'a.py'}
+        self.messages = [types.Content(role="user", parts=[types.Part(text="refactor a.py")])]
+        self.messages += make_turn('get_file_content', read_a, "A" * 4000)
+        self.messages += make_turn('run_python_file', {'work_dir': '.', 'file_path': 'a.py'}, "line\n" * 1000)
+        self.messages += make_turn('get_file_content', read_a, "B" * 4000)
+        self.messages += make_turn('get_files_info', {'working_dir': '.'}, "C" * 4000)
+
+    def test_under_budget_is_untouched(self):
+        self.assertEqual(ContextManager(token_budget=100000).compact(self.messages), 0)
+        self.assertEqual(result_of(self.messages[2]), "A" * 4000)
+
+    def test_compacts_stale_results_only(self):
+        context = ContextManager(token_budget=1000, keep_recent_turns=2)
+        before = context.estimate(self.messages)
+
+        saved = context.compact(self.messages)
+
+        self.assertGreater(saved, 0)
+        self.assertEqual(context.estimate(self.messages), before - saved)
+        self.assertIn("Superseded: a.py", result_of(self.messages[2]))
+        self.assertIn("characters of this old result omitted", result_of(self.messages[4]))
+        # The last two turns are kept as they are
+        self.assertEqual(result_of(self.messages[6]), "B" * 4000)
+        self.assertEqual(result_of(self.messages[8]), "C" * 4000)
+
+    def test_reads_superseded_by_every_tool_touching_the_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            token = config.set_workspace_root(tmp)
+            try:
+                messages = [types.Content(role="user", parts=[types.Part(text="refactor")])]
+                for name in ('a.py', 'b.py', 'c.py', 'd.py'):
+                    messages += make_turn('get_file_content', {'work_dir': '.', 'file_path': name}, "A" * 4000)
+                # Resolved against the workspace, not the current directory of the process
+                messages += make_turn('write_file', {'work_dir': tmp, 'file_path': 'a.py', 'content': 'x'}, "ok")
+                messages += make_turn('get_files_content', {'work_dir': '.', 'files': [{'file_path': 'b.py'}]}, "ok")
+                messages += make_turn('apply_patch', {'work_dir': '.', 'patch': 'c.py'}, "ok")
+                messages += make_turn('get_file_content', {'work_dir': '.', 'file_path': 'x.py'}, "ok")
+                messages += make_turn('get_file_content', {'work_dir': '.', 'file_path': 'y.py'}, "ok")
+                ContextManager(token_budget=100, keep_recent_turns=2).compact(messages)
+            finally:
+                config._workspace_root.reset(token)
+        self.assertEqual([result_of(messages[i]) for i in (2, 4, 6)], [
+            "[Superseded: a.py was modified later]",
+            "[Superseded: b.py was read again later]",
+            "[Superseded: c.py was possibly modified later]",
+        ])
+        # d.py is read before apply_patch, which covers the whole work_dir
+        self.assertEqual(result_of(messages[8]), "[Superseded: d.py was possibly modified later]")
+
+class TestOutputBudget(unittest.TestCase):
+    def setUp(self):
+        self.source = "".join(
+            f"def function_{i}(value):\n    total = value * {i}\n    return total + {i}\n\n\n" for i in range(100)
+        )
+
+    def test_truncate_keeps_whole_lines_head_and_tail(self):
+        result = truncate(self.source, 300)
+        self.assertLessEqual(estimator.estimate(result), 300)
+        head, marker, tail = re.split(r"(\[\.\.\. \d+ lines .* omitted to fit the output budget \.\.\.\]\n)", result)
+        self.assertTrue(self.source.startswith(head))
+        self.assertTrue(self.source.endswith(tail))
+        # Functions are not cut in the middle
+        self.assertTrue(head.endswith("\n\n"))
+        self.assertTrue(tail.lstrip("\n").startswith("def "))
+
+    def test_truncate_single_huge_line(self):
+        result = truncate("x" * 50000, 100)
+        self.assertIn("characters omitted", result)
+        self.assertLessEqual(estimator.estimate(result), 100)
+
+    def test_turn_budget_is_shared(self):
+        traceback = "Traceback (most recent call last):\nValueError: boom\n"
+        results = fit_results([
+            ("get_file_content", "small"),
+            ("get_file_content", self.source),
+            ("run_python_file", "log line\n" * 3000 + traceback),
+        ], turn_tokens=2000)
+        self.assertEqual(results[0], ("get_file_content", "small"))
+        self.assertLessEqual(sum(estimator.estimate(result) for _, result in results), 2000)
+        self.assertTrue(results[2][1].endswith(traceback))
+
+    def test_estimator_calibrated_on_prompt_growth(self):
+        tokens = TokenEstimator()
+        tokens.calibrate(50, 500)  # Too small to tell
+        self.assertEqual(tokens.scale, 1.0)
+        tokens.calibrate(1000, 1500)
+        self.assertEqual(tokens.scale, 1.5)
+
+        context = ContextManager()
+        messages = [types.Content(role="user", parts=[types.Part(text="word " * 1000)])]
+        with patch('agent.context.estimator', tokens):
+            context.observe(messages[:0], 300)
+            context.observe(messages, 300 + 2000)
+        self.assertEqual(tokens.scale, 1.75)
+
 class TestRunPythonFile(unittest.TestCase):
-    # TODO: Implement tests for run_python_file
-    pass
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_script(self, source):
+        with open(os.path.join(self.work_dir, 'script.py'), 'w') as f:
+            f.write(source)
+
+    def test_stdout_and_stderr_in_print_order(self):
+        self.write_script("import sys\nprint('out 1')\nprint('err', file=sys.stderr)\nprint('out 2')\n")
+
+        result = run_python_file(self.work_dir, 'script.py')
+
+        self.assertEqual(result, "out 1\nerr\nout 2\n")
+
+    def test_large_output_keeps_head_and_tail(self):
+        self.write_script("for i in range(100000):\n    print(i)\n")
+
+        result = run_python_file(self.work_dir, 'script.py', max_output_bytes=1000)
+
+        self.assertTrue(result.startswith("0\n1\n2\n"))
+        self.assertTrue(result.endswith("99999\n"))
+        self.assertRegex(result, r"\[\.\.\.\d+ bytes of output dropped\.\.\.\]")
+        self.assertLess(len(result), 1100)
+
+    def test_timeout_returns_partial_output(self):
+        self.write_script("import time\nprint('started')\ntime.sleep(10)\n")
+
+        result = run_python_file(self.work_dir, 'script.py', timeout=1)
+
+        self.assertTrue(result.startswith("Error: Script execution timed out after 1 seconds"))
+        self.assertIn("started", result)
+
+    def test_non_zero_exit_code(self):
+        self.write_script("import sys\nsys.exit(3)\n")
+
+        result = run_python_file(self.work_dir, 'script.py')
+
+        self.assertEqual(result, "Error: Script exited with code 3\n")
+
+@unittest.skipUnless(hasattr(os, 'fork'), "the worker pool needs os.fork")
+class TestRunTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = self.tmp.name
+        self.write('lib/__init__.py', '')
+        self.write('lib/calc.py', 'def add(a, b):\n    return a + b\n')
+        self.write('test_calc.py', (
+            'import unittest\nfrom lib.calc import add\n\n'
+            'class TestAdd(unittest.TestCase):\n'
+            '    def test_add(self):\n        self.assertEqual(add(1, 2), 3)\n'
+            '    def test_wrong(self):\n        self.assertEqual(add(1, 1), 3)\n'
+        ))
+        self.write('test_other.py', 'import unittest\n\nclass TestOther(unittest.TestCase):\n    def test_ok(self):\n        pass\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, path, content):
+        os.makedirs(os.path.dirname(os.path.join(self.work_dir, path)), exist_ok=True)
+        with open(os.path.join(self.work_dir, path), 'w') as f:
+            f.write(content)
+
+    def test_summary_has_only_failing_tracebacks(self):
+        result = run_tests(self.work_dir, max_workers=2)
+        self.assertTrue(result.startswith("Tests failed: 1 failed, 2 passed, 0 skipped in 2 modules (2 shards"), result)
+        self.assertRegex(result, r"FAILED test_calc\S*TestAdd\S*test_wrong")
+        self.assertIn("AssertionError: 2 != 3", result)
+        self.assertNotIn("test_add", result)
+
+    def test_unchanged_passing_modules_are_skipped(self):
+        run_tests(self.work_dir)
+        result = run_tests(self.work_dir)
+        self.assertIn("1 failed, 1 passed", result)
+        self.assertIn("unchanged since their last passing run: test_other.py", result)
+
+        # Fixing a dependency of the failing module runs it again, then caches it
+        self.write('lib/calc.py', 'def add(a, b):\n    return 3\n')
+        self.assertTrue(run_tests(self.work_dir).startswith("Tests passed: 0 failed, 2 passed"))
+        self.assertIn("0 passed, 0 skipped in 0 modules", run_tests(self.work_dir))
+        self.assertIn("3 passed", run_tests(self.work_dir, use_cache=False))
+
+    def test_modules_that_cannot_be_loaded_are_reported_apart(self):
+        self.write('test_broken.py', 'import unittest\n1 / 0\n\nclass TestX(unittest.TestCase):\n    def test_a(self):\n        pass\n')
+        self.write('test_missing.py', 'import missing_module\n')
+        result_file = os.path.join(self.work_dir, 'results.json')
+        runner = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'functions', 'test_runner.py')
+        subprocess.run([sys.executable, runner, result_file, 'unittest', 'test_broken.TestX', 'test_missing',
+                        'test_other.TestOther'], cwd=self.work_dir, check=True, capture_output=True)
+        with open(result_file) as f:
+            results = json.load(f)
+        self.assertEqual((results["passed"], results["failed"]), (1, []))
+        self.assertEqual([test_id for test_id, _ in results["load_errors"]],
+                         ['test_broken.TestX', 'unittest.loader._FailedTest.test_missing'])
+
+        result = run_tests(self.work_dir, path='test_broken.py')
+        self.assertTrue(result.startswith("Tests failed: 0 failed, 0 passed, 0 skipped, 1 not loaded in 1 modules"), result)
+        self.assertIn("NOT LOADED test_broken", result)
+
+    def test_dependencies_follow_local_imports(self):
+        root = os.path.abspath(self.work_dir)
+        deps = dependencies(root, os.path.join(root, 'test_calc.py'))
+        self.assertEqual([os.path.relpath(d, root) for d in deps],
+                         [os.path.join('lib', '__init__.py'), os.path.join('lib', 'calc.py'), 'test_calc.py'])
+
+class TestWorkerPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = WorkerPool(size=1, preload=['json'])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = os.path.realpath(self.tmp.name)
+        self.script = os.path.join(self.work_dir, 'script.py')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_script(self, source, cli_args=None, timeout=30):
+        with open(self.script, 'w') as f:
+            f.write(source)
+        return self.pool.run(self.script, cli_args, self.work_dir, timeout, 16 * 1024)
+
+    def test_same_semantics_as_a_new_interpreter(self):
+        source = "import os, sys\nprint(__name__, sys.argv, os.getcwd() == sys.path[0])\n"
+
+        returncode, output = self.run_script(source, ['--flag', 'x'])
+
+        self.assertEqual(returncode, 0)
+        self.assertEqual(output, f"__main__ {[self.script, '--flag', 'x']} True\n")
+
+    def test_exit_code_and_traceback(self):
+        self.assertEqual(self.run_script("import sys\nsys.exit(4)\n"), (4, ""))
+
+        returncode, output = self.run_script("raise ValueError('boom')\n")
+
+        self.assertEqual(returncode, 1)
+        self.assertIn("ValueError: boom", output)
+
+    def test_interpreter_shutdown_runs(self):
+        source = ("import atexit, threading, time\n"
+                  "atexit.register(lambda: print('atexit ran'))\n"
+                  "def work():\n    time.sleep(0.2)\n    print('thread done')\n"
+                  "threading.Thread(target=work).start()\n"
+                  "f = open('out.txt', 'w')\nf.write('data')\n"
+                  "print('main done')\n")
+
+        self.assertEqual(self.run_script(source), (0, "main done\nthread done\natexit ran\n"))
+        with open(os.path.join(self.work_dir, 'out.txt')) as f:
+            self.assertEqual(f.read(), "data")
+
+    def test_timeout_kills_child_and_keeps_worker(self):
+        returncode, output = self.run_script("import time\nprint('started')\ntime.sleep(10)\n", timeout=1)
+
+        self.assertIsNone(returncode)
+        self.assertEqual(output, "started\n")
+        self.assertEqual(self.run_script("print('next')\n"), (0, "next\n"))
 
 class TestRunCommand(unittest.TestCase):
     # TODO: Implement tests for run_command